@@ -0,0 +1,74 @@
+"""Benchmark of the eager and chunked (dask) reading of the CRU files.
+
+Reads the time series of random land points with
+``climvis.core.get_cru_timeseries_batch``, once per mode, each mode in a
+fresh process so that the timings include opening the files and the peak
+memory (max RSS) is the one of that mode alone.
+
+Usage::
+
+    python benchmarks/read_cru.py [NPOINTS] [--chunks TIME,LAT,LON]
+
+with climvis installed (``pip install -e .[dask]``).
+
+The chunked modes are skipped if dask (or dask.distributed) is not
+installed.
+"""
+import sys
+import time
+import resource
+import subprocess
+import importlib.util
+import numpy as np
+
+MODES = ['eager', 'threads', 'processes', 'distributed']
+
+
+def run(mode, npoints, chunks):
+    """Read the points in one mode (in this process)."""
+    from climvis import cfg, core, grid
+
+    if mode != 'eager':
+        cfg.dask_chunks = dict(zip(['time', 'lat', 'lon'], chunks))
+        cfg.dask_scheduler = mode
+    index = grid.get_grid_index()
+    ilat, ilon = np.nonzero(index.mask)
+    sel = np.random.RandomState(0).choice(len(ilat), npoints)
+    lons, lats = index.lon[ilon[sel]], index.lat[ilat[sel]]
+
+    t0 = time.perf_counter()
+    ds = core.get_cru_timeseries_batch(lons, lats)
+    elapsed = time.perf_counter() - t0
+    assert ds.tmp.shape[1] == npoints
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print('{:12s} {:8.2f} s {:8.0f} MB'.format(mode, elapsed, rss))
+
+
+def main(args):
+    npoints, chunks = 1000, (120, 60, 60)
+    if '--chunks' in args[:-1]:
+        i = args.index('--chunks')
+        chunks = tuple(int(c) for c in args[i + 1].split(','))
+        args = args[:i] + args[i + 2:]
+    if args:
+        npoints = int(args[0])
+
+    print('{} points, chunks (time, lat, lon): {}'.format(npoints, chunks))
+    print('{:12s} {:>10s} {:>11s}'.format('mode', 'time', 'max RSS'))
+    for mode in MODES:
+        needs = {'eager': None, 'distributed': 'distributed'}.get(mode,
+                                                                 'dask')
+        if needs and importlib.util.find_spec(needs) is None:
+            print('{:12s} skipped ({} is not installed)'.format(mode, needs))
+            continue
+        subprocess.run([sys.executable, __file__, '--run', mode,
+                        str(npoints), ','.join(map(str, chunks))],
+                       check=True)
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['--run']:
+        run(sys.argv[2], int(sys.argv[3]),
+            tuple(int(c) for c in sys.argv[4].split(',')))
+    else:
+        main(sys.argv[1:])
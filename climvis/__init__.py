@@ -3,5 +3,28 @@
 # string is synchronised with `setup.py`, but for our purposes this is OK
 __version__ = '0.0.1'
 
-from climvis.core import write_html
-from climvis.core import haversine
\ No newline at end of file
+import importlib
+
+# the submodules, imported on first access (e.g. ``climvis.core``) so that
+# ``import climvis`` stays cheap
+SUBMODULES = ['acinn_archive', 'batch', 'cfg', 'cities', 'cli',
+              'climatology', 'core', 'dashboard', 'graphics', 'grid',
+              'plot_acinn', 'pool', 'products', 'read_acinn', 'relayout',
+              'reportcache', 'server', 'stats']
+
+__all__ = ['write_html', 'haversine'] + SUBMODULES
+
+
+def __getattr__(name):
+    """Import ``climvis.core`` (and its heavy dependencies) on first use."""
+    if name in ['write_html', 'haversine']:
+        from climvis import core
+        return getattr(core, name)
+    if name in SUBMODULES:
+        return importlib.import_module('climvis.' + name)
+    raise AttributeError('module {!r} has no attribute {!r}'.format(__name__,
+                                                                   name))
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
@@ -0,0 +1,210 @@
+"""Local archive of the ACINN observations.
+
+The ACINN server only offers the last 1, 3 or 7 days of data. The archive
+keeps everything it has seen, in one gzipped csv file per station and
+month (``cfg.acinn_archive_dir/STATION/YYYY-MM.csv.gz``), indexed by the
+``datumsec`` timestamp (ms since 1970, UTC). Records are only appended:
+a timestamp already in the archive is never overwritten.
+
+:py:func:`sync_stations` fetches the data since the last archived record
+and appends it. Reading the archive (see
+:py:meth:`climvis.read_acinn.AcinnData.get_archived_data`) needs no
+network access and covers any period.
+"""
+import os
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+from climvis import cfg, read_acinn
+
+
+def _to_ms(t):
+    """A time (str, datetime...) as ms since 1970. Naive times are UTC."""
+    return int(read_acinn._utc(t).value // 10**6)
+
+
+def _month(ms):
+    """The month ('YYYY-MM') of timestamps in ms since 1970."""
+    return pd.to_datetime(ms, unit='ms').strftime('%Y-%m')
+
+
+class AcinnArchive():
+    """A directory of archived ACINN observations."""
+
+    def __init__(self, directory):
+        """
+        Parameters
+        ----------
+        directory : str
+            where to store the data
+        """
+        self.directory = directory
+        self._lock = threading.Lock()
+
+    def _path(self, station, month):
+        return os.path.join(self.directory, station, month + '.csv.gz')
+
+    def months(self, station):
+        """The archived months ('YYYY-MM') of a station, oldest first."""
+        try:
+            files = os.listdir(os.path.join(self.directory, station))
+        except FileNotFoundError:
+            return []
+        return sorted(f[:-len('.csv.gz')] for f in files
+                      if f.endswith('.csv.gz'))
+
+    def _read_month(self, station, month):
+        path = self._path(station, month)
+        if not os.path.exists(path):
+            return pd.DataFrame(index=pd.Index([], dtype=np.int64,
+                                               name='datumsec'))
+        return pd.read_csv(path, index_col='datumsec')
+
+    def last_time(self, station):
+        """The timestamp (ms since 1970) of the last archived record of a
+        station, or None if there is none.
+        """
+        months = self.months(station)
+        if not months:
+            return None
+        return int(self._read_month(station, months[-1]).index.max())
+
+    def append(self, station, raw_data):
+        """Add the new records of a raw data dict to the archive.
+
+        Parameters
+        ----------
+        station : str
+            the station
+        raw_data : dict
+            the data as read from the server (see
+            :py:meth:`climvis.read_acinn.AcinnData.get_data`)
+
+        Returns
+        -------
+        the number of records added (the timestamps which were not
+        archived yet)
+        """
+        n = len(raw_data.get('datumsec', []))
+        if n == 0:
+            return 0
+        index = pd.Index(np.asarray(raw_data['datumsec'], dtype=np.int64),
+                         name='datumsec')
+        df = pd.DataFrame({k: np.asarray(v, dtype=float)
+                           for k, v in raw_data.items()
+                           if k != 'datumsec' and len(v) == n}, index=index)
+        df = df[~df.index.duplicated()]
+
+        added = 0
+        with self._lock:
+            for month, new in df.groupby(_month(df.index.values)):
+                old = self._read_month(station, month)
+                new = new[~new.index.isin(old.index)]
+                if new.empty:
+                    continue
+                merged = pd.concat([old, new], sort=False).sort_index()
+                path = self._path(station, month)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+                merged.to_csv(tmp_path, compression='gzip')
+                os.replace(tmp_path, path)
+                added += len(new)
+        return added
+
+    def read(self, station, start=None, end=None):
+        """The archived records of a station in a period.
+
+        Parameters
+        ----------
+        station : str
+            the station
+        start, end : str or datetime, optional
+            the first and last time (both included, naive times are UTC).
+            Default: the first and last records
+
+        Returns
+        -------
+        a raw data dict of arrays, like :py:attr:`AcinnData.raw_data`
+        (parameters without any data in the period are left out)
+        """
+        start = None if start is None else _to_ms(start)
+        end = None if end is None else _to_ms(end)
+        months = self.months(station)
+        if start is not None:
+            months = [m for m in months if m >= _month(start)]
+        if end is not None:
+            months = [m for m in months if m <= _month(end)]
+        frames = [self._read_month(station, m) for m in months]
+        df = pd.concat(frames, sort=False) if frames else pd.DataFrame()
+        if start is not None:
+            df = df[df.index >= start]
+        if end is not None:
+            df = df[df.index <= end]
+        if df.empty:
+            raise ValueError('No archived ACINN data for {} in this period. '
+                             'Try cruvis --sync first!'.format(station))
+        df = df.dropna(axis=1, how='all')
+        raw_data = {'datumsec': df.index.values.astype(float)}
+        raw_data.update({k: df[k].values for k in df.columns})
+        return raw_data
+
+    def sync(self, station, timeout=None, retries=None):
+        """Fetch the data since the last archived record of a station.
+
+        The shortest timespan (1, 3 or 7 days) covering the gap is
+        requested. Records older than 7 days can't be recovered.
+
+        Returns
+        -------
+        the number of records added
+        """
+        last = self.last_time(station)
+        span = 7
+        if last is not None:
+            gap = (time.time() - last / 1000) / 86400
+            span = min([t for t in [1, 3, 7] if t >= gap] or [7])
+        raw_data = read_acinn.get_cache().get(station, span,
+                                              timeout=timeout,
+                                              retries=retries)
+        return self.append(station, raw_data)
+
+
+def get_archive():
+    """The archive in ``cfg.acinn_archive_dir``."""
+    return AcinnArchive(cfg.acinn_archive_dir)
+
+
+def sync_stations(stations=None, max_workers=None, timeout=None,
+                  retries=None):
+    """Update the archive of several stations concurrently.
+
+    Parameters
+    ----------
+    stations : list of str, optional
+        the stations. Default: all of them (``read_acinn.STATIONS``)
+    max_workers : int, optional
+        the number of concurrent requests. Default: one per station
+    timeout, retries :
+        see :py:func:`climvis.read_acinn.http_request`
+
+    Returns
+    -------
+    a dict station: number of records added or, if the station could not
+    be read, the Exception
+    """
+    if stations is None:
+        stations = read_acinn.STATIONS
+    if max_workers is None:
+        max_workers = len(stations)
+    archive = get_archive()
+
+    def sync(station):
+        try:
+            return archive.sync(station, timeout=timeout, retries=retries)
+        except Exception as e:
+            return e
+
+    with ThreadPoolExecutor(max(max_workers, 1)) as executor:
+        return dict(zip(stations, executor.map(sync, stations)))
@@ -0,0 +1,141 @@
+"""Generate the html reports of many sites at once.
+
+The data of all sites is extracted with one batched read
+(:py:func:`climvis.core.get_cru_timeseries_batch`) and the reports are
+rendered in parallel by a pool of worker processes, which pay the import
+and setup costs only once. A failing site (e.g. over the ocean) is
+reported in the summary and does not stop the run.
+"""
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from climvis import core, grid
+
+
+def read_sites(path):
+    """Read a csv file of sites.
+
+    The file needs a header, with either the ``lon`` and ``lat`` columns
+    or a ``city`` column (cities are looked up with
+    :py:func:`climvis.core.city_coord`). Both can be mixed: the city is
+    used where lon or lat are empty. An optional ``name`` column names
+    the reports.
+
+    Returns
+    -------
+    a pd.DataFrame with the columns ``name``, ``lon``, ``lat`` and
+    ``error`` (the reason why the site can't be processed, or None)
+    """
+    sites = pd.read_csv(path, skipinitialspace=True)
+    sites.columns = [c.strip().lower() for c in sites.columns]
+    for c in ['lon', 'lat', 'city', 'name']:
+        if c not in sites:
+            sites[c] = None if c in ['city', 'name'] else np.nan
+    sites['error'] = None
+
+    for i, site in sites.iterrows():
+        if pd.notnull(site.lon) and pd.notnull(site.lat):
+            continue
+        if pd.isnull(site.city):
+            sites.loc[i, 'error'] = 'No location given'
+            continue
+        try:
+            lat, lon, _ = core.city_coord(site.city)
+            sites.loc[i, ['lon', 'lat']] = lon, lat
+        except NameError as e:
+            sites.loc[i, 'error'] = str(e)
+
+    sites['name'] = sites['name'].fillna(sites['city'])
+    return sites[['name', 'lon', 'lat', 'error']]
+
+
+def _dirname(i, name):
+    """Report directory of a site: its number and a sanitized name."""
+    dirname = '{:04d}'.format(i)
+    if isinstance(name, str) and re.sub(r'\W+', '', name):
+        dirname += '_' + re.sub(r'\W+', '_', name).strip('_')
+    return dirname
+
+
+def _render(lon, lat, directory, ds, zoom):
+    """Render one report, returning the path or the error message."""
+    try:
+        # the DataFrame is built here: its attributes wouldn't be pickled
+        df = core.site_dataframe(ds, 0)
+        return core.write_html(lon, lat, directory=directory, df=df,
+                               zoom=zoom), None
+    except Exception as e:
+        return None, str(e) or type(e).__name__
+
+
+def run_batch(sites, outdir, workers=None, zoom=None, chunksize=500):
+    """Write the html reports of a list of sites.
+
+    Parameters
+    ----------
+    sites : str or pd.DataFrame
+        the csv file of sites (see :py:func:`read_sites`), or its content
+    outdir : str
+        the directory where to write the reports (one subdirectory per
+        site) and the ``summary.csv`` file
+    workers : int, optional
+        the number of worker processes. 1 renders in this process.
+        Default: the number of CPUs
+    zoom : int, optional
+        the zoom level of the maps
+    chunksize : int
+        the number of sites extracted at once, to bound the memory usage
+
+    Returns
+    -------
+    a pd.DataFrame with the columns ``name``, ``lon``, ``lat``, ``path``
+    (to the report) and ``error`` (None if successful). It is also written
+    to ``outdir/summary.csv``.
+    """
+    if isinstance(sites, str):
+        sites = read_sites(sites)
+    sites = sites.reset_index(drop=True).copy()
+    sites['path'] = None
+    core.mkdir(outdir)
+
+    # ocean points are rejected without reading their data
+    todo = sites.error.isnull().values
+    valid = np.zeros(len(sites), dtype=bool)
+    if todo.any():
+        valid[todo] = grid.get_grid_index().is_valid(
+            sites.lon.values[todo], sites.lat.values[todo])
+    sites.loc[todo & ~valid, 'error'] = ('No data available over the '
+                                         'ocean. Try for different location!')
+
+    if workers is None:
+        workers = os.cpu_count()
+    executor = ProcessPoolExecutor(workers) if workers > 1 else None
+    try:
+        todo = np.nonzero(valid)[0]
+        for c0 in range(0, len(todo), chunksize):
+            chunk = todo[c0:c0+chunksize]
+            ds = core.get_cru_timeseries_batch(sites.lon.values[chunk],
+                                               sites.lat.values[chunk])
+            jobs = []
+            for j, i in enumerate(chunk):
+                site = sites.loc[i]
+                args = (site.lon, site.lat,
+                        os.path.join(outdir, _dirname(i, site['name'])),
+                        ds.isel(site=[j]), zoom)
+                if executor is None:
+                    jobs.append((i, _render(*args)))
+                else:
+                    jobs.append((i, executor.submit(_render, *args)))
+            for i, job in jobs:
+                if executor is not None:
+                    job = job.result()
+                sites.loc[i, ['path', 'error']] = job
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    summary = sites[['name', 'lon', 'lat', 'path', 'error']]
+    summary.to_csv(os.path.join(outdir, 'summary.csv'), index=False)
+    return summary
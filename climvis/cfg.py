@@ -1,5 +1,6 @@
 """This configuration module is a container for parameters and constants."""
 import os
+import sys
 import platform
 import configparser
 
@@ -27,13 +28,76 @@ def get_data_path():
     return config['PATH']['cru_dir']
 
 
-cru_dir = get_data_path()
-cru_tmp_file = cru_dir + 'cru_ts4.01.1901.2016.tmp.dat.nc'
-cru_pre_file = cru_dir + 'cru_ts4.01.1901.2016.pre.dat.nc'
-cru_topo_file = cru_dir + 'cru_cl1_topography.nc'
+# the CRU files, in cru_dir
+cru_files = {'cru_tmp_file': 'cru_ts4.01.1901.2016.tmp.dat.nc',
+             'cru_pre_file': 'cru_ts4.01.1901.2016.pre.dat.nc',
+             'cru_topo_file': 'cru_cl1_topography.nc',
+             # location-chunked copy of the three files above,
+             # see climvis.relayout
+             'cru_point_file': 'cru_ts4.01.1901.2016.point.nc',
+             }
+
+
+def __getattr__(name):
+    """Read the data path out of the .cruvis file on first use only.
+
+    This way, the commands which don't need the CRU data (and the users
+    who don't have it) don't need the .cruvis file.
+    """
+    if name == 'cru_dir':
+        value = get_data_path()
+    elif name in cru_files:
+        value = sys.modules[__name__].cru_dir + cru_files[name]
+    else:
+        raise AttributeError('module {!r} has no attribute {!r}'.format(
+                             __name__, name))
+    globals()[name] = value
+    return value
+
+
+# where climvis stores the products derived from the CRU files
+cache_dir = os.path.join(os.path.expanduser('~'), '.cruvis_cache')
 
 bdir = os.path.dirname(__file__)
 html_tpl = os.path.join(bdir, 'data', 'template.html')
 world_cities = os.path.join(bdir, 'data', 'world_cities.csv')
 
 default_zoom = 8
+
+# limits of the report cache (see climvis.reportcache)
+report_cache_max_bytes = 500 * 2**20
+report_cache_max_age = 30 * 24 * 3600  # seconds since last use
+
+# ACINN data server and request settings (see climvis.read_acinn)
+acinn_url = 'http://acinn.uibk.ac.at/'
+acinn_timeout = 10  # seconds, per attempt
+acinn_retries = 2
+acinn_backoff = 0.5  # seconds before the first retry, then doubled
+# directory of the on-disk ACINN cache (None: in memory only)
+acinn_cache_dir = None
+# delay between a measurement and its availability on the server (s)
+acinn_cache_lag = 60
+# directory of the local archive of ACINN data (see climvis.acinn_archive)
+acinn_archive_dir = os.path.join(cache_dir, 'acinn')
+
+# gridded climatology and trends (see climvis.products)
+products_file = os.path.join(cache_dir, 'cru_products.nc')
+products_max_bytes = 256 * 2**20  # memory budget of the computation
+
+# opt-in chunked reading of the CRU files with dask (see climvis.core).
+# None reads eagerly. The memory used at once is about the size of one
+# chunk times the number of workers, e.g. {'time': 120, 'lat': 60,
+# 'lon': 60}
+dask_chunks = None
+# 'threads', 'processes', 'synchronous' or 'distributed' (a local cluster)
+dask_scheduler = 'threads'
+dask_workers = None  # default: the number of CPUs
+# the memory cap (bytes, or a string like '2GB'; None: no cap). With
+# 'distributed' it is the limit of each worker, enforced by dask. With the
+# local schedulers it is the limit of all the workers together: nothing
+# enforces it while computing, instead chunk size x workers is checked
+# against it when the files are opened
+dask_memory_limit = '2GB'
+
+# maximum number of netCDF files kept open by climvis.pool
+dataset_pool_size = 8
@@ -0,0 +1,383 @@
+"""Index of the cities listed in ``data/world_cities.csv``.
+
+The table is parsed once per process into array columns, with a hash map
+from the (lower case) city names to their rows. The parsed columns are
+cached in ``cfg.cache_dir``, tied to the version of the csv file.
+"""
+import os
+import csv
+import numpy as np
+from scipy.spatial import cKDTree
+from climvis import cfg, grid, pool
+
+COLUMNS = ['country', 'name', 'lat', 'lon', 'elevation']
+EARTH_RADIUS = 6371000  # same as core.haversine
+
+
+def edit_distance(a, b, max_distance=None):
+    """Levenshtein distance between two strings.
+
+    If ``max_distance`` is given, the computation stops as soon as the
+    distance is known to be larger, and ``max_distance + 1`` is returned.
+    """
+    if len(a) < len(b):
+        a, b = b, a
+    if max_distance is not None and len(a) - len(b) > max_distance:
+        return max_distance + 1
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1,
+                               previous[j - 1] + (ca != cb)))
+        if max_distance is not None and min(current) > max_distance:
+            return max_distance + 1
+        previous = current
+    return previous[-1]
+
+
+def _trigrams(name):
+    """The set of character trigrams of a (padded) name."""
+    name = '  ' + name + ' '
+    return {name[i:i+3] for i in range(len(name) - 2)}
+
+
+class CityIndex():
+    """Array-backed table of cities with a name lookup."""
+
+    def __init__(self, country, name, lat, lon, elevation, stamp=''):
+        """
+        Parameters
+        ----------
+        country : array of str
+            the countries
+        name : array of str
+            the city names
+        lat : array of float
+            the latitudes
+        lon : array of float
+            the longitudes
+        elevation : array of float
+            the elevations
+        stamp : str
+            version stamp of the source file
+        """
+        self.country = np.asarray(country, dtype=str)
+        self.name = np.asarray(name, dtype=str)
+        self.lat = np.asarray(lat, dtype=float)
+        self.lon = np.asarray(lon, dtype=float)
+        self.elevation = np.asarray(elevation, dtype=float)
+        self.stamp = stamp
+
+        rows = {}
+        for i, n in enumerate(np.char.lower(self.name)):
+            if n:
+                rows.setdefault(n, []).append(i)
+        self._rows = {n: np.array(r) for n, r in rows.items()}
+        self._names = None
+        self._trigram_index = None
+        self._tree = None
+
+    def __len__(self):
+        return len(self.name)
+
+    @classmethod
+    def from_csv(cls, path):
+        """Read the cities out of a csv file like ``world_cities.csv``."""
+        with open(path, 'r') as f:
+            reader = csv.reader(f)
+            next(reader, None)
+            columns = list(zip(*reader))
+        return cls(*columns, stamp=pool.file_stamp(path))
+
+    @classmethod
+    def load(cls, path):
+        """Read an index written with :py:meth:`save`."""
+        with np.load(path) as f:
+            return cls(*[f[c] for c in COLUMNS], stamp=str(f['stamp']))
+
+    def save(self, path):
+        """Write the index to a .npz file."""
+        np.savez(path, stamp=self.stamp,
+                 **{c: getattr(self, c) for c in COLUMNS})
+
+    def lookup(self, city):
+        """Rows of the cities matching a name.
+
+        Parameters
+        ----------
+        city : str
+            the city name (case insensitive), optionally followed by the
+            country after a comma, e.g. ``'Paris,France'``
+
+        Returns
+        -------
+        an array of row indices (empty if the city is not listed)
+        """
+        name, _, country = city.partition(',')
+        rows = self._rows.get(name.strip().lower(), np.array([], dtype=int))
+        if country.strip():
+            is_country = (np.char.lower(self.country[rows]) ==
+                          country.strip().lower())
+            rows = rows[is_country]
+        return rows
+
+    def _build_search(self):
+        """Sorted names (for prefix search) and trigram index.
+
+        ``_names`` is set last: a concurrent search seeing it set finds
+        the other attributes too.
+        """
+        names = np.array(sorted(self._rows))
+        trigrams = {}
+        for i, n in enumerate(names):
+            for t in _trigrams(n):
+                trigrams.setdefault(t, []).append(i)
+        self._name_list = names.tolist()
+        self._trigram_index = {t: np.array(r)
+                               for t, r in trigrams.items()}
+        self._names = names
+
+    def autocomplete(self, prefix, limit=10):
+        """Rows of the cities whose name starts with ``prefix``.
+
+        Parameters
+        ----------
+        prefix : str
+            the beginning of the name (case insensitive)
+        limit : int
+            the maximum number of distinct names to return
+
+        Returns
+        -------
+        an array of row indices, sorted alphabetically by name
+        """
+        if self._names is None:
+            self._build_search()
+        prefix = prefix.strip().lower()
+        i0 = np.searchsorted(self._names, prefix, side='left')
+        i1 = np.searchsorted(self._names, prefix + '\uffff', side='left')
+        names = self._names[i0:min(i1, i0 + limit)]
+        return np.concatenate([self._rows[n] for n in names] +
+                              [np.array([], dtype=int)])
+
+    def search(self, query, limit=10, max_distance=2, candidates=30):
+        """Rows of the cities with names similar to ``query``.
+
+        The names sharing most trigrams with the query are ranked by their
+        edit distance to it.
+
+        Parameters
+        ----------
+        query : str
+            the (possibly misspelled) city name, case insensitive
+        limit : int
+            the maximum number of distinct names to return
+        max_distance : int
+            the maximum edit distance between query and name
+        candidates : int
+            the number of names (with most trigrams in common with the
+            query) to compute the edit distance for
+
+        Returns
+        -------
+        an array of row indices, best matches first
+        """
+        if self._names is None:
+            self._build_search()
+        query = query.strip().lower()
+        hits = [self._trigram_index[t] for t in _trigrams(query)
+                if t in self._trigram_index]
+        if not query or not hits:
+            return np.array([], dtype=int)
+        counts = np.bincount(np.concatenate(hits),
+                             minlength=len(self._names))
+        candidates = min(candidates, len(counts))
+        best = np.argpartition(-counts, candidates - 1)[:candidates]
+        best = best[counts[best] > 0]
+        ranked = []
+        for i in best:
+            name = self._name_list[i]
+            d = edit_distance(query, name, max_distance=max_distance)
+            if d <= max_distance:
+                ranked.append((d, -counts[i], name))
+        ranked = sorted(ranked)[:limit]
+        return np.concatenate([self._rows[n] for _, _, n in ranked] +
+                              [np.array([], dtype=int)])
+
+    def _distances(self, rows, lon, lat):
+        """Great circle distances (m) between the cities and a point."""
+        # core imports this module
+        from climvis.core import haversine
+        return np.atleast_1d(haversine(lon, lat, self.lon[rows],
+                                       self.lat[rows]))
+
+    def nearest(self, lon, lat, k=1):
+        """Rows of the ``k`` cities closest to a point.
+
+        The cities are indexed in a KD-tree of 3D unit vectors, so that the
+        queries stay fast for large tables.
+
+        Parameters
+        ----------
+        lon : float
+            the longitude
+        lat : float
+            the latitude
+        k : int
+            the number of cities
+
+        Returns
+        -------
+        the array of row indices and the array of their distances (m) to
+        the point, closest first
+        """
+        if self._tree is None:
+            self._tree = cKDTree(grid.lonlat_to_xyz(self.lon, self.lat))
+        k = min(k, len(self))
+        _, rows = self._tree.query(grid.lonlat_to_xyz(lon, lat)[0], k=k)
+        rows = np.atleast_1d(rows)
+        return rows, self._distances(rows, lon, lat)
+
+    def within(self, lon, lat, radius):
+        """Rows of the cities within a given distance of a point.
+
+        Parameters
+        ----------
+        lon : float
+            the longitude
+        lat : float
+            the latitude
+        radius : float
+            the great circle distance (m)
+
+        Returns
+        -------
+        the array of row indices and the array of their distances (m) to
+        the point, closest first
+        """
+        if self._tree is None:
+            self._tree = cKDTree(grid.lonlat_to_xyz(self.lon, self.lat))
+        # great circle distance to chord length on the unit sphere
+        angle = min(radius / EARTH_RADIUS, np.pi)
+        chord = 2 * np.sin(angle / 2)
+        rows = self._tree.query_ball_point(grid.lonlat_to_xyz(lon, lat)[0],
+                                           chord * (1 + 1e-9))
+        rows = np.array(rows, dtype=int)
+        dis = self._distances(rows, lon, lat)
+        order = np.argsort(dis, kind='stable')
+        rows, dis = rows[order], dis[order]
+        return rows[dis <= radius], dis[dis <= radius]
+
+    def records(self, rows):
+        """The cities of the given rows, as a list of dicts."""
+        return [{c: getattr(self, c)[i].item() for c in COLUMNS}
+                for i in rows]
+
+
+_index = None
+
+
+def get_city_index():
+    """The (cached) index of ``cfg.world_cities``."""
+    global _index
+
+    stamp = pool.file_stamp(cfg.world_cities)
+    if _index is not None and _index.stamp == stamp:
+        return _index
+
+    fname = os.path.splitext(os.path.basename(cfg.world_cities))[0]
+    fpath = os.path.join(cfg.cache_dir, fname + '.npz')
+    if os.path.exists(fpath):
+        _index = CityIndex.load(fpath)
+        if _index.stamp == stamp:
+            return _index
+
+    _index = CityIndex.from_csv(cfg.world_cities)
+    os.makedirs(cfg.cache_dir, exist_ok=True)
+    tmp_path = fpath + '.{}.npz'.format(os.getpid())
+    _index.save(tmp_path)
+    os.replace(tmp_path, fpath)
+    return _index
+
+
+def find_cities(city):
+    """All the cities matching a name.
+
+    Parameters
+    ----------
+    city : str
+        the city name (case insensitive), optionally followed by the
+        country after a comma, e.g. ``'Paris,France'``
+
+    Returns
+    -------
+    a list of dicts with the keys ``country``, ``name``, ``lat``, ``lon``
+    and ``elevation``
+    """
+    index = get_city_index()
+    return index.records(index.lookup(city))
+
+
+def autocomplete(prefix, limit=10):
+    """The cities whose name starts with ``prefix``.
+
+    See :py:meth:`CityIndex.autocomplete`.
+
+    Returns
+    -------
+    a list of dicts like :py:func:`find_cities`
+    """
+    index = get_city_index()
+    return index.records(index.autocomplete(prefix, limit=limit))
+
+
+def search_cities(query, limit=10, max_distance=2):
+    """The cities with a name similar to ``query``, best matches first.
+
+    Use this when :py:func:`find_cities` doesn't find anything (e.g. typos).
+    See :py:meth:`CityIndex.search`.
+
+    Returns
+    -------
+    a list of dicts like :py:func:`find_cities`
+    """
+    index = get_city_index()
+    return index.records(index.search(query, limit=limit,
+                                      max_distance=max_distance))
+
+
+def nearest_cities(lon, lat, k=1):
+    """The ``k`` cities closest to a point, closest first.
+
+    See :py:meth:`CityIndex.nearest`.
+
+    Returns
+    -------
+    a list of dicts like :py:func:`find_cities`, with the additional key
+    ``distance`` (m)
+    """
+    index = get_city_index()
+    rows, dis = index.nearest(lon, lat, k=k)
+    found = index.records(rows)
+    for f, d in zip(found, dis):
+        f['distance'] = float(d)
+    return found
+
+
+def cities_within(lon, lat, radius):
+    """The cities within ``radius`` meters of a point, closest first.
+
+    See :py:meth:`CityIndex.within`.
+
+    Returns
+    -------
+    a list of dicts like :py:func:`find_cities`, with the additional key
+    ``distance`` (m)
+    """
+    index = get_city_index()
+    rows, dis = index.within(lon, lat, radius)
+    found = index.records(rows)
+    for f, d in zip(found, dis):
+        f['distance'] = float(d)
+    return found
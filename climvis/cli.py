@@ -1,7 +1,7 @@
+import os
 import webbrowser
 import sys
 import climvis
-from climvis import plot_acinn
 
 HELP = """cruvis: CRU data visualization at a selected location.
 
@@ -17,6 +17,39 @@ Usage:
                                stations: innsbruck, sattelberg, obergurgl,
                                          ellboegen
                                durations: 1, 3, 7 (days)
+   -m, --meteo [station] --start [DATE] --end [DATE]:
+                           plot any period (e.g. --start 2018-12-01) out of
+                           the local archive of ACINN data instead
+   --sync [station ...]  : add the latest ACINN data of the stations
+                           (default: all) to the local archive. Run it at
+                           least once a week to keep the archive complete
+   --dashboard [station ...] --duration [D] --out [PATH] --sidecar:
+                           plot several ACINN stations (default: all) in
+                           one html file (default duration: 7 days). With
+                           --sidecar, the data goes to json files next to
+                           the html file, reloaded by the page every 10
+                           minutes. Add --data-only to only rewrite them
+   --batch [CSV] --out [DIR] --workers [N]:
+                           write the reports of all the sites listed in a
+                           csv file (columns: name, lon, lat or city) to
+                           DIR, using N worker processes (default: all
+                           CPUs). A summary is written to DIR/summary.csv
+   serve [--port PORT] [--workers N]:
+                           run a local HTTP server (default port: 8000)
+                           answering /loc?lon=LON&lat=LAT, /city?name=CITY
+                           and /meteo?station=STATION&duration=DAYS
+   --convert [PATH]      : rewrite the CRU files into a file optimised for
+                           point time series reads (default path: next to
+                           the CRU files). It is used automatically when
+                           it exists at the default path
+   --products [DIR]      : compute the gridded 1981-2010 climatology and
+                           temperature trend and draw them as maps in DIR
+                           (default: cache directory)
+   --cache               : with --loc and --city, write the report into the
+                           shared report cache (reusing the figures of
+                           earlier reports of the same grid point) instead
+                           of a new temporary directory. Cached reports
+                           are deleted when the cache is full
    --no-browser          : the default behavior is to open a browser with the
                            newly generated visualisation. Set to ignore
                            and print the path to the html file instead
@@ -32,6 +65,10 @@ def cruvis_io(args):
         output of sys.args[1:]
     """
 
+    # The climvis modules are imported in the branches which need them:
+    # they pull in heavy libraries (xarray, matplotlib, bokeh...) which
+    # would slow down the simple commands like --help.
+
     if len(args) == 0:
         print(HELP)
     elif args[0] in ['-h', '--help']:
@@ -44,8 +81,9 @@ def cruvis_io(args):
         if len(args) < 3:
             print('cruvis --loc needs lon and lat parameters!')
         elif len(args) >= 3:
+            from climvis import core
             lon, lat = float(args[1]), float(args[2])
-            html_path = climvis.write_html(lon, lat)
+            html_path = core.write_html(lon, lat, cache='--cache' in args)
             if '--no-browser' in args:
                 print('File successfully generated at: ' + html_path)
             else:
@@ -54,24 +92,106 @@ def cruvis_io(args):
         if len(args) < 2:
             print('cruvis --city needs a city name!')
         elif len(args) >= 2:
-                lat, lon, elevation = climvis.core.city_coord(args[1])
-                html_path = climvis.write_html(lon, lat)
+                from climvis import core
+                lat, lon, elevation = core.city_coord(args[1])
+                html_path = core.write_html(
+                    lon, lat, cache='--cache' in args)
                 if '--no-browser' in args:
                     print('File successfully generated at: ' + html_path)
                 else:
                     webbrowser.get().open_new_tab(html_path)
     elif args[0] in ['-m', '--meteo']:
-        if len(args) < 3:
+        start = end = None
+        if '--start' in args[:-1]:
+            start = args[args.index('--start') + 1]
+        if '--end' in args[:-1]:
+            end = args[args.index('--end') + 1]
+        archived = start is not None or end is not None
+        if len(args) < 3 and not (archived and len(args) >= 2):
             print('cruvis --meteo needs station and duration parameters')
             return
-        if len(args) >= 3:
-            station = args[1]
-            duration = args[2]
-            html_path = plot_acinn.plot_both(station, duration)
-            if '--no-browser' in args:
-                print('File successfully generated at: ' + html_path)
+        station = args[1]
+        duration = None if archived else args[2]
+        from climvis import plot_acinn
+        html_path = plot_acinn.plot_both(station, duration, start=start,
+                                         end=end)
+        if '--no-browser' in args:
+            print('File successfully generated at: ' + html_path)
+        else:
+            webbrowser.get().open_new_tab(html_path)
+    elif args[0] == '--sync':
+        stations = [a for a in args[1:] if not a.startswith('-')] or None
+        from climvis import acinn_archive
+        added = acinn_archive.sync_stations(stations)
+        for station, n in added.items():
+            if isinstance(n, Exception):
+                print('{}: could not be updated ({})'.format(station, n))
             else:
-                webbrowser.get().open_new_tab(html_path)
+                print('{}: {} new records'.format(station, n))
+    elif args[0] == '--dashboard':
+        options = ['--duration', '--out']
+        stations = [a for i, a in enumerate(args[1:], 1)
+                    if not a.startswith('-') and args[i-1] not in options]
+        duration = 7
+        if '--duration' in args[:-1]:
+            duration = int(args[args.index('--duration') + 1])
+        outpath = None
+        if '--out' in args[:-1]:
+            outpath = args[args.index('--out') + 1]
+        from climvis import dashboard
+        if '--data-only' in args:
+            if outpath is None:
+                print('cruvis --dashboard --data-only needs the html file '
+                      '(--out)!')
+                return
+            directory = os.path.dirname(os.path.abspath(outpath))
+            dashboard.write_dashboard_data(directory, stations or None,
+                                           duration=duration)
+            print('Data successfully updated in: ' + directory)
+            return
+        html_path = dashboard.plot_dashboard(stations or None,
+                                             duration=duration,
+                                             outpath=outpath,
+                                             sidecar='--sidecar' in args)
+        if '--no-browser' in args:
+            print('File successfully generated at: ' + html_path)
+        else:
+            webbrowser.get().open_new_tab(html_path)
+    elif args[0] == '--batch':
+        if len(args) < 2 or '--out' not in args[:-1]:
+            print('cruvis --batch needs a csv file and an output directory '
+                  '(--out)!')
+            return
+        outdir = args[args.index('--out') + 1]
+        workers = None
+        if '--workers' in args[:-1]:
+            workers = int(args[args.index('--workers') + 1])
+        from climvis import batch
+        summary = batch.run_batch(args[1], outdir, workers=workers)
+        failed = summary.error.notnull()
+        print('{} reports generated in {}, {} failed (see {})'.format(
+              (~failed).sum(), outdir, failed.sum(),
+              os.path.join(outdir, 'summary.csv')))
+    elif args[0] == 'serve':
+        from climvis import server
+        port, workers = 8000, None
+        if '--port' in args[:-1]:
+            port = int(args[args.index('--port') + 1])
+        if '--workers' in args[:-1]:
+            workers = int(args[args.index('--workers') + 1])
+        server.serve(port=port, workers=workers)
+    elif args[0] == '--convert':
+        path = args[1] if len(args) >= 2 else None
+        print('Converting the CRU files, this might take a while...')
+        from climvis import relayout
+        path = relayout.convert_cru(path)
+        print('File successfully generated at: ' + path)
+    elif args[0] == '--products':
+        directory = args[1] if len(args) >= 2 else None
+        print('Computing the gridded products, this might take a while...')
+        from climvis import products
+        for path in products.render_maps(directory):
+            print('Map successfully generated at: ' + path)
     else:
         print('cruvis: command not understood. '
               'Type "cruvis --help" for usage options.')
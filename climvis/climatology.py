@@ -0,0 +1,176 @@
+"""Memory-mapped cache of the 1981-2010 monthly climatology of the CRU data.
+
+Most reports only need the monthly means of tmp and pre over the reference
+period (the annual cycle). These are computed once for the whole grid and
+stored as NumPy arrays in ``cfg.cache_dir``:
+
+- ``climatology.npy``: (lat, lon, 12, 2) monthly means of tmp and pre
+- ``annual.npy``: (lat, lon, 2) annual means of tmp and pre
+- ``climatology.npz``: the grid coordinates, the elevation and the version
+  stamp of the CRU files the cache was built from
+
+A query then reads 24 floats out of the memory-mapped arrays instead of the
+full time series.
+
+The cache is standalone: :py:func:`climvis.core.write_html` doesn't use
+it, because the time line figure of a report needs the full time series
+anyway, and the annual cycle is cheap to compute out of it. The cache is
+for the callers which only need the climatology (e.g. tables or maps of
+many sites), see :py:func:`get_climatology` and
+:py:func:`get_annual_means`.
+"""
+import os
+import numpy as np
+import pandas as pd
+from climvis import cfg, core, grid, pool, stats
+
+PERIOD = stats.PERIOD
+
+_cache = None
+
+
+def _source_stamp():
+    return pool.file_stamp(cfg.cru_tmp_file, cfg.cru_pre_file,
+                           cfg.cru_topo_file)
+
+
+def _paths(directory):
+    return (os.path.join(directory, 'climatology.npy'),
+            os.path.join(directory, 'annual.npy'),
+            os.path.join(directory, 'climatology.npz'))
+
+
+def build_climatology_cache(directory=None, slab=10):
+    """Compute the climatology of the whole grid and write it to disk.
+
+    The CRU files are read in slabs of latitude rows to keep the memory
+    usage bounded.
+
+    Parameters
+    ----------
+    directory : str, optional
+        where to write the cache. Default: ``cfg.cache_dir``
+    slab : int
+        the number of latitude rows to process at once
+    """
+    if directory is None:
+        directory = cfg.cache_dir
+    os.makedirs(directory, exist_ok=True)
+    clim_path, annual_path, meta_path = _paths(directory)
+    stamp = _source_stamp()
+
+    tmp = pool.open_dataset(cfg.cru_tmp_file).tmp
+    pre = pool.open_dataset(cfg.cru_pre_file).pre
+    tmp = tmp.sel(time=slice(*PERIOD)).transpose('time', 'lat', 'lon')
+    pre = pre.sel(time=slice(*PERIOD)).transpose('time', 'lat', 'lon')
+    time = tmp.time.values
+    ny, nx = tmp.shape[1:]
+
+    # the arrays are written to temporary files and moved in place, so
+    # that processes which have the old ones memory-mapped keep reading
+    # them. The meta file is written last: a cache without it (or with an
+    # outdated stamp) is incomplete
+    if os.path.exists(meta_path):
+        os.remove(meta_path)
+    suffix = '.{}.tmp.npy'.format(os.getpid())
+    clim_tmp, annual_tmp = clim_path + suffix, annual_path + suffix
+    clim = np.lib.format.open_memmap(clim_tmp, mode='w+', dtype=np.float32,
+                                     shape=(ny, nx, 12, 2))
+    for j0 in range(0, ny, slab):
+        rows = slice(j0, min(j0 + slab, ny))
+        for i, da in enumerate([tmp, pre]):
+            data = stats.climatology(da[:, rows, :].values, time, PERIOD)
+            clim[rows, :, :, i] = np.moveaxis(data, 0, -1)
+    clim.flush()
+    np.save(annual_tmp, clim.mean(axis=2))
+    del clim
+    os.replace(clim_tmp, clim_path)
+    os.replace(annual_tmp, annual_path)
+
+    topo = pool.open_dataset(cfg.cru_topo_file).z
+    z = topo.sel(lat=tmp.lat, lon=tmp.lon, method='nearest')
+    meta_tmp = meta_path + '.{}.tmp.npz'.format(os.getpid())
+    np.savez(meta_tmp, lon=tmp.lon.values, lat=tmp.lat.values,
+             z=z.transpose('lat', 'lon').values, stamp=stamp)
+    os.replace(meta_tmp, meta_path)
+
+
+class _ClimatologyCache():
+    """The memory-mapped arrays of a cache directory."""
+
+    def __init__(self, directory):
+        clim_path, annual_path, meta_path = _paths(directory)
+        with np.load(meta_path) as f:
+            self.stamp = str(f['stamp'])
+            self.z = f['z']
+            lon, lat = f['lon'], f['lat']
+        self.clim = np.load(clim_path, mmap_mode='r')
+        self.annual = np.load(annual_path, mmap_mode='r')
+        self.index = grid.GridIndex(lon, lat,
+                                    np.isfinite(self.annual).all(axis=-1))
+
+
+def _get_cache():
+    """The (memory-mapped) cache, (re)built if needed."""
+    global _cache
+
+    stamp = _source_stamp()
+    if _cache is not None and _cache.stamp == stamp:
+        return _cache
+
+    meta_path = _paths(cfg.cache_dir)[2]
+    if os.path.exists(meta_path):
+        _cache = _ClimatologyCache(cfg.cache_dir)
+        if _cache.stamp == stamp:
+            return _cache
+
+    _cache = None
+    build_climatology_cache()
+    _cache = _ClimatologyCache(cfg.cache_dir)
+    return _cache
+
+
+def get_climatology(lon, lat):
+    """The 1981-2010 monthly climatology at the nearest grid point.
+
+    Parameters
+    ----------
+    lon : float
+        the longitude
+    lat : float
+        the latitude
+
+    Returns
+    -------
+    a pd.DataFrame with the months (1-12) as index and the ``tmp``, ``pre``,
+    ``lon`` and ``lat`` columns, with the additional attributes
+    ``grid_point_elevation`` and ``distance_to_grid_point``. It can be
+    given to :py:func:`climvis.graphics.plot_annual_cycle`.
+    """
+    cache = _get_cache()
+    ilat, ilon = cache.index.cell(lon, lat)
+    ilat, ilon = ilat[0], ilon[0]
+    glon, glat = cache.index.lon[ilon], cache.index.lat[ilat]
+    clim = np.asarray(cache.clim[ilat, ilon], dtype=float)
+    df = pd.DataFrame({'lat': glat, 'lon': glon,
+                       'tmp': clim[:, 0], 'pre': clim[:, 1]},
+                      index=pd.Index(np.arange(1, 13), name='month'))
+    df.grid_point_elevation = float(cache.z[ilat, ilon])
+    df.distance_to_grid_point = float(core.haversine(lon, lat, glon, glat))
+    return df
+
+
+def get_annual_means(lon, lat):
+    """The 1981-2010 annual mean temperature and precipitation at the
+    nearest grid point(s).
+
+    Returns
+    -------
+    the temperature (degC) and precipitation (mm mth-1), scalars or arrays
+    """
+    cache = _get_cache()
+    ilat, ilon = cache.index.cell(lon, lat)
+    annual = np.asarray(cache.annual[ilat, ilon], dtype=float)
+    if np.isscalar(lon):
+        return annual[0, 0], annual[0, 1]
+    return annual[:, 0], annual[:, 1]
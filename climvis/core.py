@@ -4,9 +4,16 @@ from tempfile import mkdtemp
 import shutil
 import xarray as xr
 import numpy as np
-import csv
+import pandas as pd
+from matplotlib.path import Path
 from motionless import DecoratedMap, LatLonMarker
-from climvis import cfg, graphics
+from climvis import (cfg, cities, graphics, grid, pool, relayout,
+                     reportcache)
+try:
+    import dask
+    import dask.utils
+except ImportError:
+    dask = None
 
 GOOGLE_API_KEY = 'xxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxx'
 
@@ -48,6 +55,242 @@ def haversine(lon1, lat1, lon2, lat2):
     return c * 6371000  # Radius of earth in meters
 
 
+def _read_cells(da, ilat, ilon):
+    """Read the time series of several grid cells out of a 3D variable.
+
+    The cells are read row by row (one outer-indexed read per latitude),
+    which avoids loading the full lat x lon box spanned by the points.
+
+    Parameters
+    ----------
+    da : xr.DataArray
+        the (time, lat, lon) variable to read from
+    ilat : array of int
+        the latitude indices of the cells
+    ilon : array of int
+        the longitude indices of the cells
+
+    Returns
+    -------
+    a (time, cell) np.ndarray
+    """
+    da = da.transpose('time', 'lat', 'lon')
+    out = np.empty((da.shape[0], len(ilat)), dtype=da.dtype)
+    for row in np.unique(ilat):
+        is_row = ilat == row
+        out[:, is_row] = da.isel(lat=row, lon=ilon[is_row]).values
+    return out
+
+
+def _nearest_cells(ds, lons, lats):
+    """Indices of the nearest grid points of ``ds`` for arrays of points."""
+    # the nearest lookup would silently pick an edge of the grid
+    lons, lats = np.asarray(lons, dtype=float), np.asarray(lats, dtype=float)
+    valid = (np.isfinite(lons) & np.isfinite(lats) & (np.abs(lats) <= 90) &
+             (lons >= -180) & (lons <= 360))
+    if not valid.all():
+        i = np.argmin(valid)
+        raise ValueError('Invalid location: lon={}, lat={}'.format(lons[i],
+                                                                   lats[i]))
+    ilon = ds.indexes['lon'].get_indexer(lons, method='nearest')
+    ilat = ds.indexes['lat'].get_indexer(lats, method='nearest')
+    return ilat, ilon
+
+
+def _cru_files():
+    """The files to read tmp, pre and the topography from.
+
+    The location-chunked file written by
+    :py:func:`climvis.relayout.convert_cru` is preferred when it is up to
+    date.
+    """
+    if relayout.is_current():
+        return (cfg.cru_point_file, ) * 3
+    return cfg.cru_tmp_file, cfg.cru_pre_file, cfg.cru_topo_file
+
+
+def _open_cru(path):
+    """Open a CRU file out of the pool, chunked if ``cfg.dask_chunks`` is
+    set.
+    """
+    if cfg.dask_chunks is None:
+        return pool.open_dataset(path)
+    if dask is None:
+        raise ImportError('cfg.dask_chunks needs dask: pip install '
+                          '"dask[array]"')
+    ds = pool.open_dataset(path, chunks=dict(cfg.dask_chunks))
+    chunks = [np.prod(v.data.chunksize) * v.dtype.itemsize
+              for v in ds.data_vars.values() if v.chunks is not None]
+    _check_memory(max(chunks, default=0))
+    return ds
+
+
+def _check_memory(chunk_bytes):
+    """Reject the chunks which don't fit in ``cfg.dask_memory_limit``.
+
+    The 'distributed' workers enforce the limit themselves (per worker).
+    The local schedulers don't: each of their workers holds about one
+    chunk at a time, so the chunk size times the number of workers must
+    be below the limit.
+    """
+    if cfg.dask_scheduler == 'distributed' or cfg.dask_memory_limit is None:
+        return
+    limit = cfg.dask_memory_limit
+    if isinstance(limit, str):
+        limit = dask.utils.parse_bytes(limit)
+    workers = 1
+    if cfg.dask_scheduler != 'synchronous':
+        workers = cfg.dask_workers or os.cpu_count()
+    if chunk_bytes * workers > limit:
+        raise ValueError('Chunks of {} bytes on {} workers exceed '
+                         'cfg.dask_memory_limit ({}): use smaller '
+                         'cfg.dask_chunks or fewer cfg.dask_workers'.format(
+                             chunk_bytes, workers, cfg.dask_memory_limit))
+
+
+_client = None
+
+
+def _scheduler():
+    """The scheduler arguments of ``dask.compute`` (``cfg.dask_scheduler``).
+
+    The local cluster of the 'distributed' scheduler is started on first
+    use and kept for the following computations.
+    """
+    global _client
+    if cfg.dask_scheduler == 'distributed':
+        if _client is None:
+            from dask.distributed import Client, LocalCluster
+            _client = Client(LocalCluster(n_workers=cfg.dask_workers,
+                                          memory_limit=cfg.dask_memory_limit))
+        return {'scheduler': _client}
+    if cfg.dask_scheduler not in ['threads', 'processes', 'synchronous']:
+        raise ValueError('Unknown dask scheduler: {}'.format(
+                         cfg.dask_scheduler))
+    return {'scheduler': cfg.dask_scheduler,
+            'num_workers': cfg.dask_workers}
+
+
+def _compute(*arrays):
+    """Compute the dask arrays among ``arrays`` in one go (other arrays
+    are returned as they are).
+    """
+    if dask is None or not any(dask.is_dask_collection(a) for a in arrays):
+        return arrays
+    return dask.compute(*arrays, **_scheduler())
+
+
+def _extract_cells(path, var, lons, lats):
+    """Time series of the nearest grid points of a variable in a file.
+
+    In chunked mode (``cfg.dask_chunks``) the data is a lazy dask array,
+    see :py:func:`_compute`.
+
+    Returns
+    -------
+    the (time, point) data, the time coordinate, and the longitudes and
+    latitudes of the selected grid points
+    """
+    ds = _open_cru(path)
+    ilat, ilon = _nearest_cells(ds, lons, lats)
+    # one read per unique grid cell
+    nlon = ds.sizes['lon']
+    cells, inverse = np.unique(ilat * nlon + ilon, return_inverse=True)
+    clat, clon = np.divmod(cells, nlon)
+    da = ds[var]
+    if da.chunks is None:
+        data = _read_cells(da, clat, clon)
+    else:
+        data = da.isel(lat=xr.DataArray(clat, dims='cell'),
+                       lon=xr.DataArray(clon, dims='cell'))
+        data = data.transpose('time', 'cell').data
+    return (data[:, inverse], ds.time.values, ds.lon.values[ilon],
+            ds.lat.values[ilat])
+
+
+def get_cru_timeseries_batch(lons, lats):
+    """Read the climate time series of many locations at once.
+
+    All points are matched to their nearest grid point in one vectorized
+    lookup and each distinct grid cell is read only once, so that the cost
+    scales with the number of unique cells rather than with the number
+    of points.
+
+    With ``cfg.dask_chunks`` set, the files are read chunk by chunk by the
+    dask scheduler of ``cfg.dask_scheduler``, on all cores.
+
+    Parameters
+    ----------
+    lons : array_like
+        the longitudes
+    lats : array_like
+        the latitudes (same shape as ``lons``)
+
+    Returns
+    -------
+    a xr.Dataset with a ``site`` dimension, containing the variables ``tmp``
+    and ``pre`` (time, site), ``grid_point_elevation`` and
+    ``distance_to_grid_point`` (site). The coordinates ``lon`` and ``lat``
+    are the ones of the selected grid points, ``query_lon`` and
+    ``query_lat`` the ones of the requested locations.
+    """
+
+    lons = np.atleast_1d(np.asarray(lons, dtype=float))
+    lats = np.atleast_1d(np.asarray(lats, dtype=float))
+    if lons.shape != lats.shape or lons.ndim != 1:
+        raise ValueError('lons and lats must be 1D arrays of the same size')
+
+    tmp_file, pre_file, topo_file = _cru_files()
+    tmp, time, grid_lon, grid_lat = _extract_cells(tmp_file, 'tmp',
+                                                   lons, lats)
+    pre, _, _, _ = _extract_cells(pre_file, 'pre', lons, lats)
+    tmp, pre = _compute(tmp, pre)
+    ds = pool.open_dataset(topo_file)
+    ilat, ilon = _nearest_cells(ds, lons, lats)
+    z = ds.z.transpose('lat', 'lon').values[ilat, ilon]
+
+    out = xr.Dataset({'tmp': (('time', 'site'), tmp),
+                      'pre': (('time', 'site'), pre),
+                      'grid_point_elevation': ('site', z.astype(float)),
+                      'distance_to_grid_point': ('site',
+                                                 haversine(lons, lats,
+                                                           grid_lon,
+                                                           grid_lat)),
+                      },
+                     coords={'time': time,
+                             'site': np.arange(len(lons)),
+                             'lon': ('site', grid_lon),
+                             'lat': ('site', grid_lat),
+                             'query_lon': ('site', lons),
+                             'query_lat': ('site', lats),
+                             })
+    return out
+
+
+def site_dataframe(ds, site):
+    """Extract the data of one site out of a batch dataset.
+
+    Parameters
+    ----------
+    ds : xr.Dataset
+        the output of :py:func:`get_cru_timeseries_batch`
+    site : int
+        the site to extract
+
+    Returns
+    -------
+    a pd.DataFrame like the one returned by :py:func:`get_cru_timeseries`
+    """
+
+    s = ds.isel(site=site)
+    df = pd.DataFrame({'lat': float(s.lat), 'lon': float(s.lon),
+                       'tmp': s.tmp.values, 'pre': s.pre.values},
+                      index=s.time.to_index())
+    df.grid_point_elevation = float(s.grid_point_elevation)
+    df.distance_to_grid_point = float(s.distance_to_grid_point)
+    return df
+
+
 def get_cru_timeseries(lon, lat):
     """Read the climate time series out of the netcdf files.
 
@@ -64,19 +307,122 @@ def get_cru_timeseries(lon, lat):
     ``distance_to_grid_point``.
     """
 
-    with xr.open_dataset(cfg.cru_tmp_file) as ds:
-        tmp_ts = ds.tmp.sel(lon=lon, lat=lat, method='nearest')
-        df = tmp_ts.to_dataframe()
-    with xr.open_dataset(cfg.cru_pre_file) as ds:
-        pre_ts = ds.pre.sel(lon=lon, lat=lat, method='nearest')
-        df['pre'] = pre_ts.to_series()
-    with xr.open_dataset(cfg.cru_topo_file) as ds:
-        z = float(ds.z.sel(lon=lon, lat=lat, method='nearest'))
+    ds = get_cru_timeseries_batch([lon], [lat])
+    return site_dataframe(ds, 0)
+
+
+def region_mask(lon, lat, box=None, polygon=None):
+    """The grid points inside a lon/lat box or polygon.
+
+    Parameters
+    ----------
+    lon : array
+        the longitudes of the grid
+    lat : array
+        the latitudes of the grid
+    box : (float, float, float, float), optional
+        the region as (lon_min, lat_min, lon_max, lat_max), edges included.
+        A box with lon_min > lon_max crosses the antimeridian, e.g.
+        (170, -20, -170, 0)
+    polygon : array_like, optional
+        the region as a (n, 2) sequence of (lon, lat) vertices
+
+    Returns
+    -------
+    a (lat, lon) array of bool
+    """
+    if (box is None) == (polygon is None):
+        raise ValueError('Give either a box or a polygon')
+    glon, glat = np.meshgrid(lon, lat)
+    if box is not None:
+        lon0, lat0, lon1, lat1 = box
+        if lon0 <= lon1:
+            in_lon = (glon >= lon0) & (glon <= lon1)
+        else:
+            in_lon = (glon >= lon0) | (glon <= lon1)
+        return in_lon & (glat >= lat0) & (glat <= lat1)
+    points = np.stack([glon.ravel(), glat.ravel()], axis=-1)
+    inside = Path(np.asarray(polygon, dtype=float)).contains_points(points)
+    return inside.reshape(glon.shape)
+
+
+def _region_mean(da, rows, cols, weights, slab):
+    """Weighted spatial means of a (time, lat, lon) variable, read in time
+    slabs. Missing values are left out of the mean.
+    """
+    da = da.transpose('time', 'lat', 'lon')
+    out = np.empty(da.shape[0])
+    for t0 in range(0, da.shape[0], slab):
+        data, = _compute(da[t0:t0+slab, rows, cols].data)
+        valid = np.isfinite(data)
+        w = np.where(valid, weights, 0)
+        with np.errstate(invalid='ignore'):
+            out[t0:t0+slab] = (np.where(valid, data, 0) * w).sum(
+                axis=(1, 2)) / w.sum(axis=(1, 2))
+    return out
+
+
+def get_cru_regional_timeseries(box=None, polygon=None, slab=120):
+    """Area-weighted mean climate time series of a region.
+
+    The grid points inside the region are weighted by the cosine of their
+    latitude (their area). The data is read in slabs of ``slab`` time steps
+    of the smallest lat/lon window around the region, so that the memory
+    usage stays bounded for large regions.
+
+    Parameters
+    ----------
+    box : (float, float, float, float), optional
+        the region as (lon_min, lat_min, lon_max, lat_max)
+    polygon : array_like, optional
+        the region as a (n, 2) sequence of (lon, lat) vertices (e.g. a
+        catchment outline)
+    slab : int
+        the number of time steps read at once
 
-    df.grid_point_elevation = z
-    df.distance_to_grid_point = haversine(lon, lat,
-                                          float(pre_ts.lon),
-                                          float(pre_ts.lat))
+    Returns
+    -------
+    a pd.DataFrame like the one returned by :py:func:`get_cru_timeseries`,
+    which can be given to :py:mod:`climvis.graphics` and
+    :py:func:`write_html`. ``lon`` and ``lat`` are the centre of the
+    region, ``grid_point_elevation`` its mean elevation, and the
+    attributes ``region`` and ``n_grid_points`` describe it.
+    """
+    tmp_file, pre_file, topo_file = _cru_files()
+    ds = _open_cru(tmp_file)
+    mask = region_mask(ds.lon.values, ds.lat.values, box=box,
+                       polygon=polygon)
+    mask &= grid.get_grid_index().mask
+    if not mask.any():
+        raise ValueError('No data available in this region. '
+                         'Try for different location!')
+    ilat, ilon = np.nonzero(mask)
+    rows = slice(ilat.min(), ilat.max() + 1)
+    cols = slice(ilon.min(), ilon.max() + 1)
+    lat = ds.lat.values[rows]
+    weights = mask[rows, cols] * np.cos(np.deg2rad(lat))[:, None]
+
+    tmp = _region_mean(ds.tmp, rows, cols, weights, slab)
+    pre = _region_mean(_open_cru(pre_file).pre, rows, cols, weights, slab)
+    z = pool.open_dataset(topo_file).z.transpose('lat', 'lon')
+    z = z.values[rows, cols]
+    wz = np.where(np.isfinite(z), weights, 0)
+
+    glon, glat = np.meshgrid(np.deg2rad(ds.lon.values[cols]), lat)
+    # mean of the longitudes on the circle, for regions across the
+    # antimeridian
+    clon = np.rad2deg(np.arctan2((np.sin(glon) * weights).sum(),
+                                 (np.cos(glon) * weights).sum()))
+    df = pd.DataFrame({'lat': (glat * weights).sum() / weights.sum(),
+                       'lon': clon, 'tmp': tmp, 'pre': pre},
+                      index=ds.time.to_index())
+    df.grid_point_elevation = float(np.nansum(z * wz) / wz.sum())
+    df.distance_to_grid_point = 0.
+    if box is not None:
+        df.region = 'box ({}, {}, {}, {})'.format(*box)
+    else:
+        df.region = 'polygon of {} vertices'.format(len(polygon))
+    df.n_grid_points = int(mask.sum())
     return df
 
 
@@ -87,7 +433,10 @@ def city_coord(city):
     ---------------
 
     city: string
-        name of city information should be retrieved for
+        name of city information should be retrieved for. The country can
+        be given after a comma to pick between cities with the same name,
+        e.g. 'Paris,France'. Otherwise the last listed city is returned
+        (see :py:func:`climvis.cities.find_cities` for all matches).
 
 
     Returns:
@@ -95,27 +444,17 @@ def city_coord(city):
 
     latitude, longitude and elevation of the city entered
     """
-    cities = []
-
-    with open(cfg.world_cities, 'r') as f:
-        reader = csv.reader(f)
-        next(reader, None)
-        for row in reader:
-            cities.append({'country': row[0], 'name': row[1].lower(),
-                           'lat': float(row[2]), 'lon': float(row[3]),
-                           'elevation': float(row[4])})
-
-    for loc in cities:
-        if loc['name'] == city.lower():
-            lat = loc['lat']
-            lon = loc['lon']
-            elevation = loc['elevation']
-
-    try:
-        return lat, lon, elevation
-    except UnboundLocalError:
-        raise NameError('Location not listed. Please check spelling '
-                        'or try again for nearest bigger city!')
+    index = cities.get_city_index()
+    rows = index.lookup(city)
+    if len(rows) == 0:
+        msg = ('Location not listed. Please check spelling '
+               'or try again for nearest bigger city!')
+        similar = index.name[index.search(city.partition(',')[0], limit=3)]
+        if len(similar) > 0:
+            msg += ' Did you mean: {}?'.format(', '.join(np.unique(similar)))
+        raise NameError(msg)
+    i = rows[-1]
+    return float(index.lat[i]), float(index.lon[i]), float(index.elevation[i])
 
 
 def get_googlemap_url(lon, lat, zoom=10):
@@ -148,45 +487,132 @@ def mkdir(path, reset=False):
     return path
 
 
-def write_html(lon, lat, directory=None, zoom=None):
+def _replace_file(write, path):
+    """Write a file with ``write(tmp_path)`` and move it to ``path``.
 
-    # Set defaults
-    if directory is None:
-        directory = mkdtemp()
+    Readers (e.g. other processes sharing the report cache) never see
+    a partially written file.
+    """
+    tmp_path = '{}.{}.tmp{}'.format(path, os.getpid(),
+                                    os.path.splitext(path)[1])
+    write(tmp_path)
+    os.replace(tmp_path, path)
+
+
+def write_html(lon, lat, directory=None, zoom=None, snap=False, df=None,
+               cache=False):
+    """Create the html report for a location.
+
+    Parameters
+    ----------
+    lon : float
+        the longitude
+    lat : float
+        the latitude
+    directory : str, optional
+        where to write the report. Default: the report cache if ``cache``
+        is set, a new temporary directory otherwise
+    zoom : int, optional
+        the zoom level of the map. Default: ``cfg.default_zoom``
+    snap : bool
+        if the location has no data (e.g. over the ocean), use the nearest
+        grid point with valid data instead of raising an error
+    df : pd.DataFrame, optional
+        the data to plot, if it was already extracted (e.g. with
+        :py:func:`get_cru_timeseries_batch` and :py:func:`site_dataframe`,
+        or the mean of a region with
+        :py:func:`get_cru_regional_timeseries`). Default: read it out of
+        the CRU files
+    cache : bool
+        if no directory is given, write the report into the shared report
+        cache and reuse the figures of earlier reports of the same grid
+        point (see :py:mod:`climvis.reportcache`). Cached reports may be
+        evicted later. Regional reports are never cached
+
+    Returns
+    -------
+    the path to the html file
+    """
 
+    # Set defaults
     if zoom is None:
         zoom = cfg.default_zoom
 
+    data_lon, data_lat = lon, lat
+    if df is None:
+        # Reject locations without data before reading anything
+        index = grid.get_grid_index()
+        if not index.is_valid(lon, lat):
+            if not snap:
+                raise ValueError('No data available over the ocean. '
+                                 'Try for different location!')
+            data_lon, data_lat = index.nearest_valid(lon, lat)
+        ilat, ilon = index.cell(data_lon, data_lat)
+        grid_lon, grid_lat = index.lon[ilon[0]], index.lat[ilat[0]]
+    else:
+        grid_lon, grid_lat = df.lon.iloc[0], df.lat.iloc[0]
+
     # Info string
     lonlat_str = '({:.3f}E, {:.3f}N)'.format(abs(lon), abs(lat))
     if lon < 0:
         lonlat_str = lonlat_str.replace('E', 'W')
     if lat < 0:
         lonlat_str = lonlat_str.replace('N', 'S')
+    region = getattr(df, 'region', None)
+    if region is not None:
+        lonlat_str = '{}, centre {}'.format(region, lonlat_str)
+
+    outname = 'index.html'
+    reports = None
+    if directory is None and cache and region is None:
+        reports = reportcache.get_report_cache()
+        key = reports.key(grid_lon, grid_lat, zoom)
+        directory = reports.entry(key)
+        # one page per (displayed) location, the figures are shared
+        outname = 'index_{:.3f}_{:.3f}.html'.format(lon, lat)
+        if os.path.exists(os.path.join(directory, outname)):
+            reports.touch(key)
+            return os.path.join(directory, outname)
+    elif directory is None:
+        directory = mkdtemp()
 
     mkdir(directory)
 
     # Make the plot
     png = os.path.join(directory, 'annual_cycle.png')
     png2 = os.path.join(directory, 'time_line.png')
-    df = get_cru_timeseries(lon, lat)
-
-    # Check for NaNs in DataFrame
-    if not df.isnull().values.any():
-        graphics.plot_annual_cycle(df, filepath=png)
-        graphics.plot_time_line(df, filepath=png2)
-        outpath = os.path.join(directory, 'index.html')
-        with open(cfg.html_tpl, 'r') as infile:
-            lines = infile.readlines()
-            out = []
-            url = get_googlemap_url(lon, lat, zoom=zoom)
-            for txt in lines:
-                txt = txt.replace('[LONLAT]', lonlat_str)
-                txt = txt.replace('[IMGURL]', url)
-                out.append(txt)
-            with open(outpath, 'w') as outfile:
+    rendered = (reports is not None and os.path.exists(png) and
+                os.path.exists(png2))
+    if not rendered:
+        if df is None:
+            df = get_cru_timeseries(data_lon, data_lat)
+        # Check for NaNs in DataFrame
+        if df.isnull().values.any():
+            raise ValueError('No data available over the ocean. '
+                             'Try for different location!')
+        renderer = graphics.get_renderer()
+        _replace_file(lambda p: renderer.annual_cycle(df, filepath=p), png)
+        _replace_file(lambda p: renderer.time_series(df, filepath=p), png2)
+
+    outpath = os.path.join(directory, outname)
+    with open(cfg.html_tpl, 'r') as infile:
+        lines = infile.readlines()
+        out = []
+        url = get_googlemap_url(lon, lat, zoom=zoom)
+        city = cities.nearest_cities(lon, lat)[0]
+        city_str = '{} ({}), {:.0f} km away'.format(
+            city['name'], city['country'], city['distance'] / 1000)
+        for txt in lines:
+            txt = txt.replace('[LONLAT]', lonlat_str)
+            txt = txt.replace('[CITY]', city_str)
+            txt = txt.replace('[IMGURL]', url)
+            out.append(txt)
+
+        def write(path):
+            with open(path, 'w') as outfile:
                 outfile.writelines(out)
-        return outpath
-    else:
-        raise ValueError('No data available over the ocean. '
-                         'Try for different location!')
+        _replace_file(write, outpath)
+
+    if reports is not None and not rendered:
+        reports.evict()
+    return outpath
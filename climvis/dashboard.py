@@ -0,0 +1,224 @@
+"""A single html document with the meteo data of several ACINN stations.
+
+Each station gets one row of figures (temperature, precipitation, wind)
+drawn from one ColumnDataSource, so that its data is serialized once. The
+time axes of all the figures are linked.
+
+With ``sidecar=True`` the data is not inlined in the html: it is written
+to one json file per station next to it, which the page loads (and
+reloads periodically) with an ``AjaxDataSource``. Refreshing a wall
+display then only needs :py:func:`write_dashboard_data`, not a new
+document. The page must be served over HTTP for the browser to load the
+json files (e.g. ``python -m http.server`` in the output directory).
+"""
+import os
+import json
+from tempfile import mkdtemp
+import numpy as np
+import pandas as pd
+from bokeh.plotting import figure, save
+from bokeh.models import (AjaxDataSource, ColumnDataSource,
+                          DatetimeTickFormatter)
+from bokeh.layouts import gridplot
+from bokeh.resources import CDN
+from climvis import read_acinn
+
+# the columns of the data source of a station
+COLUMNS = ['time', 'tl', 'tp', 'rr', 'crm', 'ff']
+
+
+def _read_stations(stations, duration=7, start=None, end=None):
+    """The converted AcinnData of the stations (or the Exception)."""
+    if start is None and end is None:
+        out = read_acinn.fetch_stations(stations, timespan=duration)
+    else:
+        out = {}
+        for station in stations:
+            out[station] = read_acinn.AcinnData(None, station)
+            try:
+                out[station].get_archived_data(start, end)
+            except Exception as e:
+                out[station] = e
+    for data in out.values():
+        if not isinstance(data, Exception):
+            data.conv_raw()
+            data.conv_date()
+            data.conv_units()
+            data.make_dict()
+    return out
+
+
+def station_columns(acdat, freq=None):
+    """The data source columns of a station.
+
+    Parameters
+    ----------
+    acdat : AcinnData
+        the converted data (see plot_acinn.read_conv_data)
+    freq : str, optional
+        plot aggregates (e.g. 'h' or 'D') instead of the 10 min values,
+        see :py:func:`climvis.read_acinn.resample`
+
+    Returns
+    -------
+    a dict of arrays: the time (ms since 1970, UTC), the temperature and
+    dewpoint (tl, tp), the precipitation rate and accumulated
+    precipitation (rr, crm) and the wind speed (ff)
+    """
+    df = pd.DataFrame({k: getattr(acdat, k)
+                       for k in ['tl', 'tp', 'rr', 'rm', 'ff']},
+                      index=acdat.timeutc)
+    if freq is not None:
+        df = read_acinn.resample(df, freq)
+    columns = {k: df[k].values for k in ['tl', 'tp', 'rr', 'ff']}
+    columns['time'] = df.index.values.astype('datetime64[ms]').astype(float)
+    columns['crm'] = np.nancumsum(df.rm.values)
+    if 'rr' not in acdat.keys:
+        columns['crm'][:] = np.nan
+    return columns
+
+
+def _to_json(columns):
+    """The columns as json (NaN as null)."""
+    return json.dumps({k: np.where(np.isnan(v), None, v).tolist()
+                       for k, v in columns.items()})
+
+
+def write_dashboard_data(directory, stations=None, duration=7, start=None,
+                         end=None, freq=None):
+    """Write the sidecar json files of a dashboard.
+
+    Parameters
+    ----------
+    directory : str
+        the directory of the dashboard
+    stations, duration, start, end, freq :
+        see :py:func:`plot_dashboard`
+
+    Returns
+    -------
+    a dict station: path to the json file or, if the station could not be
+    read, the Exception
+    """
+    if stations is None:
+        stations = read_acinn.STATIONS
+    os.makedirs(directory, exist_ok=True)
+    out = {}
+    for station, data in _read_stations(stations, duration, start,
+                                        end).items():
+        if isinstance(data, Exception):
+            out[station] = data
+            continue
+        path = os.path.join(directory, station + '.json')
+        tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+        with open(tmp_path, 'w') as f:
+            f.write(_to_json(station_columns(data, freq=freq)))
+        os.replace(tmp_path, path)
+        out[station] = path
+    return out
+
+
+def _figure(title, x_range, plot_width):
+    p = figure(x_axis_type="datetime", title=title, x_range=x_range,
+               plot_width=plot_width, plot_height=300)
+    p.grid.grid_line_alpha = 0.3
+    p.xaxis.formatter = DatetimeTickFormatter(
+            hours=["%d %B %Y"],
+            days=["%d %B %Y"],
+            months=["%d %B %Y"],
+            years=["%d %B %Y"],
+            )
+    p.xaxis.major_label_orientation = np.pi/4
+    return p
+
+
+def plot_dashboard(stations=None, duration=7, start=None, end=None,
+                   freq=None, outpath=None, sidecar=False,
+                   polling_interval=600, plot_width=500):
+    """Plot the meteo data of several stations in one html file.
+
+    Parameters
+    ----------
+    stations : list of str, optional
+        the stations. Default: all of them (``read_acinn.STATIONS``)
+    duration : int
+        1, 3 or 7 (days) of data from the ACINN server
+    start, end : str or datetime, optional
+        any period out of the local archive instead (see
+        :py:func:`climvis.plot_acinn.read_conv_data`)
+    freq : str, optional
+        plot aggregates (e.g. 'h' or 'D') instead of the 10 min values
+    outpath : str, optional
+        the html file. Default: dashboard.html in a new temporary
+        directory
+    sidecar : bool
+        write the data to json files next to the html file (see
+        :py:func:`write_dashboard_data`) instead of inlining it
+    polling_interval : float
+        with sidecar: how often (s) the page reloads the json files
+    plot_width : int
+        the width of each figure (pixels)
+
+    Returns
+    -------
+    the path to the html file
+    """
+    if stations is None:
+        stations = read_acinn.STATIONS
+    if outpath is None:
+        outpath = os.path.join(mkdtemp(), 'dashboard.html')
+    directory = os.path.dirname(os.path.abspath(outpath))
+
+    if sidecar:
+        paths = write_dashboard_data(directory, stations, duration=duration,
+                                     start=start, end=end, freq=freq)
+        stations = [s for s in stations
+                    if not isinstance(paths[s], Exception)]
+    else:
+        data = _read_stations(stations, duration, start, end)
+        stations = [s for s in stations
+                    if not isinstance(data[s], Exception)]
+    if not stations:
+        raise ValueError('None of the stations could be read')
+
+    rows = []
+    x_range = None
+    for station in stations:
+        if sidecar:
+            source = AjaxDataSource(data_url=station + '.json',
+                                    method='GET', mode='replace',
+                                    polling_interval=int(polling_interval *
+                                                         1000),
+                                    data={k: [] for k in COLUMNS})
+        else:
+            source = ColumnDataSource(station_columns(data[station],
+                                                      freq=freq))
+        name = station.capitalize()
+
+        p1 = _figure(name + ": Temperature, Dewpoint", x_range, plot_width)
+        # all the figures share the range of the first one
+        x_range = p1.x_range
+        p1.yaxis.axis_label = 'Temperature [°C]'
+        p1.line('time', 'tl', source=source, color='red',
+                legend_label='Temperature')
+        p1.line('time', 'tp', source=source, color='green',
+                legend_label='Dewpoint')
+
+        p2 = _figure(name + ": Precipitation", x_range, plot_width)
+        p2.yaxis.axis_label = 'Precipitation [mm]'
+        p2.line('time', 'crm', source=source, color='blue',
+                legend_label='Cumulated precipitation [mm]')
+        p2.vbar(x='time', top='rr', source=source, width=0.9, alpha=0.5,
+                legend_label='Precipitationrate [mm/h]')
+
+        p3 = _figure(name + ": Wind", x_range, plot_width)
+        p3.yaxis.axis_label = 'Windspeed [m/s]'
+        p3.line('time', 'ff', source=source, color='black')
+
+        for p in [p1, p2]:
+            p.legend.location = "top_left"
+        rows.append([p1, p2, p3])
+
+    save(gridplot(rows), filename=outpath, title='ACINN stations',
+         resources=CDN)
+    return outpath
@@ -1,13 +1,27 @@
+import numpy as np
+import pandas as pd
 import matplotlib.pyplot as plt
-from scipy import stats
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from scipy import stats as sstats
+from climvis import stats
+
+MONTHS = list('JFMAMJJASOND')
+ANNUAL_CYCLE_TITLE = ('Climate diagram at location ({}\u00b0,'
+                      ' {}\u00b0)\nElevation: {} m a.s.l')
+TIME_LINE_TITLE = ('Temperature time series at location ({}\u00b0, '
+                   '{}\u00b0)\nElevation: {} m a.s.l')
 
 
 def plot_annual_cycle(df, filepath=None):
 
     z = df.grid_point_elevation
-    df = df.loc['1981':'2010']
-    df = df.groupby(df.index.month).mean()
-    df.index = list('JFMAMJJASOND')
+    # monthly climatologies (see climvis.climatology) are used as they are
+    if isinstance(df.index, pd.DatetimeIndex):
+        df = df.loc['1981':'2010']
+        df = df.groupby(df.index.month).mean()
+    # not in place: the frame may be the caller's (e.g. a climatology)
+    df = df.set_axis(MONTHS)
 
     f, ax = plt.subplots(figsize=(6, 4))
 
@@ -19,9 +33,7 @@ def plot_annual_cycle(df, filepath=None):
     df['tmp'].plot(ax=ax, color='C3', label='Temperature')
     ax.set_ylabel('Temperature (\u00b0C)', color='C3')
     ax.tick_params('y', colors='C3')
-    title = 'Climate diagram at location ({}\u00b0,' \
-            ' {}\u00b0)\nElevation: {} m a.s.l'
-    plt.title(title.format(df.lon[0], df.lat[0], int(z)),
+    plt.title(ANNUAL_CYCLE_TITLE.format(df.lon[0], df.lat[0], int(z)),
               loc='left')
     plt.tight_layout()
 
@@ -40,7 +52,7 @@ def plot_time_line(df, filepath=None):
 
     years = dfy.index
     temp_slope, temp_intercept, temp_rvalue,\
-        temp_pvalue, temp_stderr = stats.linregress(years, dfy['tmp'])
+        temp_pvalue, temp_stderr = sstats.linregress(years, dfy['tmp'])
 
     f, ax = plt.subplots(figsize=(6, 4))
 
@@ -50,9 +62,8 @@ def plot_time_line(df, filepath=None):
 
     ax.set_xlabel('Year')
     ax.set_ylabel('Temperature (\u00b0C)')
-    title = ('Temperature time series at location ({}\u00b0, '
-             '{}\u00b0)\nElevation: {} m a.s.l')
-    plt.title(title.format(df.lon[0], df.lat[0], int(z)), loc='left')
+    plt.title(TIME_LINE_TITLE.format(df.lon[0], df.lat[0], int(z)),
+              loc='left')
     plt.legend(loc='best')
 
     if filepath is not None:
@@ -60,3 +71,132 @@ def plot_time_line(df, filepath=None):
         plt.close()
 
     return f
+
+
+class FigureRenderer():
+    """Renders the figures of many sites, reusing the same figures.
+
+    The figures (axes, labels) are built once with the Agg backend,
+    without pyplot. Each call only updates the data, the title and the
+    axis limits before saving (the constrained layout adapts to the new
+    tick labels when drawing), which is much cheaper than
+    :py:func:`plot_annual_cycle` and :py:func:`plot_time_line` in loops.
+    A renderer is not thread safe.
+    """
+
+    def __init__(self, dpi=150):
+        """
+        Parameters
+        ----------
+        dpi : int
+            the resolution of the saved figures
+        """
+        self.dpi = dpi
+
+        # annual cycle: precipitation bars and temperature line
+        self.cycle = Figure(figsize=(6, 4), constrained_layout=True)
+        FigureCanvasAgg(self.cycle)
+        ax = self.cycle.add_subplot(111)
+        x = np.arange(12)
+        self._bars = ax.bar(x, np.ones(12), width=0.5, color='C0',
+                            label='Precipitation')
+        ax.set_xticks(x)
+        ax.set_xticklabels(MONTHS)
+        ax.set_xlim(-0.5, 11.5)
+        ax.set_ylabel('Precipitation (mm mth$^{-1}$)', color='C0')
+        ax.tick_params('y', colors='C0')
+        ax.set_xlabel('Month')
+        self._pre_ax = ax
+        ax = ax.twinx()
+        self._tmp_line, = ax.plot(x, np.zeros(12), color='C3',
+                                  label='Temperature')
+        ax.set_ylabel('Temperature (\u00b0C)', color='C3')
+        ax.tick_params('y', colors='C3')
+        self._tmp_ax = ax
+        self._cycle_title = ax.set_title(
+            ANNUAL_CYCLE_TITLE.format(0.0, 0.0, 0), loc='left')
+
+        # time line: annual means and trend
+        self.time_line = Figure(figsize=(6, 4), constrained_layout=True)
+        FigureCanvasAgg(self.time_line)
+        ax = self.time_line.add_subplot(111)
+        self._mean_line, = ax.plot([], [], 'b', label='annual mean')
+        self._trend_line, = ax.plot([], [], 'r', label='linear trend')
+        ax.set_xlabel('Year')
+        ax.set_ylabel('Temperature (\u00b0C)')
+        self._line_title = ax.set_title(
+            TIME_LINE_TITLE.format(0.0, 0.0, 0), loc='left')
+        ax.legend(loc='best')
+        self._line_ax = ax
+
+    def annual_cycle(self, df, filepath=None):
+        """Update the annual cycle figure with the data of a site.
+
+        Parameters
+        ----------
+        df : pd.DataFrame
+            like for :py:func:`plot_annual_cycle`
+        filepath : str, optional
+            where to save the figure
+
+        Returns
+        -------
+        the (reused) figure
+        """
+        z = df.grid_point_elevation
+        lon, lat = df.lon.iloc[0], df.lat.iloc[0]
+        clim = df[['tmp', 'pre']].values
+        if isinstance(df.index, pd.DatetimeIndex):
+            clim = stats.climatology(clim, df.index.values)
+        for bar, h in zip(self._bars, clim[:, 1]):
+            bar.set_height(h)
+        self._tmp_line.set_ydata(clim[:, 0])
+        self._cycle_title.set_text(ANNUAL_CYCLE_TITLE.format(lon, lat,
+                                                             int(z)))
+        for ax in [self._pre_ax, self._tmp_ax]:
+            ax.relim()
+            ax.autoscale_view(scalex=False)
+        if filepath is not None:
+            self.cycle.savefig(filepath, dpi=self.dpi)
+        return self.cycle
+
+    def time_series(self, df, filepath=None):
+        """Update the time line figure with the data of a site.
+
+        Only the complete years are shown.
+
+        Parameters
+        ----------
+        df : pd.DataFrame
+            like for :py:func:`plot_time_line`
+        filepath : str, optional
+            where to save the figure
+
+        Returns
+        -------
+        the (reused) figure
+        """
+        z = df.grid_point_elevation
+        lon, lat = df.lon.iloc[0], df.lat.iloc[0]
+        years, means = stats.annual_means(df['tmp'].values, df.index.values)
+        trend = stats.linear_trend(means, years)
+        self._mean_line.set_data(years, means)
+        self._trend_line.set_data(years,
+                                  trend.intercept + trend.slope * years)
+        self._line_title.set_text(TIME_LINE_TITLE.format(lon, lat, int(z)))
+        self._line_ax.relim()
+        self._line_ax.autoscale_view()
+        if filepath is not None:
+            self.time_line.savefig(filepath, dpi=self.dpi)
+        return self.time_line
+
+
+_renderer = None
+
+
+def get_renderer():
+    """The renderer of this process (created on first use)."""
+    global _renderer
+    if _renderer is None:
+        _renderer = FigureRenderer()
+    return _renderer
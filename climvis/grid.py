@@ -0,0 +1,167 @@
+"""Grid-cell index and land mask of the CRU grid.
+
+The index tells in microseconds whether a location has valid data, before
+any time series is read out of the CRU files. It is built once from the
+tmp and pre files and cached to disk, tied to the version of these files.
+"""
+import os
+import numpy as np
+import pandas as pd
+from scipy.spatial import cKDTree
+from climvis import cfg, pool
+
+
+def lonlat_to_xyz(lon, lat):
+    """Convert lon/lat (in degrees) to 3D vectors on the unit sphere.
+
+    Euclidean distances between these vectors grow monotonically with the
+    great circle distance, which makes them suitable for KD-trees.
+
+    Returns
+    -------
+    a (n, 3) np.ndarray
+    """
+    lon, lat = map(np.radians, [np.atleast_1d(lon), np.atleast_1d(lat)])
+    return np.stack([np.cos(lat) * np.cos(lon),
+                     np.cos(lat) * np.sin(lon),
+                     np.sin(lat)], axis=-1)
+
+
+def _valid_mask(path, var, slab=120):
+    """Grid points with valid data at all time steps.
+
+    The file is read in time slabs to keep the memory usage bounded.
+    """
+    da = pool.open_dataset(path)[var].transpose('time', 'lat', 'lon')
+    valid = np.ones(da.shape[1:], dtype=bool)
+    for t0 in range(0, da.shape[0], slab):
+        valid &= np.isfinite(da[t0:t0+slab].values).all(axis=0)
+    return valid
+
+
+class GridIndex():
+    """Lon/lat to grid cell lookup, with a mask of the valid (land) cells."""
+
+    def __init__(self, lon, lat, mask, stamp=''):
+        """
+        Parameters
+        ----------
+        lon : array
+            the longitudes of the grid
+        lat : array
+            the latitudes of the grid
+        mask : array of bool
+            (lat, lon) array, True where the data is valid
+        stamp : str
+            version stamp of the source files
+        """
+        self.lon = np.asarray(lon, dtype=float)
+        self.lat = np.asarray(lat, dtype=float)
+        self.mask = np.asarray(mask, dtype=bool)
+        self.stamp = stamp
+        self._ilon = pd.Index(self.lon)
+        self._ilat = pd.Index(self.lat)
+        self._tree = None
+
+    @classmethod
+    def from_cru(cls):
+        """Build the index out of the CRU tmp and pre files."""
+        ds = pool.open_dataset(cfg.cru_tmp_file)
+        lon, lat = ds.lon.values, ds.lat.values
+        dsp = pool.open_dataset(cfg.cru_pre_file)
+        if not (np.array_equal(lon, dsp.lon) and
+                np.array_equal(lat, dsp.lat)):
+            raise ValueError('The tmp and pre files are not on the same grid')
+        mask = (_valid_mask(cfg.cru_tmp_file, 'tmp') &
+                _valid_mask(cfg.cru_pre_file, 'pre'))
+        return cls(lon, lat, mask,
+                   stamp=pool.file_stamp(cfg.cru_tmp_file, cfg.cru_pre_file))
+
+    @classmethod
+    def load(cls, path):
+        """Read an index written with :py:meth:`save`."""
+        with np.load(path) as f:
+            return cls(f['lon'], f['lat'], f['mask'], stamp=str(f['stamp']))
+
+    def save(self, path):
+        """Write the index to a .npz file."""
+        np.savez(path, lon=self.lon, lat=self.lat, mask=self.mask,
+                 stamp=self.stamp)
+
+    def cell(self, lon, lat):
+        """Indices of the nearest grid cell(s).
+
+        Parameters
+        ----------
+        lon : float
+            scalar or array of longitude(s)
+        lat : float
+            scalar or array of latitude(s)
+
+        Returns
+        -------
+        the latitude and longitude indices (arrays)
+        """
+        ilon = self._ilon.get_indexer(np.atleast_1d(lon), method='nearest')
+        ilat = self._ilat.get_indexer(np.atleast_1d(lat), method='nearest')
+        return ilat, ilon
+
+    def is_valid(self, lon, lat):
+        """Whether the nearest grid cell(s) have valid data.
+
+        Returns
+        -------
+        a bool for scalar input, an array of bool otherwise
+        """
+        ilat, ilon = self.cell(lon, lat)
+        valid = self.mask[ilat, ilon]
+        return bool(valid[0]) if np.isscalar(lon) else valid
+
+    def nearest_valid(self, lon, lat):
+        """Coordinates of the nearest valid grid cell(s).
+
+        Returns
+        -------
+        the longitude(s) and latitude(s) of the grid cell centers
+        """
+        if self._tree is None:
+            ilat, ilon = np.nonzero(self.mask)
+            self._valid_cells = (ilat, ilon)
+            self._tree = cKDTree(lonlat_to_xyz(self.lon[ilon],
+                                               self.lat[ilat]))
+        _, i = self._tree.query(lonlat_to_xyz(lon, lat))
+        ilat, ilon = self._valid_cells
+        lons, lats = self.lon[ilon[i]], self.lat[ilat[i]]
+        if np.isscalar(lon):
+            return float(lons[0]), float(lats[0])
+        return lons, lats
+
+
+_index = None
+
+
+def get_grid_index():
+    """The (cached) grid index of the CRU files.
+
+    The index is kept in memory and in ``cfg.cache_dir``. It is rebuilt if
+    the CRU files changed since it was written.
+    """
+    global _index
+
+    stamp = pool.file_stamp(cfg.cru_tmp_file, cfg.cru_pre_file)
+    if _index is not None and _index.stamp == stamp:
+        return _index
+
+    fpath = os.path.join(cfg.cache_dir, 'grid_index.npz')
+    if os.path.exists(fpath):
+        _index = GridIndex.load(fpath)
+        if _index.stamp == stamp:
+            return _index
+
+    _index = GridIndex.from_cru()
+    os.makedirs(cfg.cache_dir, exist_ok=True)
+    # write to a temporary file first, other processes might be reading
+    tmp_path = fpath + '.{}.npz'.format(os.getpid())
+    _index.save(tmp_path)
+    os.replace(tmp_path, fpath)
+    return _index
@@ -7,18 +7,19 @@ Created on Sat Dec  1 16:10:03 2018
 
 from bokeh.plotting import figure, show, output_file, save
 from bokeh import palettes
-from bokeh.models import Range1d, DatetimeTickFormatter
+from bokeh.models import (ColumnDataSource, Legend, LegendItem, Range1d,
+                          DatetimeTickFormatter)
 from bokeh.layouts import gridplot, layout
 from bokeh.resources import CDN
 from math import radians
 import numpy as np
 import pandas as pd
-from climvis import read_acinn, core
+from climvis import read_acinn
 from tempfile import mkdtemp
 import os
 
 
-def read_conv_data(station, duration):
+def read_conv_data(station, duration=None, start=None, end=None):
     """
     Reads and converts data from ACINN
 
@@ -26,13 +27,20 @@ def read_conv_data(station, duration):
     ----------
     station:    Station for data (innsbruck, sattelberg, obergurgl, ellboegen)
     duration:   durations: 1, 3, 7 (days)
+    start, end: first and last time (str or datetime, naive times are UTC)
+                of any period: the data is read from the local archive
+                (see climvis.acinn_archive) instead of the ACINN server.
+                Default: the whole archive if only one of them is given
 
     Output
     ----------
     data:       AcinnData Object with all necessary conversions
     """
     data = read_acinn.AcinnData(duration, station)
-    data.get_data()
+    if start is None and end is None:
+        data.get_data()
+    else:
+        data.get_archived_data(start, end)
     data.conv_raw()
     data.conv_date()
     data.conv_units()
@@ -61,6 +69,63 @@ def speed_labels(bins, units):
     return list(labels)
 
 
+def windrose_table(dd, ff, dir_bins=24, spd_bins=None, weights=None):
+    """
+    Frequency table of wind direction and speed (2D histogram)
+
+    Input
+    ----------
+    dd:         Winddirection [°]
+    ff:         Windspeed
+                or lists of them (one per station)
+
+    Parameters:
+    ----------
+    dir_bins = 24           Number of direction sectors (the first one
+                            centered on N), or the sector edges [°], left
+                            closed. Directions are wrapped around: 355° is
+                            in the sector [-7.5, 7.5)
+    spd_bins = None         Categories for windspeed, right closed like
+                            pd.cut. Default: [-1, 0, 1, 2, 3, 5, 7, 10, inf]
+    weights = None          Weight of each value (same shape as dd).
+                            Default: 1 (the table counts the values)
+
+    Output
+    ----------
+    table:      array (direction, speed), or (station, direction, speed)
+                for lists of stations. Missing values, and values out of
+                the bins, are not counted
+    """
+    if spd_bins is None:
+        spd_bins = [-1, 0, 1, 2, 3, 5, 7, 10, np.inf]
+    if np.ndim(dir_bins) == 0:
+        width = 360 / dir_bins
+        dir_bins = np.arange(dir_bins + 1) * width - width / 2
+    dir_bins = np.asarray(dir_bins, dtype=float)
+    spd_bins = np.asarray(spd_bins, dtype=float)
+    ndir, nspd = len(dir_bins) - 1, len(spd_bins) - 1
+
+    if isinstance(dd, (list, tuple)) and len(dd) and np.ndim(dd[0]) > 0 \
+            or np.ndim(dd) == 2:
+        if weights is None:
+            weights = [None] * len(dd)
+        return np.stack([windrose_table(d, f, dir_bins, spd_bins, w)
+                         for d, f, w in zip(dd, ff, weights)])
+
+    dd = np.asarray(dd, dtype=float)
+    ff = np.asarray(ff, dtype=float)
+    # directions into [dir_bins[0], dir_bins[0] + 360)
+    dd = (dd - dir_bins[0]) % 360 + dir_bins[0]
+    idir = np.digitize(dd, dir_bins) - 1
+    ispd = np.searchsorted(spd_bins, ff, side='left') - 1
+    valid = (idir >= 0) & (idir < ndir) & (ispd >= 0) & (ispd < nspd)
+    if weights is not None:
+        weights = np.asarray(weights, dtype=float)[valid]
+    table = np.bincount(idir[valid] * nspd + ispd[valid], weights=weights,
+                        minlength=ndir * nspd)
+    return table.reshape(ndir, nspd)
+
+
 def plot_windrose(dd, ff, wndspd_units='m/s', spd_bins=None, showp=None):
     """
     Plots Windrose with bokeh
@@ -69,6 +134,7 @@ def plot_windrose(dd, ff, wndspd_units='m/s', spd_bins=None, showp=None):
     ----------
     dd:         Winddirection
     ff:         Windspeed
+                or lists of them (several stations, stacked in one rose)
 
     Parameters:
     ----------
@@ -85,18 +151,12 @@ def plot_windrose(dd, ff, wndspd_units='m/s', spd_bins=None, showp=None):
     if spd_bins is None:
         spd_bins = [-1, 0, 1, 2, 3, 5, 7, 10, np.inf]  # get speed bins
 
-    # get categorizations for speed & direction
     spd_labels = speed_labels(spd_bins, wndspd_units)  # get speed labels
-    dir_bins = np.arange(-7.5, 370, 15)  # get wind directory categories
-    dir_labelsf = (dir_bins[:-1] + dir_bins[1:]) / 2  # labels for directions
-    dir_labels = dir_labelsf.astype(int)  # get rid of the commas for labels
-    dir_labels = dir_labels.astype(str)  # convert into string
-
-    # categorize data
-    WindSpd_bins = pd.cut(ff, bins=spd_bins, labels=spd_labels, right=True)
-    WindDir_bins = pd.cut(dd, bins=dir_bins, labels=dir_labels, right=False)
-    # get frequency table
-    tab = pd.crosstab(WindDir_bins, WindSpd_bins, dropna=False)
+    dir_bins = np.arange(-7.5, 360, 15)  # 24 sectors, centered on N
+    # get frequency table (all stations together)
+    counts = windrose_table(dd, ff, dir_bins=dir_bins, spd_bins=spd_bins)
+    if counts.ndim == 3:
+        counts = counts.sum(axis=0)
 
     # -------------------------------------------------------------------------
     # setting things up for plot
@@ -119,29 +179,32 @@ def plot_windrose(dd, ff, wndspd_units='m/s', spd_bins=None, showp=None):
     # plot wind data
     # -------------------------------------------------------------------------
 
-    for i in range(len(dir_bins)-1):  # last angle not needed
-        # loop over each angle to get starting & ending angle for wedges
-        # -90 because coordinate system starts from horizontal
-        startangle = -radians(dir_bins[i+1] - 90)
-        endangle = -radians(dir_bins[i] - 90)
-        # reset of those two after each angle:
-        spdcnt = 0  # counter for windspeed frequencies
-        palcnt = 0  # counter for colorpalette
-
-        for wndspd in tab.loc[dir_labels[i]]:
-            # loop over each windspeed
-            tmpcnt = spdcnt + wndspd  # temporary variables for size of slices
-            p.annular_wedge(0, 0,  # starting coordinates
-                            spdcnt,  # inner radius for slice
-                            tmpcnt,  # outer radius for slice
-                            startangle, endangle,  # angles for wedges
-                            legend=WindSpd_bins.categories[palcnt],  # legend
-                            fill_color=palette[palcnt],  # fill with color
+    # all the wedges in one data source: one row per direction and speed
+    # class, the speed classes stacked outwards. Empty wedges are left out
+    outer = counts.cumsum(axis=1)
+    ndir, nspd = counts.shape
+    # -90 because coordinate system starts from horizontal
+    angles = np.radians(90 - dir_bins)
+    wedges = dict(start=np.repeat(angles[1:], nspd),
+                  end=np.repeat(angles[:-1], nspd),
+                  inner=(outer - counts).ravel(),
+                  outer=outer.ravel(),
+                  speed=np.tile(spd_labels, ndir),
+                  color=np.tile(palette[:nspd], ndir))
+    keep = counts.ravel() > 0
+    source = ColumnDataSource({k: v[keep] for k, v in wedges.items()})
+    wedge = p.annular_wedge(0, 0, 'inner', 'outer', 'start', 'end',
+                            source=source,
+                            fill_color='color',
                             line_color=None,
                             direction="anticlock"
                             )
-            spdcnt = tmpcnt
-            palcnt += 1
+    # one legend entry per speed class, drawn like its first wedge
+    speed = source.data['speed']
+    items = [LegendItem(label=label, renderers=[wedge],
+                        index=int(np.argmax(speed == label)))
+             for label in spd_labels if np.any(speed == label)]
+    p.add_layout(Legend(items=items))
 
     # -------------------------------------------------------------------------
     # setting up "coordinate system" for "polar plot"
@@ -151,7 +214,7 @@ def plot_windrose(dd, ff, wndspd_units='m/s', spd_bins=None, showp=None):
     ind = ['N', 'NO', 'O', 'SO', 'S', 'SW', 'W', 'NW', 'N']
     angles_deg = pd.Series(np.linspace(0, 360, 9), index=ind)
     # get size of scaling rings
-    max_cls = max(tab.sum(axis=1))
+    max_cls = counts.sum(axis=1).max()
     # get radii of the inner rings for "coordinate system"
     radii = np.linspace(0, max_cls, num=6)
     radii = radii.round()
@@ -199,7 +262,71 @@ def plot_windrose(dd, ff, wndspd_units='m/s', spd_bins=None, showp=None):
         show(p)
 
 
-def plot_meteo(acdat, showp=None):
+def decimate(x, y, n, method='minmax'):
+    """
+    Indices of the points to draw of a long time series
+
+    Input
+    ----------
+    x:          Times (sorted, datetime64 or numbers)
+    y:          Values. Missing values are left out
+    n:          Number of buckets, e.g. the plot width in pixels
+
+    Parameters:
+    ----------
+    method = 'minmax'       'minmax': the lowest and highest value of each
+                            of the n buckets of equal time span, and the
+                            ends (at most 2n + 2 points, the peaks are
+                            kept).
+                            'lttb': Largest-Triangle-Three-Buckets, n
+                            points keeping the visual shape
+
+    Output
+    ----------
+    index:      sorted array of indices into x and y
+    """
+    x = np.asarray(x)
+    if np.issubdtype(x.dtype, np.datetime64):
+        x = x.astype('datetime64[ns]').astype(np.int64)
+    x = x.astype(float)
+    y = np.asarray(y, dtype=float)
+    valid = np.flatnonzero(np.isfinite(y))
+    if len(valid) <= n or n < 3:
+        return valid
+    x, y = x[valid], y[valid]
+
+    if method == 'minmax':
+        span = max(x[-1] - x[0], 1)
+        bucket = np.minimum(((x - x[0]) / span * n).astype(int), n - 1)
+        # per bucket, sorted by value: its first and last points
+        order = np.lexsort((y, bucket))
+        bounds = np.flatnonzero(np.diff(bucket[order])) + 1
+        keep = np.concatenate([order[np.r_[0, bounds]],
+                               order[np.r_[bounds - 1, len(order) - 1]],
+                               [0, len(x) - 1]])
+    elif method == 'lttb':
+        edges = np.linspace(1, len(x) - 1, n - 1).astype(int)
+        keep = np.zeros(n, dtype=int)
+        keep[-1] = len(x) - 1
+        for i in range(n - 2):
+            # the point of this bucket making the largest triangle with
+            # the last kept point and the mean of the next bucket
+            if i + 1 < n - 2:
+                nxt = slice(edges[i + 1], edges[i + 2])
+            else:
+                nxt = slice(len(x) - 1, len(x))
+            cx, cy = x[nxt].mean(), y[nxt].mean()
+            ax, ay = x[keep[i]], y[keep[i]]
+            bx, by = x[edges[i]:edges[i + 1]], y[edges[i]:edges[i + 1]]
+            area = np.abs((ax - cx) * (by - ay) - (ax - bx) * (cy - ay))
+            keep[i + 1] = edges[i] + np.argmax(area)
+    else:
+        raise ValueError('Unknown decimation method: ' + str(method))
+    return valid[np.unique(keep)]
+
+
+def plot_meteo(acdat, showp=None, start=None, end=None, freq=None,
+               decimation=None, plot_width=800):
     """
     Plot Meteorological Data from ACINN Station
 
@@ -216,21 +343,52 @@ def plot_meteo(acdat, showp=None):
     ----------
     showp = None            Does not show, save the html, instead of returning
                             plot handles
+    start, end = None       Only plot this period (str or datetime, naive
+                            times are UTC). Default: all the data
+    freq = None             Plot aggregates instead of the 10 min values,
+                            e.g. 'h' (hourly) or 'D' (daily), see
+                            read_acinn.resample
+    decimation = None       Only draw the points which are visible at this
+                            plot_width, for long periods: 'minmax' or
+                            'lttb' (see decimate). Default: all the points
+    plot_width = 800        Width of the figures (pixels)
 
     """
+    sel = np.ones(len(acdat.timeutc), dtype=bool)
+    if start is not None:
+        sel &= acdat.timeutc >= read_acinn._utc(start)
+    if end is not None:
+        sel &= acdat.timeutc <= read_acinn._utc(end)
+    time = acdat.timeutc[sel]
+    values = pd.DataFrame({k: getattr(acdat, k)[sel]
+                           for k in ['tl', 'tp', 'rr', 'rm']}, index=time)
+    if freq is not None:
+        values = read_acinn.resample(values, freq)
+        time = values.index
+    # precipitation accumulated over the plotted period only
+    crm = np.nancumsum(values.rm.values)
+
+    def series(y):
+        """The (decimated) times and values of a parameter"""
+        y = np.asarray(y)
+        if decimation is None:
+            return time, y
+        keep = decimate(time.values, y, plot_width, method=decimation)
+        return time[keep], y[keep]
+
     # plot Temperature & Dewpoint
     p1 = figure(x_axis_type="datetime",
                 title="Temperature, Dewpoint",
-                plot_width=800,
+                plot_width=plot_width,
                 plot_height=400)
     p1.grid.grid_line_alpha = 0.3
     p1.yaxis.axis_label = acdat.dict['tl']
-    p1.line(acdat.timeutc, acdat.tl, color='red', legend=acdat.dict['tl'])
-    try:
-        p1.line(acdat.timeutc, acdat.tp,
+    p1.line(*series(values.tl), color='red', legend=acdat.dict['tl'])
+    if 'tp' in acdat.keys:
+        p1.line(*series(values.tp),
                 color='green',
                 legend=acdat.dict['tp'])
-    except AttributeError:
+    else:
         print('No dewpoint data at this station availabe, skipping display')
     p1.xaxis.formatter = DatetimeTickFormatter(
             hours=["%d %B %Y"],
@@ -243,17 +401,18 @@ def plot_meteo(acdat, showp=None):
     # plot Precipitationrate & Precipitation
     p2 = figure(x_axis_type="datetime",
                 title="Precipitationrate, Precipitation",
-                plot_width=800,
+                plot_width=plot_width,
                 plot_height=400)
     p2.grid.grid_line_alpha = 0.3
-    try:
+    if 'rr' in acdat.keys:
         p2.yaxis.axis_label = 'Precipitation [mm]'
-        p2.line(acdat.timeutc, acdat.crm,
+        p2.line(*series(crm),
                 color='blue',
                 legend=acdat.dict['crm'])
-        p2.vbar(x=acdat.timeutc, top=acdat.rr, width=0.9, alpha=0.5,
+        rr_time, rr = series(values.rr)
+        p2.vbar(x=rr_time, top=rr, width=0.9, alpha=0.5,
                 legend=acdat.dict['rr'])
-    except AttributeError:
+    else:
         print("No precipitation data at this station availabe, ",
               "skipping display")
     p2.xaxis.formatter = DatetimeTickFormatter(
@@ -272,7 +431,8 @@ def plot_meteo(acdat, showp=None):
         show(gridplot([[p1], [p2]], plot_width=800, plot_height=400))
 
 
-def plot_both(station, duration):
+def plot_both(station, duration=None, start=None, end=None,
+              decimation=None, directory=None):
     """
     Plots Meteo-Data and Windrose
 
@@ -280,14 +440,21 @@ def plot_both(station, duration):
     ----------
     station:    Station for data (innsbruck, sattelberg, obergurgl, ellboegen)
     duration:   durations: 1, 3, 7 (days)
+    start, end: any period out of the local archive, see read_conv_data
+    decimation: for long periods, see plot_meteo
+    directory:  where to write the html file (replacing an earlier one).
+                Default: a new temporary directory
     """
-    data = read_conv_data(station, duration)
-    p1, p2 = plot_meteo(data, showp=None)
+    data = read_conv_data(station, duration, start=start, end=end)
+    p1, p2 = plot_meteo(data, showp=None, decimation=decimation)
     p3 = plot_windrose(data.dd, data.ff, showp=None)
     lo = layout([p1], [p2], [p3])
-    directory = mkdtemp()
-    core.mkdir(directory)
+    if directory is None:
+        directory = mkdtemp()
+    os.makedirs(directory, exist_ok=True)
     filename = station + '.html'
     outpath = os.path.join(directory, filename)
-    save(lo, filename=outpath, title=station, resources=CDN)
+    tmp_path = '{}.{}.tmp.html'.format(outpath, os.getpid())
+    save(lo, filename=tmp_path, title=station, resources=CDN)
+    os.replace(tmp_path, outpath)
     return outpath
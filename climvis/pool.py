@@ -0,0 +1,149 @@
+"""A process-wide pool of open xarray datasets.
+
+Opening a netCDF file means parsing its header and decoding its coordinate
+variables, which is expensive for the multi-GB CRU files. The pool keeps
+the datasets open and hands out the same handle for each request, until
+the file changes on disk or the handle is evicted.
+
+The handles are shared: do not close them (or use them in a ``with``
+block). A handle which leaves the pool, because it was the least recently
+used one or because its file changed, is not closed: other threads may
+still be reading from it. It is closed by the garbage collector once it
+is not used anymore. :py:func:`close` closes the handles at once, and
+must only be called when no other thread uses them (e.g. before
+replacing a file).
+"""
+import os
+import threading
+from collections import OrderedDict
+import xarray as xr
+from climvis import cfg
+
+
+def file_stamp(*paths):
+    """A version string for a set of files, based on their size and mtime.
+
+    Used to tie derived products (caches) to the files they were built from.
+    """
+    stamp = []
+    for path in paths:
+        st = os.stat(path)
+        stamp.append('{}:{}:{}'.format(os.path.basename(path), st.st_size,
+                                       st.st_mtime_ns))
+    return '|'.join(stamp)
+
+
+class DatasetPool():
+    """LRU pool of open datasets, keyed on file path and mtime."""
+
+    def __init__(self, maxsize=None):
+        """
+        Parameters
+        ----------
+        maxsize : int, optional
+            the maximum number of pooled datasets. The least recently used
+            dataset is dropped when the pool is full. Default: no limit
+        """
+        self.maxsize = maxsize
+        self._handles = OrderedDict()
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._handles)
+
+    def __contains__(self, path):
+        return any(k[0] == os.path.abspath(path) for k in self._handles)
+
+    def open_dataset(self, path, **kwargs):
+        """Get the (lazily opened) dataset for a file.
+
+        Parameters
+        ----------
+        path : str
+            the path to the file
+        **kwargs :
+            passed to ``xr.open_dataset``. Different kwargs give different
+            handles
+
+        Returns
+        -------
+        a xr.Dataset
+        """
+        path = os.path.abspath(path)
+        key = (path, repr(sorted(kwargs.items())))
+        mtime = os.stat(path).st_mtime_ns
+        with self._lock:
+            if key in self._handles:
+                stamp, ds = self._handles[key]
+                if stamp == mtime:
+                    self._handles.move_to_end(key)
+                    return ds
+                # the file changed on disk (the old handle is left to the
+                # garbage collector, see the module docstring)
+                del self._handles[key]
+            ds = xr.open_dataset(path, **kwargs)
+            self._handles[key] = (mtime, ds)
+            if self.maxsize is not None:
+                while len(self._handles) > self.maxsize:
+                    self._handles.popitem(last=False)
+            return ds
+
+    def close(self, path=None):
+        """Close the datasets of a file, or all datasets.
+
+        The handles are closed at once: no other thread must be using them.
+
+        Parameters
+        ----------
+        path : str, optional
+            the file to close. Default: close everything
+        """
+        if path is not None:
+            path = os.path.abspath(path)
+        with self._lock:
+            for key in list(self._handles):
+                if path is None or key[0] == path:
+                    _, ds = self._handles.pop(key)
+                    ds.close()
+
+    def refresh(self):
+        """Drop the datasets whose file changed or disappeared on disk.
+
+        They will be reopened at the next request. The dropped handles are
+        closed by the garbage collector, once no thread uses them anymore.
+        """
+        with self._lock:
+            for key, (stamp, _) in list(self._handles.items()):
+                try:
+                    mtime = os.stat(key[0]).st_mtime_ns
+                except FileNotFoundError:
+                    mtime = None
+                if mtime != stamp:
+                    del self._handles[key]
+
+
+_pool = DatasetPool(maxsize=cfg.dataset_pool_size)
+
+
+def open_dataset(path, **kwargs):
+    """Get a shared dataset out of the process-wide pool.
+
+    See :py:meth:`DatasetPool.open_dataset`.
+    """
+    return _pool.open_dataset(path, **kwargs)
+
+
+def close(path=None):
+    """Close datasets of the process-wide pool.
+
+    See :py:meth:`DatasetPool.close`.
+    """
+    _pool.close(path=path)
+
+
+def refresh():
+    """Drop the datasets of the process-wide pool which changed on disk.
+
+    See :py:meth:`DatasetPool.refresh`.
+    """
+    _pool.refresh()
@@ -0,0 +1,219 @@
+"""Gridded climatology and trend products of the CRU data.
+
+:py:func:`build_products` computes, for the whole grid and in one pass over
+slabs of latitude rows (the memory usage stays below
+``cfg.products_max_bytes``):
+
+- the 1981-2010 monthly climatology of tmp and pre, and its annual mean
+- the linear trend of the annual mean temperature over all the complete
+  years (per decade), with its p-value and standard error
+
+and writes them to a netCDF file (``cfg.products_file``), tied to the
+version of the CRU files. :py:func:`render_maps` draws them as map PNGs,
+and :py:func:`point_values` reads the values of a location without
+touching the time series.
+"""
+import os
+import numpy as np
+import netCDF4
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from climvis import cfg, pool, stats
+
+MAPS = {'tmp_annual': ('RdYlBu_r', False),
+        'pre_annual': ('YlGnBu', False),
+        'tmp_trend': ('RdBu_r', True)}
+
+
+def _source_stamp():
+    return pool.file_stamp(cfg.cru_tmp_file, cfg.cru_pre_file)
+
+
+def _slab_rows(nt, nx, max_bytes):
+    """Number of latitude rows per slab within the memory budget."""
+    # tmp and pre as float32, plus float64 temporaries
+    return max(1, int(max_bytes // (nt * nx * (4 + 8) * 2)))
+
+
+def _create(nc, name, dims, long_name, units):
+    var = nc.createVariable(name, 'f4', dims, zlib=True,
+                            fill_value=np.float32(np.nan))
+    var.setncattr('long_name', long_name)
+    var.setncattr('units', units)
+    return var
+
+
+def build_products(outpath=None, max_bytes=None):
+    """Compute the gridded products and write them to a netCDF file.
+
+    Parameters
+    ----------
+    outpath : str, optional
+        the file to write. Default: ``cfg.products_file``
+    max_bytes : int, optional
+        the memory budget for the data read at once. Default:
+        ``cfg.products_max_bytes``
+
+    Returns
+    -------
+    the path to the file
+    """
+    if outpath is None:
+        outpath = cfg.products_file
+    if max_bytes is None:
+        max_bytes = cfg.products_max_bytes
+    stamp = _source_stamp()
+
+    tmp = pool.open_dataset(cfg.cru_tmp_file).tmp.transpose('time', 'lat',
+                                                            'lon')
+    pre = pool.open_dataset(cfg.cru_pre_file).pre.transpose('time', 'lat',
+                                                            'lon')
+    time = tmp.time.values
+    years = stats.by_year(np.empty((len(time), 0)), time)[0]
+    nt, ny, nx = tmp.shape
+    slab = _slab_rows(nt, nx, max_bytes)
+
+    os.makedirs(os.path.dirname(os.path.abspath(outpath)), exist_ok=True)
+    tmp_path = outpath + '.{}.tmp'.format(os.getpid())
+    with netCDF4.Dataset(tmp_path, 'w') as out:
+        out.setncattr('source_stamp', stamp)
+        out.setncattr('climatology_period', '-'.join(stats.PERIOD))
+        out.setncattr('trend_period', '{}-{}'.format(years[0], years[-1]))
+        for dim, values in [('month', np.arange(1, 13)),
+                            ('lat', tmp.lat.values),
+                            ('lon', tmp.lon.values)]:
+            out.createDimension(dim, len(values))
+            out.createVariable(dim, values.dtype, (dim,))[:] = values
+        out.variables['lat'].setncattr('units', 'degrees_north')
+        out.variables['lon'].setncattr('units', 'degrees_east')
+
+        dims = ('month', 'lat', 'lon')
+        variables = {
+            'tmp_clim': _create(out, 'tmp_clim', dims,
+                                'monthly mean temperature', 'degC'),
+            'pre_clim': _create(out, 'pre_clim', dims,
+                                'monthly precipitation', 'mm mth-1'),
+            'tmp_annual': _create(out, 'tmp_annual', dims[1:],
+                                  'annual mean temperature', 'degC'),
+            'pre_annual': _create(out, 'pre_annual', dims[1:],
+                                  'mean monthly precipitation', 'mm mth-1'),
+            'tmp_trend': _create(out, 'tmp_trend', dims[1:],
+                                 'trend of the annual mean temperature',
+                                 'degC decade-1'),
+            'tmp_trend_pvalue': _create(out, 'tmp_trend_pvalue', dims[1:],
+                                        'p-value of the trend', '1'),
+            'tmp_trend_stderr': _create(out, 'tmp_trend_stderr', dims[1:],
+                                        'standard error of the trend',
+                                        'degC decade-1'),
+        }
+
+        for j0 in range(0, ny, slab):
+            rows = slice(j0, min(j0 + slab, ny))
+            data = {'tmp': tmp[:, rows, :].values,
+                    'pre': pre[:, rows, :].values}
+            for name in ['tmp', 'pre']:
+                clim = stats.climatology(data[name], time)
+                variables[name + '_clim'][:, rows, :] = clim
+                variables[name + '_annual'][rows, :] = clim.mean(axis=0)
+            years, means = stats.annual_means(data['tmp'], time)
+            trend = stats.linear_trend(means, years)
+            variables['tmp_trend'][rows, :] = trend.slope * 10
+            variables['tmp_trend_pvalue'][rows, :] = trend.pvalue
+            variables['tmp_trend_stderr'][rows, :] = trend.stderr * 10
+
+    pool.close(outpath)
+    os.replace(tmp_path, outpath)
+    return outpath
+
+
+def is_current(path=None):
+    """Whether a file written by :py:func:`build_products` exists and was
+    built from the current CRU files.
+    """
+    if path is None:
+        path = cfg.products_file
+    if not os.path.exists(path):
+        return False
+    return pool.open_dataset(path).attrs.get('source_stamp') == \
+        _source_stamp()
+
+
+def get_products(path=None):
+    """The products (xr.Dataset), (re)built if needed."""
+    if path is None:
+        path = cfg.products_file
+    if not is_current(path):
+        build_products(path)
+    return pool.open_dataset(path)
+
+
+def point_values(lon, lat, path=None):
+    """The products at the nearest grid point of a location.
+
+    Returns
+    -------
+    a dict with the annual means (``tmp_annual``, ``pre_annual``) and the
+    temperature trend (``tmp_trend``, per decade, ``tmp_trend_pvalue``,
+    ``tmp_trend_stderr``)
+    """
+    ds = get_products(path)
+    ilat = ds.indexes['lat'].get_indexer([lat], method='nearest')
+    ilon = ds.indexes['lon'].get_indexer([lon], method='nearest')
+    names = ['tmp_annual', 'pre_annual', 'tmp_trend', 'tmp_trend_pvalue',
+             'tmp_trend_stderr']
+    return {n: float(ds[n].values[ilat[0], ilon[0]]) for n in names}
+
+
+def render_maps(directory=None, path=None, dpi=100):
+    """Draw the annual means and the temperature trend as map PNGs.
+
+    The grid points where the trend is not significant (p >= 0.05) are
+    hatched.
+
+    Parameters
+    ----------
+    directory : str, optional
+        where to write the PNGs. Default: ``cfg.cache_dir/products``
+    path : str, optional
+        the products file. Default: ``cfg.products_file``
+    dpi : int
+        the resolution of the PNGs
+
+    Returns
+    -------
+    the list of paths to the PNGs
+    """
+    if directory is None:
+        directory = os.path.join(cfg.cache_dir, 'products')
+    os.makedirs(directory, exist_ok=True)
+    ds = get_products(path)
+
+    out = []
+    for name, (cmap, centered) in MAPS.items():
+        da = ds[name]
+        fig = Figure(figsize=(8, 5))
+        FigureCanvasAgg(fig)
+        ax = fig.add_subplot(111)
+        kwargs = {}
+        if centered:
+            vmax = np.nanmax(np.abs(da.values))
+            kwargs = dict(vmin=-vmax, vmax=vmax)
+        mesh = ax.pcolormesh(ds.lon.values, ds.lat.values, da.values,
+                             cmap=cmap, shading='nearest', **kwargs)
+        if name == 'tmp_trend':
+            weak = (ds.tmp_trend_pvalue.values >= 0.05).astype(float)
+            ax.contourf(ds.lon.values, ds.lat.values, weak, levels=[0.5, 1.5],
+                        colors='none', hatches=['...'])
+        fig.colorbar(mesh, ax=ax, label=da.attrs['units'])
+        period = ds.attrs['trend_period'] if name == 'tmp_trend' else \
+            ds.attrs['climatology_period']
+        ax.set_title('{} ({})'.format(da.attrs['long_name'].capitalize(),
+                                      period), loc='left')
+        ax.set_xlabel('Longitude (°)')
+        ax.set_ylabel('Latitude (°)')
+        ax.set_aspect('equal')
+        fig.tight_layout()
+        fpath = os.path.join(directory, name + '.png')
+        fig.savefig(fpath, dpi=dpi)
+        out.append(fpath)
+    return out
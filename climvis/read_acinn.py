@@ -10,12 +10,352 @@
 
 """
 
+import os
 import json
-import urllib
-import urllib.request
-from datetime import datetime
-import pytz
+import time
+import threading
+import http.client
+from urllib.parse import urlsplit, urljoin
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
+import pandas as pd
+from climvis import cfg
+
+STATIONS = ['innsbruck', 'ellboegen', 'sattelberg', 'obergurgl']
+# parameters measured by (some of) the stations, and derived from them
+PARAMETERS = ['tl', 'tp', 'rr', 'dd', 'ff', 'so', 'p', 'rf']
+DERIVED = ['kmwind', 'rm', 'crm', 'sop']
+# aggregation of the parameters in time (see resample), default: mean
+AGGREGATION = {'rm': 'sum', 'so': 'sum', 'crm': 'last', 'dd': 'vector'}
+
+
+class ConnectionPool():
+    """Keep-alive HTTP connections, shared by all threads.
+
+    A connection is used by one request at a time: it is taken out of the
+    pool with :py:meth:`acquire` and put back with :py:meth:`release` once
+    its response has been read. The idle connections outlive the threads
+    which opened them, so that successive calls (e.g. of
+    :py:func:`fetch_stations`) reuse them.
+    """
+
+    def __init__(self, maxsize=8):
+        """
+        Parameters
+        ----------
+        maxsize : int
+            the maximum number of idle connections kept per host
+        """
+        self.maxsize = maxsize
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, scheme, netloc, timeout=None):
+        """An idle connection to a host, or a new one."""
+        with self._lock:
+            idle = self._idle.get((scheme, netloc), [])
+            conn = idle.pop() if idle else None
+        if conn is None:
+            if scheme == 'https':
+                conn = http.client.HTTPSConnection(netloc, timeout=timeout)
+            else:
+                conn = http.client.HTTPConnection(netloc, timeout=timeout)
+        conn.timeout = timeout
+        if conn.sock is not None:
+            conn.sock.settimeout(timeout)
+        return conn
+
+    def release(self, scheme, netloc, conn):
+        """Put a connection back into the pool (it is closed if the pool
+        is full).
+        """
+        with self._lock:
+            idle = self._idle.setdefault((scheme, netloc), [])
+            if len(idle) < self.maxsize:
+                idle.append(conn)
+                return
+        conn.close()
+
+    def clear(self):
+        """Close all the idle connections."""
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for conns in idle.values():
+            for conn in conns:
+                conn.close()
+
+
+_connections = ConnectionPool()
+
+
+def http_request(url, headers=None, timeout=None, retries=None,
+                 backoff=None, max_redirects=5):
+    """GET a URL over a pooled keep-alive connection.
+
+    Connection errors, timeouts and server errors (5xx) are retried with an
+    exponential backoff. Redirects are followed.
+
+    Parameters
+    ----------
+    url : str
+        the URL
+    headers : dict, optional
+        additional request headers (e.g. for conditional requests)
+    timeout : float, optional
+        the timeout (s) of each attempt. Default: ``cfg.acinn_timeout``
+    retries : int, optional
+        the number of retries. Default: ``cfg.acinn_retries``
+    backoff : float, optional
+        the wait (s) before the first retry, doubled at each retry.
+        Default: ``cfg.acinn_backoff``
+
+    Returns
+    -------
+    the status (200 or 304), the response headers (dict) and the body
+    (bytes)
+    """
+    if timeout is None:
+        timeout = cfg.acinn_timeout
+    if retries is None:
+        retries = cfg.acinn_retries
+    if backoff is None:
+        backoff = cfg.acinn_backoff
+    if headers is None:
+        headers = {}
+
+    for attempt in range(retries + 1):
+        if attempt > 0:
+            time.sleep(backoff * 2**(attempt - 1))
+        target = url
+        for _ in range(max_redirects + 1):
+            parts = urlsplit(target)
+            path = parts.path or '/'
+            if parts.query:
+                path += '?' + parts.query
+            conn = _connections.acquire(parts.scheme, parts.netloc, timeout)
+            # an idle connection may have been closed by the server: it is
+            # then retried at once on a new one (close() resets it)
+            for fresh in [conn.sock is None, True]:
+                try:
+                    conn.request('GET', path, headers=headers)
+                    response = conn.getresponse()
+                    body = response.read()
+                    break
+                except (OSError, http.client.HTTPException):
+                    conn.close()
+                    response = None
+                    if fresh:
+                        break
+            if response is None:
+                break
+            if response.will_close:
+                conn.close()
+            else:
+                _connections.release(parts.scheme, parts.netloc, conn)
+            if response.status in [301, 302, 303, 307, 308]:
+                target = urljoin(target, response.getheader('Location'))
+                continue
+            break
+        if response is None or response.status >= 500:
+            continue
+        if response.status in [200, 304]:
+            return response.status, dict(response.getheaders()), body
+        break
+    raise Exception('could not read from URL')
+
+
+def http_get(url, timeout=None, retries=None, backoff=None):
+    """GET a URL, see :py:func:`http_request`.
+
+    Returns
+    -------
+    the body of the response (bytes)
+    """
+    return http_request(url, timeout=timeout, retries=retries,
+                        backoff=backoff)[2]
+
+
+def _utc(t):
+    """A time (str, datetime...) as naive UTC pd.Timestamp. Naive times
+    are taken as UTC."""
+    t = pd.Timestamp(t)
+    if t.tzinfo is not None:
+        t = t.tz_convert('UTC').tz_localize(None)
+    return t
+
+
+def resample(df, freq):
+    """Aggregates of ACINN parameters over longer periods.
+
+    Most parameters are averaged. The precipitation (rm, mm) and the
+    sunshine duration (so, min) are summed, the wind direction (dd) is the
+    direction of the mean unit vector.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        the parameters (columns) with a datetime64 index, like
+        :py:meth:`AcinnData.to_dataframe`
+    freq : str
+        the pandas frequency of the aggregates, e.g. 'h' (hourly) or 'D'
+        (daily, UTC)
+
+    Returns
+    -------
+    a pd.DataFrame (periods without data are NaN)
+    """
+    resampler = df.resample(freq)
+    out = resampler.mean()
+    for k in df.columns:
+        how = AGGREGATION.get(k, 'mean')
+        if how == 'sum':
+            out[k] = resampler[k].sum(min_count=1)
+        elif how == 'last':
+            out[k] = resampler[k].last()
+        elif how == 'vector':
+            rad = np.radians(df[k])
+            sin = np.sin(rad).resample(freq).mean()
+            cos = np.cos(rad).resample(freq).mean()
+            out[k] = np.degrees(np.arctan2(sin, cos)) % 360
+    return out
+
+
+def _slice_days(raw_data, timespan):
+    """The last ``timespan`` days of a raw data dict."""
+    datumsec = raw_data['datumsec']
+    if not datumsec:
+        return raw_data
+    start = datumsec[-1] - timespan * 86400 * 1000
+    i0 = int(np.searchsorted(datumsec, start, side='right'))
+    return {k: v[i0:] if isinstance(v, list) and len(v) == len(datumsec)
+            else v for k, v in raw_data.items()}
+
+
+class AcinnCache():
+    """Cache of the raw ACINN data, in memory and optionally on disk.
+
+    The stations measure every 10 minutes: an entry is fresh until the next
+    measurement is expected to be online. Stale entries are revalidated
+    with a conditional request (ETag / Last-Modified) when the server
+    supports it. A fresh entry for a longer timespan also serves the
+    shorter ones (the 1 day data is sliced out of the 7 days data).
+    """
+
+    def __init__(self, directory=None, lag=None, min_ttl=60):
+        """
+        Parameters
+        ----------
+        directory : str, optional
+            where to store the entries on disk. Default: memory only
+        lag : float, optional
+            the delay (s) between a measurement and its availability on the
+            server. Default: ``cfg.acinn_cache_lag``
+        min_ttl : float
+            the minimum time (s) an entry is considered fresh
+        """
+        self.directory = directory
+        self.lag = cfg.acinn_cache_lag if lag is None else lag
+        self.min_ttl = min_ttl
+        self._entries = {}
+        self._lock = threading.RLock()
+
+    def _path(self, station, timespan):
+        return os.path.join(self.directory,
+                            'acinn_{}_{}.json'.format(station, timespan))
+
+    def _entry(self, station, timespan):
+        key = (station, int(timespan))
+        with self._lock:
+            if key not in self._entries and self.directory is not None:
+                try:
+                    with open(self._path(*key)) as f:
+                        self._entries[key] = json.load(f)
+                except (OSError, ValueError):
+                    pass
+            return self._entries.get(key)
+
+    def _store(self, station, timespan, entry):
+        key = (station, int(timespan))
+        with self._lock:
+            self._entries[key] = entry
+        if self.directory is not None:
+            os.makedirs(self.directory, exist_ok=True)
+            path = self._path(*key)
+            tmp_path = '{}.{}.{}'.format(path, os.getpid(),
+                                         threading.get_ident())
+            with open(tmp_path, 'w') as f:
+                json.dump(entry, f)
+            os.replace(tmp_path, path)
+
+    def _expires(self, raw_data):
+        """Time at which the next measurement should be online."""
+        now = time.time()
+        datumsec = raw_data.get('datumsec') or [now * 1000]
+        return max(datumsec[-1] / 1000 + 600 + self.lag, now + self.min_ttl)
+
+    def get(self, station, timespan, timeout=None, retries=None):
+        """The raw data of a station (see :py:meth:`AcinnData.get_data`).
+
+        Returns
+        -------
+        a dict (a copy: it can be modified)
+        """
+        # e.g. a string from the command line
+        timespan = int(timespan)
+        now = time.time()
+        for span in [t for t in [1, 3, 7] if t >= timespan] or [timespan]:
+            entry = self._entry(station, span)
+            if entry is not None and entry['expires'] > now:
+                return self._copy(_slice_days(entry['data'], timespan)
+                                  if span != timespan else entry['data'])
+
+        url = AcinnData(timespan, station).url()
+        entry = self._entry(station, timespan)
+        headers = {}
+        if entry is not None:
+            if entry.get('etag'):
+                headers['If-None-Match'] = entry['etag']
+            if entry.get('last_modified'):
+                headers['If-Modified-Since'] = entry['last_modified']
+        status, rheaders, body = http_request(url, headers=headers,
+                                              timeout=timeout,
+                                              retries=retries)
+        if status == 304 and entry is not None:
+            entry = dict(entry, expires=self._expires(entry['data']))
+        else:
+            data = json.loads(body.decode())
+            entry = {'data': data, 'expires': self._expires(data),
+                     'etag': rheaders.get('ETag'),
+                     'last_modified': rheaders.get('Last-Modified')}
+        self._store(station, timespan, entry)
+        return self._copy(entry['data'])
+
+    @staticmethod
+    def _copy(raw_data):
+        return {k: list(v) if isinstance(v, list) else v
+                for k, v in raw_data.items()}
+
+    def clear(self):
+        """Forget all entries (in memory and on disk)."""
+        with self._lock:
+            for station, timespan in list(self._entries):
+                if self.directory is not None:
+                    try:
+                        os.remove(self._path(station, timespan))
+                    except FileNotFoundError:
+                        pass
+            self._entries = {}
+
+
+_cache = None
+
+
+def get_cache():
+    """The process-wide cache, stored in ``cfg.acinn_cache_dir``."""
+    global _cache
+    if _cache is None or _cache.directory != cfg.acinn_cache_dir:
+        _cache = AcinnCache(directory=cfg.acinn_cache_dir)
+    return _cache
 
 
 class AcinnData():
@@ -25,64 +365,103 @@ class AcinnData():
         """
         Initialize object:
         Input:
-            timespan: (1,3,7 days)
+            timespan: (1,3,7 days, None for archived data)
             station:  (innsbruck, ellboegen, sattelberg, obergurgl)
         """
         self.timespan = timespan
         self.station = station
 
-    def get_data(self):
-        """Read raw data"""
-        timestr = str(self.timespan)
-        url = 'http://acinn.uibk.ac.at/' + self.station + '/' + timestr
-        try:
-            response = urllib.request.urlopen(url)
-        except urllib.error.HTTPError:
-            raise Exception('could not read from URL')
-        except urllib.error.URLError:
-            raise Exception('could not read from URL')
-        self.raw_data = json.loads(response.read().decode())
+    def url(self):
+        """URL of the data"""
+        return cfg.acinn_url + self.station + '/' + str(self.timespan)
+
+    def get_data(self, timeout=None, retries=None, cache=True):
+        """Read raw data
+
+        Parameters:
+            timeout, retries: see http_request
+            cache: use the cached data if it is up to date (see AcinnCache)
+        """
+        if cache:
+            self.raw_data = get_cache().get(self.station, self.timespan,
+                                            timeout=timeout, retries=retries)
+        else:
+            body = http_get(self.url(), timeout=timeout, retries=retries)
+            self.raw_data = json.loads(body.decode())
         self.keys = []
 
+    def get_archived_data(self, start=None, end=None):
+        """Read raw data of any period out of the local archive
+        (see climvis.acinn_archive), instead of get_data
+
+        Parameters:
+            start, end: first and last time (str or datetime, naive is UTC)
+        """
+        # acinn_archive imports this module
+        from climvis import acinn_archive
+        self.raw_data = acinn_archive.get_archive().read(self.station,
+                                                         start, end)
+        self.keys = []
+
+    def __getattr__(self, name):
+        """Parameters not measured at this station are all NaN"""
+        if name in PARAMETERS and 'datumsec' in self.__dict__:
+            return np.full(len(self.__dict__['datumsec']), np.nan)
+        raise AttributeError('{!r} object has no attribute {!r}'.format(
+                             type(self).__name__, name))
+
     def conv_raw(self):
-        """ make data better accessible (.param) """
+        """ make data better accessible (.param), as float arrays
+        (missing values are NaN) """
         try:
             for key in self.raw_data.keys():
-                setattr(self, key, self.raw_data[key])
+                setattr(self, key, np.asarray(self.raw_data[key],
+                                              dtype=float))
                 self.keys.append(key)
         except AttributeError:
             raise Exception('you might have called get_data method first')
 
     def conv_date(self):
-        """ date & time conversions """
+        """ date & time conversions
+        timeutc: datetime64 (UTC), time: local time (Europe/Vienna) """
         try:
-            self.datumsec = [x / 1000 for x in self.datumsec]
-        except AttributeError:
+            self.datumsec = self.__dict__['datumsec'] / 1000
+        except KeyError:
             raise Exception('you might have called get_data method first')
-        self.timeutc = [datetime.utcfromtimestamp(x) for x in self.datumsec]
-        tz = pytz.timezone('Europe/Vienna')
-        self.time = [datetime.fromtimestamp(x, tz) for x in self.datumsec]
+        self.timeutc = pd.to_datetime(self.datumsec, unit='s')
+        self.time = self.timeutc.tz_localize('UTC').tz_convert(
+            'Europe/Vienna')
         self.keys.append('time')
 
     def conv_units(self):
         """ convert units & keys
-        pass if parameter not measured at this station"""
-        try:
-            self.kmwind = [x * 3.6 for x in self.ff]
+        NaN if parameter not measured at this station"""
+        self.kmwind = self.ff * 3.6
+        if 'ff' in self.keys:
             self.keys.append('kmwind')
-        except AttributeError:
-            pass
-        try:
-            self.rm = [x / 6 for x in self.rr]
-            self.crm = np.cumsum(self.rm)
+        self.rm = self.rr / 6
+        # missing values don't stop the accumulation
+        self.crm = np.where(np.isnan(self.rm), 0, self.rm).cumsum()
+        if 'rr' in self.keys:
             self.keys.append('rm')
-        except AttributeError:
-            pass
-        try:
-            self.sop = [x * 10 for x in self.so]
+        else:
+            self.crm[:] = np.nan
+        self.sop = self.so * 10
+        if 'so' in self.keys:
             self.keys.append('sop')
-        except AttributeError:
-            pass
+
+    def to_dataframe(self):
+        """ all parameters in a pd.DataFrame with a UTC datetime64 index
+        (needs conv_raw and conv_date) """
+        columns = [k for k in PARAMETERS + DERIVED if k in self.__dict__]
+        df = pd.DataFrame({k: getattr(self, k) for k in columns},
+                          index=pd.DatetimeIndex(self.timeutc, name='time'))
+        return df
+
+    def resample(self, freq):
+        """ hourly ('h'), daily ('D')... aggregates of all parameters in a
+        pd.DataFrame (see resample) """
+        return resample(self.to_dataframe(), freq)
 
     def make_dict(self):
         """Dictionary with meaningful names and units"""
@@ -113,3 +492,40 @@ class AcinnData():
             self.dict['sop'] = 'Sunshine duration [%]'
         if 'rf' in self.keys:
             self.dict['rf'] = 'Relative humidity [%]'
+
+
+def fetch_stations(stations=None, timespan=7, max_workers=None,
+                   timeout=None, retries=None):
+    """Read the raw data of several stations concurrently.
+
+    Parameters
+    ----------
+    stations : list of str, optional
+        the stations. Default: all of them (``STATIONS``)
+    timespan : int
+        1, 3, 7 days
+    max_workers : int, optional
+        the number of concurrent requests. Default: one per station
+    timeout, retries :
+        see http_get
+
+    Returns
+    -------
+    a dict station: AcinnData (after get_data) or, if the station could
+    not be read, the Exception
+    """
+    if stations is None:
+        stations = STATIONS
+    if max_workers is None:
+        max_workers = len(stations)
+
+    def fetch(station):
+        data = AcinnData(timespan, station)
+        try:
+            data.get_data(timeout=timeout, retries=retries)
+        except Exception as e:
+            return e
+        return data
+
+    with ThreadPoolExecutor(max(max_workers, 1)) as executor:
+        return dict(zip(stations, executor.map(fetch, stations)))
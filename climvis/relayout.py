@@ -0,0 +1,125 @@
+"""Rewrite the CRU data into a file optimised for point time series reads.
+
+The CRU TS files are stored time-major: reading the 1392 months of a
+single grid point touches data scattered across the whole file. The file
+written here stores ``tmp``, ``pre`` and the topography ``z`` on the same
+grid, in compressed chunks holding the full time series of a few
+neighbouring grid points, so that a point read is one or two chunk reads.
+
+:py:mod:`climvis.core` reads from this file (``cfg.cru_point_file``) when
+it exists and was built from the current CRU files.
+"""
+import os
+import numpy as np
+import netCDF4
+from climvis import cfg, pool
+
+
+def _copy_attrs(src, dst, skip=('_FillValue',)):
+    for name in src.ncattrs():
+        if name not in skip:
+            dst.setncattr(name, src.getncattr(name))
+
+
+def _create_like(nc, src, name, dims, chunksizes=None):
+    """Create a variable in ``nc`` with the type and attributes of ``src``."""
+    fill = src.getncattr('_FillValue') if '_FillValue' in src.ncattrs() \
+        else None
+    kwargs = {}
+    if chunksizes is not None:
+        kwargs = dict(zlib=True, complevel=1, chunksizes=chunksizes)
+    var = nc.createVariable(name, src.dtype, dims, fill_value=fill, **kwargs)
+    _copy_attrs(src, var)
+    return var
+
+
+def convert_cru(outpath=None, chunk=4, slab=None):
+    """Write the CRU tmp, pre and topography data into one location-chunked
+    netCDF4 file.
+
+    The data is processed in slabs of latitude rows to keep the memory usage
+    bounded.
+
+    Parameters
+    ----------
+    outpath : str, optional
+        the file to write. Default: ``cfg.cru_point_file``
+    chunk : int
+        the chunk size along latitude and longitude. Each chunk holds the
+        full time series of ``chunk x chunk`` grid points
+    slab : int, optional
+        the number of latitude rows to process at once. Default: ``chunk``
+
+    Returns
+    -------
+    the path to the file
+    """
+
+    if outpath is None:
+        outpath = cfg.cru_point_file
+    if slab is None:
+        slab = chunk
+    stamp = pool.file_stamp(cfg.cru_tmp_file, cfg.cru_pre_file,
+                            cfg.cru_topo_file)
+
+    # the topography is taken at the nearest point of the data grid
+    topo = pool.open_dataset(cfg.cru_topo_file).z
+    tmp_path = outpath + '.{}.tmp'.format(os.getpid())
+
+    with netCDF4.Dataset(cfg.cru_tmp_file) as nct, \
+            netCDF4.Dataset(cfg.cru_pre_file) as ncp, \
+            netCDF4.Dataset(tmp_path, 'w') as out:
+
+        for nc in [nct, ncp]:
+            nc.set_auto_maskandscale(False)
+        src_tmp = nct.variables['tmp']
+        src_pre = ncp.variables['pre']
+        if src_tmp.dimensions != ('time', 'lat', 'lon') or \
+                src_pre.shape != src_tmp.shape:
+            raise ValueError('Unexpected layout of the CRU files')
+        nt, ny, nx = src_tmp.shape
+
+        _copy_attrs(nct, out)
+        out.setncattr('source_stamp', stamp)
+        for dim, size in zip(src_tmp.dimensions, src_tmp.shape):
+            out.createDimension(dim, size)
+            _create_like(out, nct.variables[dim], dim, (dim,))
+            out.variables[dim][:] = nct.variables[dim][:]
+
+        chunks = (nt, min(chunk, ny), min(chunk, nx))
+        dims = ('time', 'lat', 'lon')
+        tmp = _create_like(out, src_tmp, 'tmp', dims, chunksizes=chunks)
+        pre = _create_like(out, src_pre, 'pre', dims, chunksizes=chunks)
+        z = out.createVariable('z', 'f4', ('lat', 'lon'), zlib=True,
+                               fill_value=np.float32(np.nan))
+        z.setncattr('long_name', 'elevation')
+        z.setncattr('units', 'm')
+        for var in [tmp, pre, z]:
+            var.set_auto_maskandscale(False)
+
+        lat = nct.variables['lat'][:]
+        lon = nct.variables['lon'][:]
+        z[:] = topo.sel(lat=lat, lon=lon, method='nearest').transpose(
+            'lat', 'lon').values
+
+        for j0 in range(0, ny, slab):
+            rows = slice(j0, min(j0 + slab, ny))
+            tmp[:, rows, :] = src_tmp[:, rows, :]
+            pre[:, rows, :] = src_pre[:, rows, :]
+
+    pool.close(outpath)
+    os.replace(tmp_path, outpath)
+    return outpath
+
+
+def is_current(path=None):
+    """Whether a file written by :py:func:`convert_cru` exists and was built
+    from the current CRU files.
+    """
+    if path is None:
+        path = cfg.cru_point_file
+    if not os.path.exists(path):
+        return False
+    stamp = pool.file_stamp(cfg.cru_tmp_file, cfg.cru_pre_file,
+                            cfg.cru_topo_file)
+    return pool.open_dataset(path).attrs.get('source_stamp') == stamp
@@ -0,0 +1,124 @@
+"""On-disk cache of the html reports written by :py:func:`core.write_html`.
+
+Many locations share the same CRU grid cell, and therefore the same
+figures. The reports are stored in one directory per key: (grid cell, map
+zoom, version of the data files, html template and climvis). The figures
+are rendered once per key, and each requested location gets its own
+(cheap) html page in the same directory.
+
+Old entries are evicted by age and total size.
+"""
+import os
+import time
+import shutil
+import hashlib
+import climvis
+from climvis import cfg, pool
+
+
+class ReportCache():
+    """A directory of cached reports."""
+
+    def __init__(self, directory, max_bytes=None, max_age=None):
+        """
+        Parameters
+        ----------
+        directory : str
+            where to store the reports
+        max_bytes : int, optional
+            the maximum total size of the reports. Default: no limit
+        max_age : float, optional
+            the maximum age (s) of a report since its last use.
+            Default: no limit
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+
+    def key(self, lon, lat, zoom):
+        """The key of the report of a grid point.
+
+        Parameters
+        ----------
+        lon : float
+            the longitude of the grid point
+        lat : float
+            the latitude of the grid point
+        zoom : int
+            the zoom level of the map
+
+        Returns
+        -------
+        a str
+        """
+        with open(cfg.html_tpl, 'rb') as f:
+            tpl_hash = hashlib.sha1(f.read()).hexdigest()
+        data_stamp = pool.file_stamp(cfg.cru_tmp_file, cfg.cru_pre_file,
+                                     cfg.cru_topo_file)
+        key = '{:.4f}|{:.4f}|{}|{}|{}|{}'.format(lon, lat, zoom, data_stamp,
+                                                 tpl_hash,
+                                                 climvis.__version__)
+        return hashlib.sha1(key.encode()).hexdigest()
+
+    def entry(self, key):
+        """The directory of a key (it might not exist)."""
+        return os.path.join(self.directory, key)
+
+    def touch(self, key):
+        """Mark an entry as used now."""
+        os.utime(self.entry(key))
+
+    def entries(self):
+        """The existing entries, with their last use time and size.
+
+        Returns
+        -------
+        a list of (key, time, bytes), the least recently used first
+        """
+        out = []
+        if not os.path.isdir(self.directory):
+            return out
+        for key in os.listdir(self.directory):
+            path = self.entry(key)
+            if not os.path.isdir(path):
+                continue
+            try:
+                size = sum(e.stat().st_size for e in os.scandir(path))
+                out.append((key, os.stat(path).st_mtime, size))
+            except FileNotFoundError:
+                # evicted by another process
+                continue
+        return sorted(out, key=lambda e: e[1])
+
+    def evict(self):
+        """Remove the entries which are too old, then the least recently
+        used ones until the cache is small enough.
+
+        Returns
+        -------
+        the list of removed keys
+        """
+        entries = self.entries()
+        removed = []
+        total = sum(e[2] for e in entries)
+        now = time.time()
+        for key, mtime, size in entries:
+            too_old = self.max_age is not None and now - mtime > self.max_age
+            too_big = self.max_bytes is not None and total > self.max_bytes
+            if not (too_old or too_big):
+                continue
+            shutil.rmtree(self.entry(key), ignore_errors=True)
+            removed.append(key)
+            total -= size
+        return removed
+
+    def clear(self):
+        """Remove all entries."""
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+def get_report_cache():
+    """The report cache in ``cfg.cache_dir``, with the limits of ``cfg``."""
+    return ReportCache(os.path.join(cfg.cache_dir, 'reports'),
+                       max_bytes=cfg.report_cache_max_bytes,
+                       max_age=cfg.report_cache_max_age)
@@ -0,0 +1,301 @@
+"""A long-running local HTTP service for the climvis reports.
+
+``cruvis serve`` starts an asyncio HTTP server with the endpoints:
+
+- ``/loc?lon=LON&lat=LAT[&zoom=Z]``: the climate report of a location
+- ``/city?name=CITY[&zoom=Z]``: the climate report of a city
+- ``/meteo?station=STATION&duration=DAYS``: the ACINN meteo report
+
+The endpoints redirect to the generated html file, served under
+``/files/``. The city index and the grid mask are kept in memory, the
+rendering runs in a pool of worker processes which keep the datasets and
+the plotting libraries loaded. Identical requests arriving while a report
+is being generated wait for the same result instead of rendering again.
+
+The meteo reports are written into a directory owned by the server (one
+file per station and duration, replaced at each request), which is
+removed when the server is closed.
+"""
+import os
+import shutil
+import asyncio
+import hashlib
+import mimetypes
+from collections import OrderedDict
+from tempfile import mkdtemp
+from urllib.parse import urlsplit, parse_qs, quote
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from climvis import cities, core, grid, read_acinn
+
+STATUS = {200: 'OK', 303: 'See Other', 400: 'Bad Request',
+          404: 'Not Found', 405: 'Method Not Allowed',
+          500: 'Internal Server Error'}
+
+
+class HTTPError(Exception):
+    """An error to send to the client."""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def _warm_worker():
+    """Load the libraries and indexes in a worker process."""
+    from climvis import plot_acinn  # noqa: F401 (imports bokeh)
+    grid.get_grid_index()
+    cities.get_city_index()
+
+
+def _write_loc(lon, lat, zoom):
+    return core.write_html(lon, lat, zoom=zoom, cache=True)
+
+
+def _write_meteo(station, duration, directory):
+    from climvis import plot_acinn
+    return plot_acinn.plot_both(station, duration,
+                                directory=os.path.join(directory,
+                                                       str(duration)))
+
+
+class ReportServer():
+    """Asyncio HTTP server generating the climvis reports."""
+
+    def __init__(self, host='127.0.0.1', port=8000, workers=None,
+                 executor=None, max_directories=1024):
+        """
+        Parameters
+        ----------
+        host : str
+            the address to listen on
+        port : int
+            the port to listen on (0: pick a free port)
+        workers : int, optional
+            the number of worker processes. Default: the number of CPUs
+        executor : concurrent.futures.Executor, optional
+            the executor running the rendering. Default: a pool of
+            ``workers`` processes, restarted if a worker dies
+        max_directories : int
+            the number of report directories served under ``/files/``.
+            The least recently requested ones are forgotten beyond that
+        """
+        self.host = host
+        self.port = port
+        self.workers = workers
+        self._owns_executor = executor is None
+        if executor is None:
+            executor = self._new_executor()
+        self.executor = executor
+        self.max_directories = max_directories
+        self.meteo_dir = mkdtemp(prefix='cruvis_meteo_')
+        self._inflight = {}
+        self._directories = OrderedDict()
+        self._server = None
+
+    def _new_executor(self):
+        return ProcessPoolExecutor(self.workers, initializer=_warm_worker)
+
+    def _replace_broken(self, executor):
+        """Start new workers in place of a broken process pool (only if
+        the server created it), returning the executor to use.
+        """
+        if self.executor is executor and self._owns_executor:
+            executor.shutdown(wait=False)
+            self.executor = self._new_executor()
+        return self.executor
+
+    async def _execute(self, func, *args):
+        loop = asyncio.get_running_loop()
+        executor = self.executor
+        try:
+            future = loop.run_in_executor(executor, func, *args)
+        except BrokenProcessPool:
+            # the workers died while idle: nothing was run yet
+            executor = self._replace_broken(executor)
+            future = loop.run_in_executor(executor, func, *args)
+        try:
+            return await future
+        except BrokenProcessPool:
+            # a worker died while rendering (e.g. killed by the OS for its
+            # memory usage): the next requests get new workers
+            self._replace_broken(executor)
+            raise HTTPError(500, 'A worker process died, try again')
+
+    async def run(self, key, func, *args):
+        """Run ``func(*args)`` in the executor, coalescing the concurrent
+        calls with the same key.
+        """
+        if key not in self._inflight:
+            future = asyncio.ensure_future(self._execute(func, *args))
+            self._inflight[key] = future
+            future.add_done_callback(lambda f: self._inflight.pop(key, None))
+        return await asyncio.shield(self._inflight[key])
+
+    def _file_url(self, path):
+        """The URL under which a generated file is served."""
+        directory, name = os.path.split(path)
+        token = hashlib.sha1(directory.encode()).hexdigest()[:16]
+        self._directories[token] = directory
+        self._directories.move_to_end(token)
+        while len(self._directories) > self.max_directories:
+            self._directories.popitem(last=False)
+        return '/files/{}/{}'.format(token, quote(name))
+
+    def _serve_file(self, parts):
+        if len(parts) != 2 or parts[0] not in self._directories:
+            raise HTTPError(404, 'File not found')
+        directory = self._directories[parts[0]]
+        if not os.path.isdir(directory):
+            # e.g. evicted from the report cache
+            del self._directories[parts[0]]
+            raise HTTPError(404, 'File not found')
+        path = os.path.join(directory, os.path.basename(parts[1]))
+        if not os.path.isfile(path):
+            raise HTTPError(404, 'File not found')
+        with open(path, 'rb') as f:
+            body = f.read()
+        ctype = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        return 200, ctype, body
+
+    async def _report(self, endpoint, query):
+        """Generate a report, returning the path to its html file."""
+
+        def param(name, conv=str, required=True):
+            if name not in query:
+                if not required:
+                    return None
+                raise HTTPError(400, 'Missing parameter: ' + name)
+            try:
+                return conv(query[name][0])
+            except ValueError:
+                raise HTTPError(400, 'Invalid parameter: ' + name)
+
+        try:
+            if endpoint == 'meteo':
+                station = param('station')
+                if station not in read_acinn.STATIONS:
+                    raise HTTPError(400, 'Unknown station: {}. Available: {}'
+                                    .format(station,
+                                            ', '.join(read_acinn.STATIONS)))
+                duration = param('duration', int)
+                return await self.run(('meteo', station, duration),
+                                      _write_meteo, station, duration,
+                                      self.meteo_dir)
+            zoom = param('zoom', int, required=False)
+            if endpoint == 'city':
+                lat, lon, _ = core.city_coord(param('name'))
+            else:
+                lon, lat = param('lon', float), param('lat', float)
+            if not grid.get_grid_index().is_valid(lon, lat):
+                raise HTTPError(404, 'No data available over the ocean. '
+                                     'Try for different location!')
+            return await self.run(('loc', lon, lat, zoom),
+                                  _write_loc, lon, lat, zoom)
+        except NameError as e:
+            raise HTTPError(404, str(e))
+        except ValueError as e:
+            raise HTTPError(400, str(e))
+
+    async def handle(self, method, target):
+        """Answer a request.
+
+        Returns
+        -------
+        the status, the content type and the body (bytes), or the status
+        and the location to redirect to
+        """
+        if method != 'GET':
+            raise HTTPError(405, 'Only GET requests are supported')
+        url = urlsplit(target)
+        parts = [p for p in url.path.split('/') if p]
+        if not parts:
+            raise HTTPError(404, 'Endpoints: /loc, /city, /meteo')
+        if parts[0] == 'files':
+            return self._serve_file(parts[1:])
+        if len(parts) == 1 and parts[0] in ['loc', 'city', 'meteo']:
+            path = await self._report(parts[0], parse_qs(url.query))
+            return 303, self._file_url(path)
+        raise HTTPError(404, 'Endpoints: /loc, /city, /meteo')
+
+    async def _on_connection(self, reader, writer):
+        headers = {}
+        try:
+            request = await reader.readline()
+            method, target, _ = request.decode('latin-1').split(' ', 2)
+            while True:
+                line = await reader.readline()
+                if line in [b'\r\n', b'\n', b'']:
+                    break
+            try:
+                result = await self.handle(method, target)
+            except HTTPError as e:
+                result = (e.status, 'text/plain; charset=utf-8',
+                          str(e).encode())
+            except Exception as e:
+                result = (500, 'text/plain; charset=utf-8',
+                          'Internal error: {}'.format(e).encode())
+            if len(result) == 2:
+                status, body = result[0], b''
+                headers['Location'] = result[1]
+            else:
+                status, ctype, body = result
+                headers['Content-Type'] = ctype
+        except ValueError:
+            status, body = 400, b'Malformed request'
+
+        headers['Content-Length'] = str(len(body))
+        headers['Connection'] = 'close'
+        head = ['HTTP/1.1 {} {}'.format(status, STATUS[status])]
+        head += ['{}: {}'.format(k, v) for k, v in headers.items()]
+        writer.write(('\r\n'.join(head) + '\r\n\r\n').encode('latin-1'))
+        writer.write(body)
+        try:
+            await writer.drain()
+        finally:
+            writer.close()
+
+    async def start(self):
+        """Load the indexes and start listening."""
+        grid.get_grid_index()
+        cities.get_city_index()
+        self._server = await asyncio.start_server(self._on_connection,
+                                                  self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def serve_forever(self):
+        """Start the server and run until cancelled."""
+        if self._server is None:
+            await self.start()
+        async with self._server:
+            await self._server.serve_forever()
+
+    def close(self):
+        """Stop listening, shut the workers down and remove the meteo
+        reports.
+        """
+        if self._server is not None:
+            self._server.close()
+        self.executor.shutdown()
+        shutil.rmtree(self.meteo_dir, ignore_errors=True)
+
+
+def serve(host='127.0.0.1', port=8000, workers=None):
+    """Run the report server until interrupted.
+
+    See :py:class:`ReportServer` for the parameters.
+    """
+    server = ReportServer(host=host, port=port, workers=workers)
+
+    async def main():
+        await server.start()
+        print('cruvis: serving on http://{}:{}/'.format(server.host,
+                                                        server.port))
+        await server.serve_forever()
+
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
@@ -0,0 +1,180 @@
+"""Climatologies, annual means and trends of many sites at once.
+
+The functions work on monthly arrays with the time as first axis and any
+other dimensions (sites, or lat and lon of a grid slab): the complete
+years are reshaped to (year, month, ...) and all the statistics are
+computed with array operations, without a loop over the sites. They also
+accept xarray DataArrays with a ``time`` dimension, and then return
+DataArrays.
+"""
+from collections import namedtuple
+import numpy as np
+import pandas as pd
+import xarray as xr
+from scipy import stats
+
+PERIOD = ('1981', '2010')
+
+Trend = namedtuple('Trend', ['slope', 'intercept', 'rvalue', 'pvalue',
+                             'stderr'])
+
+
+def _time_first(data, time):
+    """The values (time first), the times and the other coordinates."""
+    if isinstance(data, xr.DataArray):
+        dims = ['time'] + [d for d in data.dims if d != 'time']
+        data = data.transpose(*dims)
+        coords = {k: c for k, c in data.coords.items()
+                  if 'time' not in c.dims}
+        return data.values, data.time.values, (dims[1:], coords)
+    if time is None:
+        raise ValueError('The times are needed for arrays')
+    return np.asarray(data), np.asarray(time), None
+
+
+def _wrap(values, dim, labels, meta):
+    """The values as DataArray, if the input was one."""
+    if meta is None:
+        return values
+    dims, coords = meta
+    return xr.DataArray(values, dims=[dim] + dims,
+                        coords=dict(coords, **{dim: labels}))
+
+
+def by_year(data, time=None):
+    """Reshape monthly data to (year, month, ...).
+
+    Only the complete years (January to December) are kept.
+
+    Parameters
+    ----------
+    data : array or xr.DataArray
+        monthly data, time first (for arrays)
+    time : array of datetime64, optional
+        the times of the data (needed for arrays)
+
+    Returns
+    -------
+    the array of years and the (year, month, ...) array
+    """
+    values, time, _ = _time_first(data, time)
+    return _by_year(values, time)
+
+
+def _by_year(values, time):
+    months = pd.DatetimeIndex(time).month.values
+    years = pd.DatetimeIndex(time).year.values
+    i0 = np.argmax(months == 1) if (months == 1).any() else len(months)
+    nyears = (len(months) - i0) // 12
+    i1 = i0 + nyears * 12
+    if nyears and not (months[i0:i1].reshape(nyears, 12) ==
+                       np.arange(1, 13)).all():
+        raise ValueError('The data must be monthly, without gaps')
+    values = values[i0:i1].reshape((nyears, 12) + values.shape[1:])
+    return years[i0:i1:12], values
+
+
+def climatology(data, time=None, period=PERIOD):
+    """The mean annual cycle over a period.
+
+    Parameters
+    ----------
+    data : array or xr.DataArray
+        monthly data, time first (for arrays)
+    time : array of datetime64, optional
+        the times of the data (needed for arrays)
+    period : (str, str)
+        the first and last year
+
+    Returns
+    -------
+    the (month, ...) array of monthly means (month 1 to 12), or a
+    DataArray with a ``month`` dimension
+    """
+    values, time, meta = _time_first(data, time)
+    years, values = _by_year(values, time)
+    sel = (years >= int(period[0])) & (years <= int(period[1]))
+    clim = values[sel].mean(axis=0, dtype=np.float64)
+    return _wrap(clim, 'month', np.arange(1, 13), meta)
+
+
+def annual_means(data, time=None):
+    """The means of the complete years.
+
+    Returns
+    -------
+    the array of years and the (year, ...) array of annual means, or a
+    DataArray with a ``year`` dimension
+    """
+    values, time, meta = _time_first(data, time)
+    years, values = _by_year(values, time)
+    means = values.mean(axis=1, dtype=np.float64)
+    if meta is not None:
+        return years, _wrap(means, 'year', years, meta)
+    return years, means
+
+
+def linear_trend(y, x):
+    """Ordinary least squares fits of y = intercept + slope * x.
+
+    The regression is computed in closed form along the first axis of y,
+    for all the other dimensions at once. The results are the same as
+    ``scipy.stats.linregress`` for each series.
+
+    Parameters
+    ----------
+    y : array
+        the data, (x, ...)
+    x : array
+        the 1D regressor
+
+    Returns
+    -------
+    a Trend (slope, intercept, rvalue, pvalue, stderr) of arrays with the
+    shape of y without its first axis (the p-value is two-sided)
+    """
+    y = np.asarray(y, dtype=float)
+    x = np.asarray(x, dtype=float)
+    n = len(x)
+    xm = x - x.mean()
+    ym = y - y.mean(axis=0)
+    sxx = (xm ** 2).sum()
+    syy = (ym ** 2).sum(axis=0)
+    sxy = np.tensordot(xm, ym, axes=(0, 0))
+    slope = sxy / sxx
+    intercept = y.mean(axis=0) - slope * x.mean()
+    with np.errstate(invalid='ignore', divide='ignore'):
+        r = np.clip(sxy / np.sqrt(sxx * syy), -1, 1)
+        ssr = np.maximum(syy - slope * sxy, 0)
+        stderr = np.sqrt(ssr / (n - 2) / sxx)
+        t = slope / stderr
+    pvalue = 2 * stats.t.sf(np.abs(t), n - 2)
+    return Trend(slope, intercept, r, pvalue, stderr)
+
+
+def annual_trend(data, time=None, period=None):
+    """The linear trend of the annual means (per year).
+
+    Parameters
+    ----------
+    data : array or xr.DataArray
+        monthly data, time first (for arrays)
+    time : array of datetime64, optional
+        the times of the data (needed for arrays)
+    period : (str, str), optional
+        the first and last year. Default: all the complete years
+
+    Returns
+    -------
+    a Trend, see :py:func:`linear_trend`. Its fields are DataArrays for
+    DataArray input
+    """
+    years, means = annual_means(data, time)
+    if period is not None:
+        sel = (years >= int(period[0])) & (years <= int(period[1]))
+        years, means = years[sel], means[sel]
+    if not isinstance(means, xr.DataArray):
+        return linear_trend(means, years)
+    trend = linear_trend(means.values, years)
+    template = means.isel(year=0, drop=True)
+    return Trend(*[template.copy(data=v) for v in trend])
@@ -0,0 +1,114 @@
+"""Test fixtures: a private cache directory and a local stand-in for the
+ACINN data server.
+"""
+import os
+import json
+import time
+import hashlib
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import numpy as np
+import pytest
+from climvis import cfg, read_acinn
+
+
+@pytest.fixture(scope='session', autouse=True)
+def private_cache_dir(tmp_path_factory):
+    """Keep the caches of the test session out of the home directory."""
+    path = str(tmp_path_factory.mktemp('cruvis_cache'))
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setattr(cfg, 'cache_dir', path)
+        mp.setattr(cfg, 'acinn_archive_dir', os.path.join(path, 'acinn'))
+        mp.setattr(cfg, 'products_file',
+                   os.path.join(path, 'cru_products.nc'))
+        yield path
+
+
+def fake_acinn_data(station, days, end=None):
+    """ACINN-like json content: 10 min data of ``days`` days."""
+    if end is None:
+        end = int(time.time()) // 600 * 600
+    n = days * 144
+    datumsec = (end - 600 * np.arange(n)[::-1]) * 1000
+    rng = np.random.RandomState(len(station) + days)
+    data = {'datumsec': datumsec.tolist(),
+            'tl': (10 + 5 * np.sin(np.arange(n) / 144 * 2 * np.pi)).tolist(),
+            'dd': rng.uniform(0, 360, n).round(1).tolist(),
+            'ff': rng.gamma(2, 1.5, n).round(1).tolist(),
+            'p': rng.normal(950, 5, n).round(1).tolist(),
+            'so': rng.randint(0, 11, n).tolist(),
+            }
+    # some stations don't measure everything
+    if station != 'sattelberg':
+        data['tp'] = (data['tl'] - rng.uniform(1, 5, n)).tolist()
+        data['rr'] = rng.choice([0, 0, 0, 0.6, 1.2], n).tolist()
+        data['rf'] = rng.uniform(40, 100, n).round().tolist()
+    return data
+
+
+class FakeAcinn(BaseHTTPRequestHandler):
+
+    def setup(self):
+        super().setup()
+        self.server.connections += 1
+
+    def do_GET(self):
+        self.server.requests.append(self.path)
+        if self.server.fail > 0:
+            self.server.fail -= 1
+            self.send_error(503)
+            return
+        if self.server.delay:
+            time.sleep(self.server.delay)
+        try:
+            _, station, days = self.path.split('/')
+            days = int(days)
+        except ValueError:
+            self.send_error(404)
+            return
+        if station not in ['innsbruck', 'ellboegen', 'sattelberg',
+                           'obergurgl'] or days not in [1, 3, 7]:
+            self.send_error(404)
+            return
+        body = json.dumps(fake_acinn_data(station, days,
+                                          end=self.server.end)).encode()
+        etag = '"{}"'.format(hashlib.md5(body).hexdigest())
+        if self.server.etags and self.headers['If-None-Match'] == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        if self.server.etags:
+            self.send_header('ETag', etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def acinn_server(monkeypatch):
+    """Serve fake ACINN data locally and point cfg.acinn_url to it."""
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FakeAcinn)
+    server.protocol_version = 'HTTP/1.1'
+    FakeAcinn.protocol_version = 'HTTP/1.1'
+    server.requests = []
+    server.connections = 0
+    server.fail = 0
+    server.delay = 0
+    server.end = None
+    server.etags = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    monkeypatch.setattr(cfg, 'acinn_url',
+                        'http://127.0.0.1:{}/'.format(server.server_port))
+    monkeypatch.setattr(cfg, 'acinn_backoff', 0.01)
+    monkeypatch.setattr(read_acinn, '_cache', None)
+    yield server
+    server.shutdown()
+    server.server_close()
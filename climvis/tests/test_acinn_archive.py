@@ -0,0 +1,68 @@
+import time
+import numpy as np
+import pandas as pd
+import pytest
+from climvis import acinn_archive, cfg, read_acinn
+from climvis.read_acinn import AcinnData
+from climvis.tests.conftest import fake_acinn_data
+
+
+def test_append_read(tmpdir):
+
+    archive = acinn_archive.AcinnArchive(str(tmpdir))
+    assert archive.last_time('innsbruck') is None
+
+    # 7 days across a month change
+    end = int(time.mktime((2018, 12, 3, 12, 0, 0, 0, 0, 0)))
+    data = fake_acinn_data('innsbruck', 7, end=end)
+    data['tl'][10] = None
+    assert archive.append('innsbruck', data) == 1008
+    assert archive.months('innsbruck') == ['2018-11', '2018-12']
+    assert archive.last_time('innsbruck') == data['datumsec'][-1]
+
+    # nothing new
+    assert archive.append('innsbruck', fake_acinn_data('innsbruck', 1,
+                                                       end=end)) == 0
+    # one day more
+    later = fake_acinn_data('innsbruck', 3, end=end + 86400)
+    assert archive.append('innsbruck', later) == 144
+
+    raw = archive.read('innsbruck')
+    assert len(raw['datumsec']) == 1008 + 144
+    assert np.all(np.diff(raw['datumsec']) == 600000)
+    np.testing.assert_allclose(raw['dd'][:1008], data['dd'])
+    assert np.isnan(raw['tl'][10])
+
+    raw = archive.read('innsbruck', start='2018-12-01', end='2018-12-02')
+    assert len(raw['datumsec']) == 145
+    with pytest.raises(ValueError):
+        archive.read('innsbruck', start='2019-01-01')
+
+    # sattelberg doesn't measure dewpoint
+    archive.append('sattelberg', fake_acinn_data('sattelberg', 1, end=end))
+    assert 'tp' not in archive.read('sattelberg')
+
+
+def test_sync(acinn_server, tmpdir, monkeypatch):
+
+    monkeypatch.setattr(cfg, 'acinn_archive_dir', str(tmpdir))
+    now = int(time.time()) // 600 * 600
+    acinn_server.end = now - 2 * 86400
+    out = acinn_archive.sync_stations(['innsbruck', 'muenchen'])
+    assert out['innsbruck'] == 1008
+    assert isinstance(out['muenchen'], Exception)
+
+    # only the missing window is requested
+    monkeypatch.setattr(read_acinn, '_cache', None)
+    acinn_server.end = now
+    acinn_server.requests.clear()
+    out = acinn_archive.sync_stations(['innsbruck'])
+    assert out['innsbruck'] == 288
+    assert acinn_server.requests == ['/innsbruck/3']
+
+    data = AcinnData(None, 'innsbruck')
+    data.get_archived_data(start=pd.Timestamp(now - 10 * 86400, unit='s'))
+    data.conv_raw()
+    data.conv_date()
+    assert len(data.timeutc) == 1008 + 288
+    assert data.timeutc[-1].value // 10**9 == now
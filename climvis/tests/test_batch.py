@@ -0,0 +1,48 @@
+import os
+import numpy as np
+import pandas as pd
+from climvis import batch
+
+
+def _write_sites(path):
+    with open(path, 'w') as f:
+        f.write('name,lon,lat,city\n'
+                'Innsbruck,11.4,47.27,\n'
+                'ocean,47,12,\n'
+                ',,,Paris\n'
+                'typo,,,Insbruk\n'
+                'Wien centre,16.37,48.21,\n')
+
+
+def test_read_sites(tmpdir):
+
+    fpath = str(tmpdir.join('sites.csv'))
+    _write_sites(fpath)
+    sites = batch.read_sites(fpath)
+    assert list(sites.name) == ['Innsbruck', 'ocean', 'Paris', 'typo',
+                                'Wien centre']
+    np.testing.assert_allclose(sites.lon[2], 2.3487999)
+    assert sites.error[0] is None
+    assert 'Location not listed' in sites.error[3]
+
+
+def test_run_batch(tmpdir):
+
+    fpath = str(tmpdir.join('sites.csv'))
+    _write_sites(fpath)
+
+    for workers in [1, 2]:
+        outdir = str(tmpdir.join('out{}'.format(workers)))
+        summary = batch.run_batch(fpath, outdir, workers=workers,
+                                  chunksize=2)
+        assert os.path.exists(os.path.join(outdir, 'summary.csv'))
+        ok = summary.error.isnull()
+        assert list(ok) == [True, False, True, False, True]
+        assert 'ocean' in summary.error[1]
+        for path in summary.path[ok]:
+            assert os.path.exists(path)
+        assert summary.path[4] == os.path.join(outdir, '0004_Wien_centre',
+                                               'index.html')
+
+    dfs = pd.read_csv(os.path.join(outdir, 'summary.csv'))
+    assert len(dfs) == 5
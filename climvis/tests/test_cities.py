@@ -0,0 +1,131 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pytest
+from climvis import cfg, cities, core
+
+
+@pytest.fixture
+def cache_dir(tmpdir, monkeypatch):
+    path = str(tmpdir.join('cache'))
+    monkeypatch.setattr(cfg, 'cache_dir', path)
+    monkeypatch.setattr(cities, '_index', None)
+    return path
+
+
+def test_city_index(cache_dir):
+
+    index = cities.get_city_index()
+    assert len(index) > 10000
+    assert os.path.exists(os.path.join(cache_dir, 'world_cities.npz'))
+    assert cities.get_city_index() is index
+
+    # read from disk
+    cities._index = None
+    index2 = cities.get_city_index()
+    assert index2 is not index
+    assert len(index2) == len(index)
+    np.testing.assert_equal(index2.name, index.name)
+    np.testing.assert_equal(index2.lat, index.lat)
+
+
+def test_find_cities(cache_dir):
+
+    found = cities.find_cities('InnSBruck')
+    assert len(found) == 1
+    assert found[0]['country'] == 'Austria'
+    assert found[0]['lat'] == 47.2666667
+
+    # ambiguous names
+    found = cities.find_cities('armenia')
+    assert len(found) == 2
+    found = cities.find_cities('Armenia, el salvador')
+    assert len(found) == 1
+    assert found[0]['country'] == 'El Salvador'
+
+    # countries with commas
+    found = cities.find_cities('Anyang,Korea, South')
+    assert len(found) == 1
+    assert found[0]['country'] == 'Korea, South'
+
+    assert cities.find_cities('InnSBruc') == []
+    assert cities.find_cities('Innsbruck,France') == []
+    assert cities.find_cities('') == []
+
+
+def test_edit_distance():
+
+    assert cities.edit_distance('innsbruck', 'innsbruck') == 0
+    assert cities.edit_distance('insbruck', 'innsbruck') == 1
+    assert cities.edit_distance('innsbruck', 'insbruk') == 2
+    assert cities.edit_distance('', 'abc') == 3
+    assert cities.edit_distance('kitten', 'sitting') == 3
+    assert cities.edit_distance('kitten', 'sitting', max_distance=1) == 2
+
+
+def test_autocomplete(cache_dir):
+
+    found = cities.autocomplete('InnS')
+    assert [f['name'] for f in found] == ['Innsbruck']
+
+    names = [f['name'].lower() for f in cities.autocomplete('san', limit=5)]
+    assert len(set(names)) == 5
+    assert all(n.startswith('san') for n in names)
+    assert names == sorted(names)
+
+    assert cities.autocomplete('xqz') == []
+
+
+def test_search_cities(cache_dir):
+
+    found = cities.search_cities('Insbruk')
+    assert found[0]['name'] == 'Innsbruck'
+    found = cities.search_cities('los angles')
+    assert found[0]['name'] == 'Los Angeles'
+    assert all(f['name'] != 'Innsbruck'
+               for f in cities.search_cities('Insbruk', max_distance=1))
+    assert cities.search_cities('xq') == []
+
+
+def test_search_threads(cache_dir):
+
+    # the first searches build the search index concurrently
+    index = cities.get_city_index()
+    with ThreadPoolExecutor(8) as executor:
+        found = list(executor.map(lambda n: index.search(n)[:1],
+                                  ['Insbruk'] * 8 + ['Par'] * 8))
+    assert len({tuple(f) for f in found[:8]}) == 1
+    assert len(found[0]) == 1
+
+
+def test_nearest_cities(cache_dir):
+
+    found = cities.nearest_cities(11.4, 47.27, k=3)
+    assert [f['name'] for f in found] == ['Innsbruck', 'Rum', 'Schwaz']
+    assert found[0]['distance'] < 1000
+
+    # same as brute force
+    index = cities.get_city_index()
+    dis = core.haversine(-70, -30, index.lon, index.lat)
+    found = cities.nearest_cities(-70, -30, k=5)
+    np.testing.assert_allclose([f['distance'] for f in found],
+                               np.sort(dis)[:5])
+
+    # across the date line
+    found = cities.nearest_cities(179.9, -17, k=1)[0]
+    assert found['distance'] == np.min(core.haversine(179.9, -17,
+                                                      index.lon, index.lat))
+
+
+def test_cities_within(cache_dir):
+
+    found = cities.cities_within(11.4, 47.27, 30000)
+    assert [f['name'] for f in found] == ['Innsbruck', 'Rum', 'Schwaz',
+                                          'Telfs']
+
+    index = cities.get_city_index()
+    dis = core.haversine(2.35, 48.85, index.lon, index.lat)
+    found = cities.cities_within(2.35, 48.85, 500000)
+    assert len(found) == np.sum(dis <= 500000)
+    assert found[0]['name'] == 'Paris'
+    assert cities.cities_within(-30, -50, 1000) == []
@@ -1,7 +1,12 @@
 # Testing command line interfaces is hard. But we'll try
 # At least we separated our actual program from the I/O part so that we
 # can test that
+import sys
+import time
+import subprocess
+import pytest
 import climvis
+from climvis import cfg
 from climvis.cli import cruvis_io
 
 
@@ -29,6 +34,49 @@ def test_version(capsys):
     assert climvis.__version__ in captured.out
 
 
+def test_lazy_imports(tmpdir):
+
+    # The simple commands must not import the heavy libraries, nor need
+    # the .cruvis file (the empty home directory has none)
+    heavy = ['xarray', 'pandas', 'matplotlib', 'bokeh', 'scipy', 'netCDF4']
+    code = ('import sys\n'
+            'from climvis.cli import cruvis_io\n'
+            'cruvis_io(["--help"])\n'
+            'cruvis_io(["--version"])\n'
+            'print([m for m in {} if m in sys.modules])\n'.format(heavy))
+    env = {'HOME': str(tmpdir), 'PATH': '', 'PYTHONPATH': ':'.join(sys.path)}
+
+    def run(code):
+        # best of three, to be robust against a busy machine
+        elapsed = []
+        for _ in range(3):
+            t0 = time.perf_counter()
+            out = subprocess.run([sys.executable, '-c', code], env=env,
+                                 stdout=subprocess.PIPE,
+                                 stderr=subprocess.PIPE,
+                                 universal_newlines=True, check=True)
+            elapsed.append(time.perf_counter() - t0)
+        return out, min(elapsed)
+
+    out, elapsed = run(code)
+    _, baseline = run('pass')
+    # importing pandas alone takes longer than this
+    assert elapsed < baseline + 0.3
+    assert out.stdout.strip().endswith('[]'), out.stdout
+
+    # the package itself still exposes the main functions
+    assert callable(climvis.write_html)
+    assert climvis.haversine(34, 42, 35, 42) > 0
+
+    # and its submodules after a bare import
+    out, _ = run('import climvis\n'
+                 'print(climvis.core.__name__, climvis.graphics.__name__)\n'
+                 'print("stats" in dir(climvis))')
+    assert out.stdout.split() == ['climvis.core', 'climvis.graphics', 'True']
+    with pytest.raises(AttributeError):
+        climvis.nothing
+
+
 def test_print_html(capsys):
 
     cruvis_io(['-l', '12.1', '47.3', '--no-browser'])
@@ -60,3 +108,66 @@ def test_error(capsys):
     captured = capsys.readouterr()
     string = 'cruvis --meteo needs station and duration parameters'
     assert string in captured.out
+
+
+def test_convert(capsys, tmpdir):
+
+    fpath = str(tmpdir.join('point.nc'))
+    cruvis_io(['--convert', fpath])
+    captured = capsys.readouterr()
+    assert 'File successfully generated at: ' + fpath in captured.out
+
+
+def test_batch(capsys, tmpdir):
+
+    fpath = str(tmpdir.join('sites.csv'))
+    with open(fpath, 'w') as f:
+        f.write('lon,lat\n11.4,47.27\n47,12\n')
+    outdir = str(tmpdir.join('out'))
+    cruvis_io(['--batch', fpath, '--out', outdir, '--workers', '1'])
+    captured = capsys.readouterr()
+    assert '1 reports generated in ' + outdir + ', 1 failed' in captured.out
+
+    cruvis_io(['--batch', fpath])
+    captured = capsys.readouterr()
+    assert 'cruvis --batch needs a csv file' in captured.out
+
+
+def test_sync_archive(capsys, tmpdir, acinn_server, monkeypatch):
+
+    monkeypatch.setattr(cfg, 'acinn_archive_dir', str(tmpdir))
+    cruvis_io(['--sync', 'sattelberg', 'muenchen'])
+    captured = capsys.readouterr()
+    assert 'sattelberg: 1008 new records' in captured.out
+    assert 'muenchen: could not be updated' in captured.out
+
+    start = time.strftime('%Y-%m-%d %H:%M', time.gmtime(time.time() - 86400))
+    cruvis_io(['-m', 'sattelberg', '--start', start, '--no-browser'])
+    captured = capsys.readouterr()
+    assert 'File successfully generated at:' in captured.out
+    assert len(acinn_server.requests) == 2
+
+
+def test_dashboard(capsys, tmpdir, acinn_server):
+
+    outpath = str(tmpdir.join('dashboard.html'))
+    cruvis_io(['--dashboard', 'innsbruck', 'ellboegen', '--duration', '1',
+               '--out', outpath, '--sidecar', '--no-browser'])
+    captured = capsys.readouterr()
+    assert 'File successfully generated at: ' + outpath in captured.out
+    assert tmpdir.join('ellboegen.json').exists()
+    assert sorted(acinn_server.requests) == ['/ellboegen/1', '/innsbruck/1']
+
+    cruvis_io(['--dashboard', '--out', outpath, '--data-only'])
+    captured = capsys.readouterr()
+    assert 'Data successfully updated in: ' + str(tmpdir) in captured.out
+    assert tmpdir.join('obergurgl.json').exists()
+
+
+def test_products(capsys, tmpdir, monkeypatch):
+
+    monkeypatch.setattr(cfg, 'products_file', str(tmpdir.join('p.nc')))
+    cruvis_io(['--products', str(tmpdir)])
+    captured = capsys.readouterr()
+    assert 'Map successfully generated at: ' + str(tmpdir.join(
+        'tmp_trend.png')) in captured.out
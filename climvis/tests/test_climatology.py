@@ -0,0 +1,77 @@
+import os
+import numpy as np
+import pandas as pd
+import pytest
+import matplotlib as mpl
+import matplotlib.pyplot as plt
+from climvis import cfg, core, climatology, graphics
+
+
+@pytest.fixture
+def cache_dir(tmpdir, monkeypatch):
+    path = str(tmpdir.join('cache'))
+    monkeypatch.setattr(cfg, 'cache_dir', path)
+    monkeypatch.setattr(climatology, '_cache', None)
+    return path
+
+
+def test_get_climatology(cache_dir):
+
+    df_cities = pd.read_csv(cfg.world_cities)
+    dfi = df_cities.loc[df_cities.Name.str.contains('innsbruck', case=False,
+                                                    na=False)].iloc[0]
+
+    dfc = climatology.get_climatology(dfi.Lon, dfi.Lat)
+    assert os.path.exists(os.path.join(cache_dir, 'climatology.npy'))
+    assert len(dfc) == 12
+
+    # compare with the full time series
+    df = core.get_cru_timeseries(dfi.Lon, dfi.Lat)
+    ref = df.loc['1981':'2010']
+    ref = ref.groupby(ref.index.month).mean()
+    np.testing.assert_allclose(dfc.tmp, ref.tmp, rtol=1e-5)
+    np.testing.assert_allclose(dfc.pre, ref.pre, rtol=1e-5)
+    assert dfc.lon[1] == df.lon[0]
+    assert dfc.grid_point_elevation == df.grid_point_elevation
+    assert dfc.distance_to_grid_point == df.distance_to_grid_point
+
+    t, p = climatology.get_annual_means(dfi.Lon, dfi.Lat)
+    np.testing.assert_allclose(t, ref.tmp.mean(), rtol=1e-5)
+    np.testing.assert_allclose(p, ref.pre.mean(), rtol=1e-5)
+    t, p = climatology.get_annual_means([dfi.Lon, 47], [dfi.Lat, 12])
+    assert np.isfinite(t[0]) and np.isnan(t[1])
+
+    # the figure is the same
+    fig = graphics.plot_annual_cycle(dfc)
+    ref = 'Climate diagram at location (11.25°, 47.25°)'
+    test = [ref in t.get_text() for t in fig.findobj(mpl.text.Text)]
+    assert np.any(test)
+    plt.close()
+    # and the input is left unchanged
+    np.testing.assert_equal(dfc.index, np.arange(1, 13))
+
+
+def test_stale_cache(cache_dir):
+
+    climatology.build_climatology_cache()
+    cache = climatology._get_cache()
+    assert climatology._get_cache() is cache
+
+    # a cache built from other files is rebuilt
+    climatology._cache = None
+    meta = os.path.join(cache_dir, 'climatology.npz')
+    with np.load(meta) as f:
+        data = dict(f)
+    data['stamp'] = 'outdated'
+    np.savez(meta, **data)
+    cache = climatology._get_cache()
+    assert cache.stamp == climatology._source_stamp()
+
+    # a rebuild replaces the files: the arrays mapped before are untouched
+    old = np.array(cache.clim)
+    inode = os.stat(cache.clim.filename).st_ino
+    climatology.build_climatology_cache()
+    assert os.stat(cache.clim.filename).st_ino != inode
+    np.testing.assert_array_equal(cache.clim, old)
+    assert sorted(os.listdir(cache_dir)) == ['annual.npy', 'climatology.npy',
+                                             'climatology.npz']
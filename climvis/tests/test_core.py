@@ -4,6 +4,7 @@ import os
 import pytest
 import numpy as np
 import pandas as pd
+import xarray as xr
 
 from climvis import core, cfg
 
@@ -49,6 +50,93 @@ def test_get_ts():
     assert np.abs(dfm.ref - dfm.tmp_cor) < np.abs(dfm.ref - dfm.tmp)
 
 
+def test_get_ts_batch():
+
+    df_cities = pd.read_csv(cfg.world_cities)
+    dfi = df_cities.loc[df_cities.Name.str.contains('innsbruck', case=False,
+                                                    na=False)].iloc[0]
+
+    # two points in the same grid cell, one far away
+    lons = [dfi.Lon, dfi.Lon + 0.01, 16.37]
+    lats = [dfi.Lat, dfi.Lat + 0.01, 48.21]
+    ds = core.get_cru_timeseries_batch(lons, lats)
+    assert ds.sizes['site'] == 3
+    np.testing.assert_allclose(ds.query_lon, lons)
+    np.testing.assert_allclose(ds.tmp.isel(site=0), ds.tmp.isel(site=1))
+    assert np.all(ds.distance_to_grid_point < 50000)
+
+    # same as selecting the nearest grid points in the files
+    with xr.open_dataset(cfg.cru_tmp_file) as dst, \
+            xr.open_dataset(cfg.cru_pre_file) as dsp, \
+            xr.open_dataset(cfg.cru_topo_file) as dsz:
+        for i in range(3):
+            tmp = dst.tmp.sel(lon=lons[i], lat=lats[i], method='nearest')
+            pre = dsp.pre.sel(lon=lons[i], lat=lats[i], method='nearest')
+            z = dsz.z.sel(lon=lons[i], lat=lats[i], method='nearest')
+            dfb = core.site_dataframe(ds, i)
+            np.testing.assert_allclose(dfb.tmp, tmp)
+            np.testing.assert_allclose(dfb.pre, pre)
+            assert dfb.lon[0] == float(tmp.lon)
+            assert dfb.lat[0] == float(tmp.lat)
+            assert dfb.grid_point_elevation == float(z)
+
+    with pytest.raises(ValueError):
+        core.get_cru_timeseries_batch([1, 2], [3])
+    for lon, lat in [(np.nan, 47), (11, np.nan), (11, 95), (400, 47)]:
+        with pytest.raises(ValueError, match='Invalid location'):
+            core.get_cru_timeseries_batch([11.4, lon], [47.3, lat])
+
+
+@pytest.mark.parametrize('scheduler', ['threads', 'processes',
+                                       'synchronous', 'distributed'])
+def test_get_ts_batch_chunked(monkeypatch, scheduler):
+
+    pytest.importorskip('dask')
+    if scheduler == 'distributed':
+        pytest.importorskip('distributed')
+    lons, lats = [11.38, 11.39, 16.37, 2.35], [47.26, 47.27, 48.21, 48.85]
+    ref = core.get_cru_timeseries_batch(lons, lats)
+
+    monkeypatch.setattr(cfg, 'dask_chunks', {'time': 100, 'lat': 30,
+                                             'lon': 30})
+    monkeypatch.setattr(cfg, 'dask_scheduler', scheduler)
+    monkeypatch.setattr(cfg, 'dask_workers', 2)
+    ds = core.get_cru_timeseries_batch(lons, lats)
+    assert not ds.tmp.chunks
+    np.testing.assert_allclose(ds.tmp, ref.tmp)
+    np.testing.assert_allclose(ds.pre, ref.pre)
+    np.testing.assert_allclose(ds.grid_point_elevation,
+                               ref.grid_point_elevation)
+
+
+def test_chunked_memory_limit(monkeypatch):
+
+    monkeypatch.setattr(cfg, 'dask_memory_limit', 1000)
+    monkeypatch.setattr(cfg, 'dask_workers', 2)
+    core._check_memory(500)
+    with pytest.raises(ValueError, match='dask_memory_limit'):
+        core._check_memory(600)
+    monkeypatch.setattr(cfg, 'dask_scheduler', 'synchronous')
+    core._check_memory(600)
+    # enforced by the workers themselves
+    monkeypatch.setattr(cfg, 'dask_scheduler', 'distributed')
+    core._check_memory(2000)
+
+    pytest.importorskip('dask')
+    monkeypatch.setattr(cfg, 'dask_scheduler', 'threads')
+    monkeypatch.setattr(cfg, 'dask_chunks', {'time': 100})
+    with pytest.raises(ValueError, match='dask_memory_limit'):
+        core.get_cru_timeseries(11.38, 47.26)
+
+
+def test_chunked_needs_dask(monkeypatch):
+
+    monkeypatch.setattr(cfg, 'dask_chunks', {'time': 100})
+    monkeypatch.setattr(core, 'dask', None)
+    with pytest.raises(ImportError):
+        core.get_cru_timeseries(11.38, 47.26)
+
+
 def test_city_coord():
 
     # test that city is found even if capital letters in between
@@ -60,6 +148,10 @@ def test_city_coord():
     with pytest.raises(NameError, match='Location not listed. '):
         lat, lon, elevation = core.city_coord('InnSBruc')
 
+    # similar names are suggested
+    with pytest.raises(NameError, match='Did you mean: Innsbruck'):
+        core.city_coord('Insbruck')
+
 
 def test_get_url():
 
@@ -78,10 +170,87 @@ def test_write_html(tmpdir):
                                                     na=False)].iloc[0]
 
     dir = str(tmpdir.join('html_dir'))
-    core.write_html(dfi.Lon, dfi.Lat, directory=dir)
+    path = core.write_html(dfi.Lon, dfi.Lat, directory=dir)
     assert os.path.isdir(dir)
+    with open(path) as f:
+        assert 'Nearest listed city: Innsbruck (Austria)' in f.read()
 
     # test for location over the ocean
     string = 'No data available over the ocean. '
     with pytest.raises(ValueError, match=string):
         core.write_html(47, 12, directory=dir)
+
+    # or snap to the nearest land point
+    path = core.write_html(47, 12, directory=dir, snap=True)
+    assert os.path.exists(path)
+
+
+def test_region_mask():
+
+    lon, lat = np.arange(0.25, 5), np.arange(40.25, 45)
+    mask = core.region_mask(lon, lat, box=(1, 41, 3, 42.5))
+    assert mask.shape == (5, 5)
+    np.testing.assert_equal(np.nonzero(mask.any(axis=1))[0], [1, 2])
+    np.testing.assert_equal(np.nonzero(mask.any(axis=0))[0], [1, 2])
+    # lower left half of the grid
+    mask = core.region_mask(lon, lat, polygon=[(0, 40), (5, 40), (0, 45)])
+    assert mask.sum() == 15
+    assert mask[0, 0] and not mask[4, 4]
+    with pytest.raises(ValueError):
+        core.region_mask(lon, lat)
+
+    # a box across the antimeridian
+    lon = np.arange(-179.75, 180, 0.5)
+    mask = core.region_mask(lon, lat, box=(170, 41, -170, 42))
+    np.testing.assert_allclose(lon[mask.any(axis=0)],
+                               np.r_[-179.75:-170:0.5, 170.25:180:0.5])
+    np.testing.assert_equal(np.nonzero(mask.any(axis=1))[0], [1])
+
+
+def test_get_ts_regional(tmpdir):
+
+    # one grid point: same as the point time series
+    df1 = core.get_cru_timeseries(11.25, 47.25)
+    df = core.get_cru_regional_timeseries(box=(11.1, 47.1, 11.4, 47.4))
+    assert df.n_grid_points == 1
+    np.testing.assert_allclose(df.tmp, df1.tmp, rtol=1e-6)
+    np.testing.assert_allclose(df.pre, df1.pre, rtol=1e-6)
+    assert df.grid_point_elevation == df1.grid_point_elevation
+
+    # area-weighted mean of four grid points, in slabs
+    lons, lats = [10.75, 11.25, 10.75, 11.25], [46.75, 46.75, 47.25, 47.25]
+    ds = core.get_cru_timeseries_batch(lons, lats)
+    w = np.cos(np.deg2rad(lats))
+    box = (10.5, 46.5, 11.5, 47.5)
+    df = core.get_cru_regional_timeseries(box=box, slab=50)
+    assert df.n_grid_points == 4
+    np.testing.assert_allclose(df.tmp, (ds.tmp * w).sum('site') / w.sum(),
+                               rtol=1e-5)
+    np.testing.assert_allclose(df.lat, np.average(lats, weights=w))
+    assert df.index.equals(df1.index)
+
+    # the same region as a polygon
+    polygon = [(10.5, 46.5), (11.5, 46.5), (11.5, 47.5), (10.5, 47.5)]
+    dfp = core.get_cru_regional_timeseries(polygon=polygon)
+    np.testing.assert_allclose(dfp.tmp, df.tmp)
+    np.testing.assert_allclose(dfp.pre, df.pre)
+
+    with pytest.raises(ValueError, match='No data available'):
+        core.get_cru_regional_timeseries(box=(47, 12, 47.2, 12.2))
+
+    # the regional data goes into a report
+    path = core.write_html(df.lon[0], df.lat[0], df=df,
+                           directory=str(tmpdir))
+    with open(path) as f:
+        assert 'Selected point: box (10.5, 46.5, 11.5, 47.5)' in f.read()
+    assert os.path.exists(os.path.join(str(tmpdir), 'annual_cycle.png'))
+
+
+def test_city_coord_country():
+
+    lat, lon, elevation = core.city_coord('Armenia,Colombi')
+    assert lat == 4.5338889
+    lat, lon, elevation = core.city_coord('Armenia, El Salvador')
+    assert lat == 13.7436111
+    with pytest.raises(NameError, match='Location not listed. '):
+        core.city_coord('Innsbruck,Italy')
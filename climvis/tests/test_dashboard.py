@@ -0,0 +1,78 @@
+import os
+import json
+import numpy as np
+from bokeh.models import AjaxDataSource
+from bokeh.plotting.figure import Figure
+from climvis import dashboard, plot_acinn
+
+
+def test_station_columns(acinn_server):
+
+    data = plot_acinn.read_conv_data('innsbruck', 1)
+    cols = dashboard.station_columns(data)
+    assert sorted(cols) == sorted(dashboard.COLUMNS)
+    assert np.all(np.diff(cols['time']) == 600000)
+    np.testing.assert_allclose(cols['tl'], data.tl)
+    np.testing.assert_allclose(cols['crm'], data.crm)
+
+    cols = dashboard.station_columns(data, freq='h')
+    assert np.all(np.diff(cols['time']) == 3600000)
+    np.testing.assert_allclose(cols['crm'][-1], data.crm[-1])
+
+    # no precipitation at sattelberg
+    data = plot_acinn.read_conv_data('sattelberg', 1)
+    cols = dashboard.station_columns(data)
+    assert np.isnan(cols['crm']).all()
+
+
+def test_plot_dashboard(acinn_server, tmpdir):
+
+    outpath = str(tmpdir.join('inline', 'dashboard.html'))
+    os.makedirs(os.path.dirname(outpath))
+    path = dashboard.plot_dashboard(stations=['innsbruck', 'sattelberg',
+                                              'muenchen'],
+                                    duration=3, outpath=outpath)
+    assert path == outpath
+    inline_size = os.path.getsize(path)
+    assert inline_size > 0
+
+    # sidecar data
+    outpath = str(tmpdir.join('sidecar', 'dashboard.html'))
+    dashboard.plot_dashboard(stations=['innsbruck', 'sattelberg'],
+                             duration=3, outpath=outpath, sidecar=True)
+    assert os.path.getsize(outpath) < inline_size / 2
+    with open(str(tmpdir.join('sidecar', 'innsbruck.json'))) as f:
+        data = json.load(f)
+    assert len(data['time']) == 3 * 144
+    with open(str(tmpdir.join('sidecar', 'sattelberg.json'))) as f:
+        assert json.load(f)['tp'][0] is None
+
+    # refreshing only rewrites the data
+    acinn_server.requests.clear()
+    out = dashboard.write_dashboard_data(str(tmpdir.join('sidecar')),
+                                         stations=['innsbruck'])
+    assert out['innsbruck'].endswith('innsbruck.json')
+
+
+def test_dashboard_models(acinn_server, monkeypatch, tmpdir):
+
+    # inspect the document instead of the html
+    saved = {}
+    monkeypatch.setattr(dashboard, 'save',
+                        lambda obj, **kw: saved.update(obj=obj))
+    outpath = str(tmpdir.join('dashboard.html'))
+    dashboard.plot_dashboard(stations=['innsbruck', 'ellboegen'],
+                             outpath=outpath)
+    figures = list(saved['obj'].select({'type': Figure}))
+    assert len(figures) == 6
+    # one data source per station, one shared time axis
+    sources = {r.data_source.id for p in figures for r in p.renderers}
+    assert len(sources) == 2
+    assert len({p.x_range.id for p in figures}) == 1
+
+    dashboard.plot_dashboard(stations=['innsbruck'], outpath=outpath,
+                             sidecar=True)
+    figures = list(saved['obj'].select({'type': Figure}))
+    source = figures[0].renderers[0].data_source
+    assert isinstance(source, AjaxDataSource)
+    assert source.data_url == 'innsbruck.json'
@@ -26,3 +26,47 @@ def test_annual_cycle(tmpdir):
     assert os.path.exists(fpath)
 
     plt.close()
+
+
+def test_renderer(tmpdir):
+
+    renderer = graphics.FigureRenderer()
+    nfigs = len(plt.get_fignums())
+    for lon, lat in [(11.4, 47.27), (-70.6, -33.4)]:
+        df = core.get_cru_timeseries(lon, lat)
+        fpath = str(tmpdir.join('annual_cycle.png'))
+        fig = renderer.annual_cycle(df, filepath=fpath)
+        assert os.path.exists(fpath)
+        ref = 'Climate diagram at location ({}°, {}°)'.format(
+            df.lon.iloc[0], df.lat.iloc[0])
+        assert any(ref in t.get_text() for t in fig.findobj(mpl.text.Text))
+        clim = df.loc['1981':'2010'].groupby(df.loc['1981':'2010']
+                                             .index.month).mean()
+        heights = [b.get_height() for b in renderer._bars]
+        np.testing.assert_allclose(heights, clim.pre)
+        # the data is within the axes
+        ylim = renderer._tmp_ax.get_ylim()
+        assert ylim[0] <= clim.tmp.min() and clim.tmp.max() <= ylim[1]
+
+        fpath = str(tmpdir.join('time_line.png'))
+        fig = renderer.time_series(df, filepath=fpath)
+        assert os.path.exists(fpath)
+        ref = 'Temperature time series at location ({}°, {}°)'.format(
+            df.lon.iloc[0], df.lat.iloc[0])
+        assert any(ref in t.get_text() for t in fig.findobj(mpl.text.Text))
+
+    # the layout follows the data: long tick labels push the axis labels
+    # inwards instead of out of the figure
+    df['pre'] *= 1000
+    df['tmp'] *= 1000
+    for fig in [renderer.annual_cycle(df, filepath=fpath),
+                renderer.time_series(df, filepath=fpath)]:
+        fig.canvas.draw()
+        bbox = fig.bbox
+        for ax in fig.axes:
+            for label in [ax.yaxis.label, ax.xaxis.label]:
+                ext = label.get_window_extent()
+                assert bbox.x0 <= ext.x0 and ext.x1 <= bbox.x1
+
+    # no pyplot figures are left behind
+    assert len(plt.get_fignums()) == nfigs
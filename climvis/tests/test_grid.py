@@ -0,0 +1,69 @@
+import os
+import numpy as np
+import pandas as pd
+import pytest
+from climvis import cfg, core, grid
+
+
+@pytest.fixture
+def cache_dir(tmpdir, monkeypatch):
+    path = str(tmpdir.join('cache'))
+    monkeypatch.setattr(cfg, 'cache_dir', path)
+    monkeypatch.setattr(grid, '_index', None)
+    return path
+
+
+def test_lonlat_to_xyz():
+
+    xyz = grid.lonlat_to_xyz([0, 90, 0], [0, 0, 90])
+    np.testing.assert_allclose(xyz, np.eye(3), atol=1e-12)
+    np.testing.assert_allclose(np.linalg.norm(xyz, axis=1), 1)
+
+
+def test_grid_index():
+
+    lon = np.arange(0.25, 3, 0.5)
+    lat = np.arange(40.25, 42, 0.5)
+    mask = np.ones((len(lat), len(lon)), dtype=bool)
+    mask[:, 0] = False
+    idx = grid.GridIndex(lon, lat, mask)
+
+    ilat, ilon = idx.cell([0.3, 2.9], [40.1, 41.6])
+    np.testing.assert_equal(ilat, [0, 3])
+    np.testing.assert_equal(ilon, [0, 5])
+
+    assert not idx.is_valid(0.3, 40.1)
+    assert idx.is_valid(0.8, 40.1)
+    np.testing.assert_equal(idx.is_valid([0.3, 0.8], [41, 41]),
+                            [False, True])
+
+    assert idx.nearest_valid(0.1, 41.2) == (0.75, 41.25)
+    assert idx.nearest_valid(1.2, 41.2) == (1.25, 41.25)
+
+
+def test_get_grid_index(cache_dir):
+
+    df_cities = pd.read_csv(cfg.world_cities)
+    dfi = df_cities.loc[df_cities.Name.str.contains('innsbruck', case=False,
+                                                    na=False)].iloc[0]
+
+    idx = grid.get_grid_index()
+    assert os.path.exists(os.path.join(cache_dir, 'grid_index.npz'))
+    assert grid.get_grid_index() is idx
+    assert idx.is_valid(dfi.Lon, dfi.Lat)
+    assert not idx.is_valid(47, 12)  # ocean
+
+    # the snapped cell has data
+    lon, lat = idx.nearest_valid(47, 12)
+    df = core.get_cru_timeseries(lon, lat)
+    assert not df.isnull().values.any()
+
+    # read from disk
+    grid._index = None
+    idx2 = grid.get_grid_index()
+    assert idx2 is not idx
+    np.testing.assert_equal(idx2.mask, idx.mask)
+
+    # a stale index is rebuilt
+    idx2.stamp = 'outdated'
+    assert grid.get_grid_index() is not idx2
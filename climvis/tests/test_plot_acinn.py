@@ -1,10 +1,14 @@
 # -*- coding: utf-8 -*-
 
-from climvis import plot_acinn
+import time
+from climvis import acinn_archive, cfg, plot_acinn
+from climvis.tests.conftest import fake_acinn_data
 import numpy as np
+import pandas as pd
 from climvis.read_acinn import AcinnData
 import random
 from bokeh.plotting.figure import Figure
+from bokeh.models import AnnularWedge
 import os
 
 
@@ -42,3 +46,118 @@ def test_plot_both():
 
     outpath = plot_acinn.plot_both('innsbruck', 1)
     assert os.path.exists(outpath)
+
+
+def test_plot_meteo_local(acinn_server):
+
+    # sattelberg has neither dewpoint nor precipitation data
+    for station in ['innsbruck', 'sattelberg']:
+        data = plot_acinn.read_conv_data(station, 1)
+        p1, p2 = plot_acinn.plot_meteo(data, showp=None)
+        assert isinstance(p1, Figure)
+        assert isinstance(p2, Figure)
+
+
+def test_plot_windrose_renderers():
+
+    rng = np.random.RandomState(0)
+    dd = rng.uniform(0, 360, 1008)
+    ff = rng.gamma(2, 1.5, 1008)
+    ff[::10] = 0
+    p = plot_acinn.plot_windrose(dd, ff, showp=None)
+    wedges = [r for r in p.renderers
+              if isinstance(r.glyph, AnnularWedge) and 'outer' in
+              r.data_source.data]
+    # one renderer for all the wedges, with one legend entry per speed
+    assert len(wedges) == 1
+    data = wedges[0].data_source.data
+    assert np.all(data['outer'] > data['inner'])
+    assert len(p.legend[0].items) == 8
+    assert p.legend[0].items[0].label['value'] == 'calm'
+
+
+def test_windrose_table():
+
+    dd = [0, 7, 355, 352, 180, 90, np.nan, 45, 360]
+    ff = [0, 0.5, 2, 4, 12, np.nan, 1, 0.5, 3]
+    tab = plot_acinn.windrose_table(dd, ff)
+    assert tab.shape == (24, 8)
+    assert tab.sum() == 7
+    # 355 and 360 are in the northern sector, 352 is not
+    np.testing.assert_array_equal(tab[0], [1, 1, 1, 1, 0, 0, 0, 0])
+    assert tab[23, 4] == 1
+    assert tab[12, 7] == 1
+    assert tab[3, 1] == 1
+
+    # same as pd.cut
+    rng = np.random.RandomState(0)
+    dd = rng.uniform(0, 360, 1000)
+    ff = rng.gamma(2, 1.5, 1000).round(1)
+    spd_bins = [-1, 0, 1, 2, 3, 5, 7, 10, np.inf]
+    ref = pd.crosstab(pd.cut(dd, np.arange(0, 361, 45), right=False),
+                      pd.cut(ff, spd_bins))
+    tab = plot_acinn.windrose_table(dd, ff, dir_bins=np.arange(0, 361, 45))
+    np.testing.assert_array_equal(tab[:, 1:], ref.values)
+
+    w = rng.uniform(0, 1, 1000)
+    tabw = plot_acinn.windrose_table(dd, ff, dir_bins=8, weights=w)
+    np.testing.assert_allclose(tabw.sum(), w.sum())
+
+    # several stations
+    tabs = plot_acinn.windrose_table([dd, dd[:10]], [ff, ff[:10]], 8)
+    assert tabs.shape == (2, 8, 8)
+    assert tabs[1].sum() == 10
+    np.testing.assert_array_equal(tabs[0],
+                                  plot_acinn.windrose_table(dd, ff, 8))
+
+
+def test_decimate():
+
+    rng = np.random.RandomState(0)
+    x = np.arange(10000)
+    y = np.cumsum(rng.normal(size=10000))
+    y[500] = 1000
+    y[20:30] = np.nan
+    for method in ['minmax', 'lttb']:
+        keep = plot_acinn.decimate(x, y, 200, method=method)
+        assert len(keep) <= 402
+        assert np.all(np.diff(keep) > 0)
+        assert np.all(np.isfinite(y[keep]))
+        # the peaks and the ends are kept
+        assert 500 in keep
+        assert keep[0] == 0 and keep[-1] == 9999
+    assert np.nanmin(y) in y[plot_acinn.decimate(x, y, 200)]
+    assert len(plot_acinn.decimate(x, y, 200, method='lttb')) == 200
+    # short series are not decimated
+    assert len(plot_acinn.decimate(x[:100], y[:100], 200)) == 90
+
+
+def test_plot_meteo_decimated(tmpdir, monkeypatch):
+
+    # two months out of the archive
+    monkeypatch.setattr(cfg, 'acinn_archive_dir', str(tmpdir))
+    end = int(time.mktime((2018, 12, 31, 0, 0, 0, 0, 0, 0)))
+    acinn_archive.get_archive().append(
+        'innsbruck', fake_acinn_data('innsbruck', 61, end=end))
+    data = plot_acinn.read_conv_data('innsbruck', start='2018-11-01')
+    assert len(data.timeutc) > 8000
+
+    def npoints(p):
+        return sum(len(r.data_source.data['x']) for r in p.renderers)
+
+    p1, p2 = plot_acinn.plot_meteo(data)
+    n_all = npoints(p1) + npoints(p2)
+    p1, p2 = plot_acinn.plot_meteo(data, decimation='minmax',
+                                   plot_width=600)
+    assert npoints(p1) <= 2 * 1202
+    assert npoints(p2) <= 2 * 1202
+    assert npoints(p1) + npoints(p2) < n_all / 3
+
+    p1, p2 = plot_acinn.plot_meteo(data, freq='D')
+    assert npoints(p1) == 2 * 61
+
+    daily = data.resample('D')
+    assert len(daily) == 61
+    np.testing.assert_allclose(daily.tl.values[1:-1], 10, atol=0.1)
+    np.testing.assert_allclose(daily.rm.sum(), np.nansum(data.rm))
+    assert daily.dd.between(0, 360).all()
@@ -0,0 +1,116 @@
+import os
+import threading
+import numpy as np
+import xarray as xr
+from climvis import pool
+
+
+def _write_file(path, value=1.):
+    ds = xr.Dataset({'z': (('lat', 'lon'), np.full((2, 3), value))},
+                    coords={'lat': [0., 1.], 'lon': [0., 1., 2.]})
+    ds.to_netcdf(path)
+
+
+def test_pool_reuse(tmpdir):
+
+    fpath = str(tmpdir.join('f1.nc'))
+    _write_file(fpath)
+
+    p = pool.DatasetPool()
+    ds = p.open_dataset(fpath)
+    assert p.open_dataset(fpath) is ds
+    assert fpath in p
+    assert len(p) == 1
+
+    # different kwargs give different handles
+    assert p.open_dataset(fpath, decode_times=False) is not ds
+    assert len(p) == 2
+
+    p.close(fpath)
+    assert len(p) == 0
+    assert fpath not in p
+
+
+def test_pool_lru(tmpdir):
+
+    paths = [str(tmpdir.join('f{}.nc'.format(i))) for i in range(3)]
+    for path in paths:
+        _write_file(path)
+
+    p = pool.DatasetPool(maxsize=2)
+    ds0 = p.open_dataset(paths[0])
+    p.open_dataset(paths[1])
+    p.open_dataset(paths[0])  # 1 is now the least recently used
+    p.open_dataset(paths[2])
+    assert len(p) == 2
+    assert paths[1] not in p
+    assert p.open_dataset(paths[0]) is ds0
+    p.close()
+    assert len(p) == 0
+
+
+def test_pool_evict_while_reading(tmpdir):
+
+    paths = [str(tmpdir.join('f{}.nc'.format(i))) for i in range(3)]
+    for i, path in enumerate(paths):
+        _write_file(path, value=i)
+
+    p = pool.DatasetPool(maxsize=1)
+    opened, evicted = threading.Event(), threading.Event()
+    closed, out = [], []
+
+    def read():
+        ds = p.open_dataset(paths[0], cache=False)
+        close = ds._close
+        ds.set_close(lambda: closed.append(1) or close())
+        opened.set()
+        evicted.wait(10)
+        # the other thread dropped the handle in the meantime
+        out.append(float(ds.z.values.sum()))
+
+    thread = threading.Thread(target=read)
+    thread.start()
+    assert opened.wait(10)
+    p.open_dataset(paths[1])
+    p.open_dataset(paths[2])
+    assert paths[0] not in p
+    evicted.set()
+    thread.join(10)
+    assert out == [0]
+    # the evicted handle was left to the reader
+    assert closed == []
+
+
+def test_pool_refresh(tmpdir):
+
+    fpath = str(tmpdir.join('f1.nc'))
+    _write_file(fpath)
+    st = os.stat(fpath)
+
+    p = pool.DatasetPool()
+    ds = p.open_dataset(fpath)
+
+    # the file changes on disk: the pool notices
+    os.utime(fpath, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    ds2 = p.open_dataset(fpath)
+    assert ds2 is not ds
+    assert p.open_dataset(fpath) is ds2
+    assert len(p) == 1
+
+    # refresh drops the stale handles
+    os.utime(fpath, ns=(st.st_atime_ns, st.st_mtime_ns + 2 * 10**9))
+    p.refresh()
+    assert len(p) == 0
+
+
+def test_file_stamp(tmpdir):
+
+    fpath = str(tmpdir.join('f1.nc'))
+    _write_file(fpath)
+    stamp = pool.file_stamp(fpath)
+    assert 'f1.nc' in stamp
+    assert pool.file_stamp(fpath) == stamp
+
+    st = os.stat(fpath)
+    os.utime(fpath, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    assert pool.file_stamp(fpath) != stamp
@@ -0,0 +1,73 @@
+import os
+import numpy as np
+import pandas as pd
+import xarray as xr
+from matplotlib.image import imread
+from climvis import cfg, core, pool, products, stats
+
+
+def test_build_products(tmpdir, monkeypatch):
+
+    fpath = str(tmpdir.join('products.nc'))
+    monkeypatch.setattr(cfg, 'products_file', fpath)
+    assert not products.is_current()
+    # a small budget, to compute the grid in several slabs
+    assert products._slab_rows(1392, 120, 20 * 2**20) < 100
+    assert products.build_products(max_bytes=20 * 2**20) == fpath
+    assert products.is_current()
+
+    ds = pool.open_dataset(fpath)
+    assert ds.tmp_clim.dims == ('month', 'lat', 'lon')
+    assert ds.tmp_trend.dims == ('lat', 'lon')
+    assert ds.attrs['climatology_period'] == '1981-2010'
+
+    # same values as the statistics of the time series
+    df = core.get_cru_timeseries(11.38, 47.26)
+    vals = products.point_values(11.38, 47.26)
+    clim = stats.climatology(df.tmp.values, df.index.values)
+    np.testing.assert_allclose(vals['tmp_annual'], clim.mean(), rtol=1e-5)
+    clim = stats.climatology(df.pre.values, df.index.values)
+    np.testing.assert_allclose(vals['pre_annual'], clim.mean(), rtol=1e-5)
+    trend = stats.annual_trend(df.tmp.values, df.index.values)
+    np.testing.assert_allclose(vals['tmp_trend'], trend.slope * 10,
+                               rtol=1e-4)
+    np.testing.assert_allclose(vals['tmp_trend_pvalue'], trend.pvalue,
+                               rtol=1e-3, atol=1e-10)
+
+    # no values over the ocean
+    assert np.isnan(products.point_values(47, 12)['tmp_trend'])
+
+    # outdated files are rebuilt
+    ds.attrs['source_stamp'] = 'outdated'
+    assert not products.is_current()
+    pool.close(fpath)
+
+
+def test_point_values_grid(tmpdir):
+
+    # a products file on another grid than the CRU files
+    names = ['tmp_annual', 'pre_annual', 'tmp_trend', 'tmp_trend_pvalue',
+             'tmp_trend_stderr']
+    values = np.arange(6.).reshape(2, 3)
+    ds = xr.Dataset({n: (('lat', 'lon'), values + i)
+                     for i, n in enumerate(names)},
+                    coords={'lat': [40., 50.], 'lon': [0., 10., 20.]},
+                    attrs={'source_stamp': products._source_stamp()})
+    fpath = str(tmpdir.join('coarse.nc'))
+    ds.to_netcdf(fpath)
+    vals = products.point_values(11.38, 47.26, path=fpath)
+    assert vals['tmp_annual'] == 4
+    assert vals['tmp_trend_stderr'] == 8
+    pool.close(fpath)
+
+
+def test_render_maps(tmpdir, monkeypatch):
+
+    monkeypatch.setattr(cfg, 'products_file', str(tmpdir.join('p.nc')))
+    paths = products.render_maps(str(tmpdir.join('maps')))
+    assert [os.path.basename(p) for p in paths] == ['tmp_annual.png',
+                                                    'pre_annual.png',
+                                                    'tmp_trend.png']
+    for path in paths:
+        assert imread(path).shape[:2] == (500, 800)
+    pool.close(cfg.products_file)
@@ -1,6 +1,10 @@
 # -*- coding: utf-8 -*-
 
+import time
+from climvis import cfg, read_acinn
 from climvis.read_acinn import AcinnData
+import numpy as np
+import pandas as pd
 import pytest
 
 
@@ -42,9 +46,176 @@ def test_conv_date():
     data.get_data()
     data.conv_raw()
     data.conv_date()
-    assert isinstance(data.timeutc, list)
+    assert isinstance(data.timeutc, pd.DatetimeIndex)
 
     data = AcinnData(7, 'innsbruck')
     with pytest.raises(Exception) as excinfo:
         data.conv_date()
     assert 'you might have called get_data method first' in str(excinfo.value)
+
+
+def test_get_data_local(acinn_server):
+
+    data = AcinnData(1, 'innsbruck')
+    data.get_data()
+    assert len(data.raw_data['datumsec']) == 144
+    assert acinn_server.requests == ['/innsbruck/1']
+
+    data = AcinnData(7, 'muenchen')
+    with pytest.raises(Exception) as excinfo:
+        data.get_data()
+    assert 'could not read from URL' in str(excinfo.value)
+    # client errors are not retried
+    assert acinn_server.requests[-1] == '/muenchen/7'
+    assert len(acinn_server.requests) == 2
+
+
+def test_get_data_retries(acinn_server):
+
+    acinn_server.fail = 2
+    data = AcinnData(1, 'innsbruck')
+    data.get_data(retries=2, cache=False)
+    assert len(data.raw_data['datumsec']) == 144
+    assert len(acinn_server.requests) == 3
+
+    acinn_server.fail = 2
+    with pytest.raises(Exception, match='could not read from URL'):
+        data.get_data(retries=1, cache=False)
+
+    # timeouts
+    acinn_server.delay = 0.5
+    with pytest.raises(Exception, match='could not read from URL'):
+        data.get_data(timeout=0.1, retries=0, cache=False)
+
+
+def test_fetch_stations(acinn_server):
+
+    acinn_server.delay = 0.3
+    t0 = time.time()
+    out = read_acinn.fetch_stations(timespan=3)
+    # concurrent requests
+    assert time.time() - t0 < 4 * 0.3
+    assert list(out) == read_acinn.STATIONS
+    for station, data in out.items():
+        assert data.station == station
+        assert len(data.raw_data['datumsec']) == 3 * 144
+
+    out = read_acinn.fetch_stations(['innsbruck', 'muenchen'], timespan=1,
+                                    max_workers=1)
+    assert isinstance(out['innsbruck'], AcinnData)
+    assert isinstance(out['muenchen'], Exception)
+
+
+def test_fetch_stations_keep_alive(acinn_server, monkeypatch):
+
+    stations = ['innsbruck', 'ellboegen']
+    read_acinn.fetch_stations(stations, timespan=1)
+    assert len(acinn_server.requests) == 2
+    connections = acinn_server.connections
+    assert connections <= 2
+
+    # the connections outlive the worker threads of the first call
+    monkeypatch.setattr(read_acinn, '_cache', None)
+    out = read_acinn.fetch_stations(stations, timespan=1)
+    assert len(acinn_server.requests) == 4
+    assert acinn_server.connections == connections
+    assert all(isinstance(d, AcinnData) for d in out.values())
+
+
+def test_cache(acinn_server, tmpdir):
+
+    acinn_server.end = int(time.time()) // 600 * 600
+    cache = read_acinn.AcinnCache(directory=str(tmpdir))
+    data = cache.get('innsbruck', 7)
+    assert len(data['datumsec']) == 7 * 144
+    assert cache.get('innsbruck', 7) == data
+    assert len(acinn_server.requests) == 1
+
+    # the shorter timespans are sliced out of the cached data
+    data1 = cache.get('innsbruck', 1)
+    assert len(acinn_server.requests) == 1
+    assert data1['datumsec'] == data['datumsec'][-144:]
+    assert data1['tl'] == data['tl'][-144:]
+
+    # the command line gives the timespan as a string
+    assert cache.get('innsbruck', '1') == data1
+    assert len(acinn_server.requests) == 1
+
+    # modifying the output doesn't change the cache
+    data1['tl'][0] = -999
+    assert cache.get('innsbruck', 1)['tl'][0] != -999
+
+    # the entry expires with the next measurement
+    entry = cache._entries[('innsbruck', 7)]
+    assert entry['expires'] > time.time()
+    assert entry['expires'] <= acinn_server.end + 600 + cfg.acinn_cache_lag
+
+    # stale entries are revalidated
+    entry['expires'] = 0
+    assert cache.get('innsbruck', 7) == data
+    assert len(acinn_server.requests) == 2
+    assert cache._entries[('innsbruck', 7)]['expires'] > time.time()
+
+    # the disk store is shared
+    cache2 = read_acinn.AcinnCache(directory=str(tmpdir))
+    assert cache2.get('innsbruck', 3) == cache.get('innsbruck', 3)
+    assert len(acinn_server.requests) == 2
+
+    # servers without ETags
+    acinn_server.etags = False
+    cache2._entries[('innsbruck', 7)]['expires'] = 0
+    cache2.get('innsbruck', 7)
+    assert len(acinn_server.requests) == 3
+
+    cache2.clear()
+    assert cache2._entries == {}
+    cache3 = read_acinn.AcinnCache(directory=str(tmpdir))
+    cache3.get('innsbruck', 7)
+    assert len(acinn_server.requests) == 4
+
+
+def test_get_data_cache(acinn_server):
+
+    AcinnData(7, 'innsbruck').get_data()
+    data = AcinnData(1, 'innsbruck')
+    data.get_data()
+    assert len(data.raw_data['datumsec']) == 144
+    assert len(acinn_server.requests) == 1
+    data.get_data(cache=False)
+    assert len(acinn_server.requests) == 2
+
+
+def test_columns(acinn_server):
+
+    data = AcinnData(1, 'innsbruck')
+    data.get_data()
+    data.raw_data['tl'][3] = None
+    data.conv_raw()
+    data.conv_date()
+    data.conv_units()
+    assert isinstance(data.tl, np.ndarray)
+    assert np.isnan(data.tl[3])
+    assert data.time.tz is not None
+    assert (data.timeutc == data.time.tz_convert(None)).all()
+    np.testing.assert_allclose(data.kmwind, data.ff * 3.6)
+    np.testing.assert_allclose(data.crm, np.cumsum(data.rr / 6))
+    assert data.crm[-1] > 0
+
+    df = data.to_dataframe()
+    assert len(df) == 144
+    assert df.index.is_monotonic_increasing
+    for c in ['tl', 'tp', 'rr', 'dd', 'ff', 'kmwind', 'crm', 'sop']:
+        assert c in df
+
+    # sattelberg doesn't measure dewpoint and precipitation
+    data = AcinnData(1, 'sattelberg')
+    data.get_data()
+    data.conv_raw()
+    data.conv_date()
+    data.conv_units()
+    assert 'tp' not in data.keys and 'rm' not in data.keys
+    assert np.isnan(data.tp).all() and len(data.tp) == 144
+    assert np.isnan(data.crm).all()
+    assert 'tp' not in data.to_dataframe()
+    with pytest.raises(AttributeError):
+        data.nonsense
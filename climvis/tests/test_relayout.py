@@ -0,0 +1,37 @@
+import numpy as np
+import pandas as pd
+from climvis import cfg, core, pool, relayout
+
+
+def test_convert_cru(tmpdir, monkeypatch):
+
+    df_cities = pd.read_csv(cfg.world_cities)
+    dfi = df_cities.loc[df_cities.Name.str.contains('innsbruck', case=False,
+                                                    na=False)].iloc[0]
+
+    fpath = str(tmpdir.join('point.nc'))
+    monkeypatch.setattr(cfg, 'cru_point_file', fpath)
+    assert not relayout.is_current()
+    assert core._cru_files()[0] == cfg.cru_tmp_file
+    ref = core.get_cru_timeseries(dfi.Lon, dfi.Lat)
+
+    assert relayout.convert_cru(chunk=3) == fpath
+    assert relayout.is_current()
+    assert core._cru_files() == (fpath, fpath, fpath)
+
+    ds = pool.open_dataset(fpath)
+    assert ds.tmp.encoding['chunksizes'] == (ds.sizes['time'], 3, 3)
+    assert ds.z.dims == ('lat', 'lon')
+
+    # same data as from the original files
+    df = core.get_cru_timeseries(dfi.Lon, dfi.Lat)
+    np.testing.assert_allclose(df.tmp, ref.tmp)
+    np.testing.assert_allclose(df.pre, ref.pre)
+    assert df.index.equals(ref.index)
+    assert df.lon[0] == ref.lon[0]
+    assert df.grid_point_elevation == ref.grid_point_elevation
+
+    # outdated files are ignored
+    ds.attrs['source_stamp'] = 'outdated'
+    assert not relayout.is_current()
+    pool.close(fpath)
@@ -0,0 +1,88 @@
+import os
+import time
+import pytest
+from climvis import cfg, core, grid, reportcache
+
+
+@pytest.fixture
+def cache_dir(tmpdir, monkeypatch):
+    path = str(tmpdir.join('cache'))
+    monkeypatch.setattr(cfg, 'cache_dir', path)
+    monkeypatch.setattr(grid, '_index', None)
+    return path
+
+
+def _make_entry(cache, key, size, age):
+    path = cache.entry(key)
+    os.makedirs(path)
+    with open(os.path.join(path, 'f.png'), 'wb') as f:
+        f.write(b'0' * size)
+    t = time.time() - age
+    os.utime(path, (t, t))
+
+
+def test_evict(tmpdir):
+
+    cache = reportcache.ReportCache(str(tmpdir.join('reports')))
+    assert cache.entries() == []
+    _make_entry(cache, 'old', 10, 1000)
+    _make_entry(cache, 'mid', 10, 500)
+    _make_entry(cache, 'new', 10, 0)
+    assert [e[0] for e in cache.entries()] == ['old', 'mid', 'new']
+    assert cache.evict() == []
+
+    cache.max_age = 800
+    assert cache.evict() == ['old']
+    cache.max_bytes = 15
+    assert cache.evict() == ['mid']
+    assert [e[0] for e in cache.entries()] == ['new']
+
+    # used entries are kept
+    _make_entry(cache, 'other', 10, 100)
+    cache.touch('other')
+    assert cache.evict() == ['new']
+
+    cache.clear()
+    assert cache.entries() == []
+
+
+def test_key(cache_dir):
+
+    cache = reportcache.get_report_cache()
+    assert cache.directory == os.path.join(cache_dir, 'reports')
+    key = cache.key(11.25, 47.25, 8)
+    assert cache.key(11.25, 47.25, 8) == key
+    assert cache.key(11.75, 47.25, 8) != key
+    assert cache.key(11.25, 47.25, 9) != key
+
+
+def test_write_html_cache(cache_dir):
+
+    path = core.write_html(11.4, 47.27, cache=True)
+    assert path.startswith(os.path.join(cache_dir, 'reports'))
+    png = os.path.join(os.path.dirname(path), 'annual_cycle.png')
+    mtime = os.stat(png).st_mtime_ns
+
+    # same request
+    assert core.write_html(11.4, 47.27, cache=True) == path
+
+    # same grid cell: the figures are reused
+    path2 = core.write_html(11.3, 47.3, cache=True)
+    assert path2 != path
+    assert os.path.dirname(path2) == os.path.dirname(path)
+    assert os.stat(png).st_mtime_ns == mtime
+    with open(path2) as f:
+        assert '(11.300E, 47.300N)' in f.read()
+
+    # other zoom level, other cell, no cache
+    assert os.path.dirname(core.write_html(11.4, 47.27, zoom=3,
+                                           cache=True)) != \
+        os.path.dirname(path)
+    assert os.path.dirname(core.write_html(12.4, 47.27, cache=True)) != \
+        os.path.dirname(path)
+    # not cached by default
+    path3 = core.write_html(11.4, 47.27)
+    assert not path3.startswith(cache_dir)
+
+    with pytest.raises(ValueError, match='No data available over the ocean'):
+        core.write_html(47, 12)
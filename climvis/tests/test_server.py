@@ -0,0 +1,130 @@
+import os
+import time
+import asyncio
+import threading
+from urllib.request import urlopen
+from urllib.error import HTTPError
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+from climvis import server
+
+
+@pytest.fixture(scope='module')
+def url():
+    srv = server.ReportServer(port=0, workers=1)
+    loop = asyncio.new_event_loop()
+    loop.run_until_complete(srv.start())
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    yield 'http://127.0.0.1:{}'.format(srv.port)
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join()
+    srv.close()
+
+
+def test_loc(url):
+
+    with urlopen(url + '/loc?lon=11.4&lat=47.27') as r:
+        assert r.status == 200
+        assert '/files/' in r.url
+        html = r.read().decode()
+    assert 'Climate visualization' in html
+    assert '(11.400E, 47.270N)' in html
+
+    # the figures are served too
+    png = r.url.rsplit('/', 1)[0] + '/annual_cycle.png'
+    with urlopen(png) as r:
+        assert r.headers['Content-Type'] == 'image/png'
+
+    with urlopen(url + '/city?name=Innsbruck') as r:
+        assert 'Innsbruck' in r.read().decode()
+
+
+def test_errors(url):
+
+    def status(path):
+        with pytest.raises(HTTPError) as excinfo:
+            urlopen(url + path)
+        return excinfo.value.code, excinfo.value.read().decode()
+
+    assert status('/loc?lon=47&lat=12') == (
+        404, 'No data available over the ocean. Try for different location!')
+    assert status('/loc?lon=11.4')[0] == 400
+    assert status('/loc?lon=11.4&lat=x')[0] == 400
+    code, msg = status('/city?name=Insbruck')
+    assert code == 404
+    assert 'Did you mean: Innsbruck' in msg
+    code, msg = status('/meteo?station=xxx&duration=1')
+    assert code == 400
+    assert 'Unknown station: xxx' in msg
+    assert status('/files/xxx/index.html')[0] == 404
+    assert status('/nothing')[0] == 404
+
+
+def test_coalesce():
+
+    calls = []
+
+    def slow(x):
+        calls.append(x)
+        time.sleep(0.2)
+        return x * 2
+
+    srv = server.ReportServer(executor=ThreadPoolExecutor(4))
+
+    async def main():
+        return await asyncio.gather(srv.run('a', slow, 1),
+                                    srv.run('a', slow, 1),
+                                    srv.run('b', slow, 2))
+
+    assert asyncio.run(main()) == [2, 2, 4]
+    assert sorted(calls) == [1, 2]
+    assert srv._inflight == {}
+    srv.close()
+
+
+def test_broken_workers():
+
+    srv = server.ReportServer(workers=1)
+    broken = srv.executor
+
+    async def main():
+        # the worker dies
+        with pytest.raises(server.HTTPError) as excinfo:
+            await srv.run('a', os._exit, 1)
+        assert excinfo.value.status == 500
+        # the next requests get a new one
+        return await srv.run('b', abs, -2)
+
+    assert asyncio.run(main()) == 2
+    assert srv.executor is not broken
+    srv.close()
+
+
+def test_meteo_files(acinn_server, tmpdir):
+
+    srv = server.ReportServer(executor=ThreadPoolExecutor(2),
+                              max_directories=2)
+    target = '/meteo?station=innsbruck&duration=1'
+    status, location = asyncio.run(srv.handle('GET', target))
+    assert status == 303
+    # the same file is rewritten by the next request
+    assert asyncio.run(srv.handle('GET', target)) == (status, location)
+    parts = location.split('/')[2:]
+    path = os.path.join(srv._directories[parts[0]], parts[1])
+    assert path.startswith(srv.meteo_dir)
+    assert srv._serve_file(parts)[1] == 'text/html'
+
+    # the map of the served directories is bounded
+    dirs = [str(tmpdir.mkdir(d)) for d in 'abc']
+    urls = [srv._file_url(os.path.join(d, 'index.html')) for d in dirs]
+    assert list(srv._directories.values()) == dirs[1:]
+    # and forgets the directories which were removed
+    os.rmdir(dirs[2])
+    token = urls[2].split('/')[2]
+    with pytest.raises(server.HTTPError):
+        srv._serve_file([token, 'index.html'])
+    assert token not in srv._directories
+
+    srv.close()
+    assert not os.path.exists(srv.meteo_dir)
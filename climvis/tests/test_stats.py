@@ -0,0 +1,84 @@
+import numpy as np
+import pandas as pd
+import xarray as xr
+from scipy import stats as sstats
+import pytest
+from climvis import cfg, core, pool, stats
+
+
+def _monthly(nsites=5, start='1901-01', nmonths=1392, seed=0):
+    rng = np.random.RandomState(seed)
+    time = pd.date_range(start, periods=nmonths, freq='MS') + \
+        pd.Timedelta('15D')
+    data = (10 + 10 * np.sin(np.arange(nmonths) / 12 * 2 * np.pi)[:, None] +
+            np.arange(nmonths)[:, None] * rng.uniform(0, 0.002, nsites) +
+            rng.normal(size=(nmonths, nsites)))
+    return data, time.values
+
+
+def test_climatology_annual_means():
+
+    data, time = _monthly()
+    years, by_year = stats.by_year(data, time)
+    assert by_year.shape == (116, 12, 5)
+    assert years[0] == 1901 and years[-1] == 2016
+
+    clim = stats.climatology(data, time)
+    df = pd.DataFrame(data, index=time).loc['1981':'2010']
+    ref = df.groupby(df.index.month).mean()
+    np.testing.assert_allclose(clim, ref.values)
+
+    years, means = stats.annual_means(data, time)
+    ref = pd.DataFrame(data, index=time).groupby(time.astype(
+        'datetime64[Y]')).mean()
+    np.testing.assert_allclose(means, ref.values)
+
+    # incomplete years are left out
+    years, by_year = stats.by_year(data[1:-1], time[1:-1])
+    assert by_year.shape == (114, 12, 5)
+    assert years[0] == 1902
+    with pytest.raises(ValueError):
+        stats.by_year(data[::2], time[::2])
+
+
+def test_linear_trend():
+
+    data, time = _monthly()
+    years, means = stats.annual_means(data, time)
+    trend = stats.annual_trend(data, time)
+    for i in range(data.shape[1]):
+        ref = sstats.linregress(years, means[:, i])
+        np.testing.assert_allclose([t[i] for t in trend], ref, rtol=1e-8)
+
+    trend = stats.annual_trend(data, time, period=('1950', '2000'))
+    ref = sstats.linregress(years[49:100], means[49:100, 0])
+    np.testing.assert_allclose([t[0] for t in trend], ref, rtol=1e-8)
+
+    # missing data stays missing
+    data[:, 2] = np.nan
+    trend = stats.annual_trend(data, time)
+    assert np.isnan(trend.slope[2]) and np.isfinite(trend.slope[1])
+
+
+def test_grid_slab():
+
+    # a slab of the CRU grid, as DataArray
+    da = pool.open_dataset(cfg.cru_tmp_file).tmp.isel(lat=slice(60, 70))
+    clim = stats.climatology(da)
+    assert clim.dims == ('month', 'lat', 'lon')
+    ref = da.sel(time=slice('1981', '2010')).groupby('time.month').mean()
+    np.testing.assert_allclose(clim, ref.transpose('month', 'lat', 'lon'),
+                               atol=1e-4)
+
+    trend = stats.annual_trend(da)
+    assert trend.slope.dims == ('lat', 'lon')
+    j, i = np.argwhere(np.isfinite(trend.slope.values))[0]
+    years, means = stats.annual_means(da)
+    ref = sstats.linregress(years, means[:, j, i])
+    np.testing.assert_allclose(trend.slope[j, i], ref.slope, rtol=1e-5)
+
+    # sites of a batch extraction keep their coordinates
+    ds = core.get_cru_timeseries_batch([11.4, 12], [47.27, 47])
+    clim = stats.climatology(ds.tmp)
+    assert clim.dims == ('month', 'site')
+    assert 'lon' in clim.coords
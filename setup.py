@@ -178,7 +178,10 @@ setup(
     # Similar to `install_requires` above, these must be valid existing
     # projects.
     extras_require={  # Optional
-        'test': ['pytest'],
+        # with the dependencies of the chunked reading, which is tested too
+        'test': ['pytest', 'dask[array]', 'distributed'],
+        # chunked reading of the CRU files, see climvis.cfg.dask_chunks
+        'dask': ['dask[array]', 'distributed'],
     },
 
     # If there are data files included in your packages that need to be